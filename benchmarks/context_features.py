@@ -0,0 +1,45 @@
+# benchmark: wall time and peak memory of build_context_features, per season
+#
+#   python -m benchmarks.context_features --table vaep --n-prev 5 10
+#
+# the n-k_* columns already stored in the table are dropped and rebuilt from the base actions of each season
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+import feature_engineering
+import load_data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--table', default='vaep', choices=['vaep', 'vaep_test', 'xt', 'xt_test'])
+    parser.add_argument('--n-prev', type=int, nargs='+', default=[5, 10])
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+    actions = tables[args.table]
+    games = pd.concat([tables.games, tables.games_test]).drop_duplicates('game_id')
+
+    base = actions[[col for col in actions.columns if not col.startswith('n-')]]
+    season_ids = base['game_id'].map(games.set_index('game_id')['season_id'])
+
+    print(f"{'season':>8} {'rows':>10} {'n_prev':>7} {'seconds':>9} {'peak MB':>9} {'columns':>8}")
+    for season_id, season_actions in base.groupby(season_ids, sort=True):
+        for n_prev in args.n_prev:
+            tracemalloc.start()
+            start = time.perf_counter()
+            context = feature_engineering.build_context_features(season_actions, n_prev=n_prev)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+
+            print(f'{season_id:>8} {len(season_actions):>10,} {n_prev:>7} {seconds:>9.3f} {peak:>9.1f} {context.shape[1]:>8}')
+            del context
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# benchmark: memory of the vaep / xt tables with the compact feature_schema dtypes, and the change in model score
+#
+#   python -m benchmarks.dtype_schema --team-id 965
+#
+# the four Notebook 6 team pipelines are fitted on the default (csv) and on the compact tables and scored on the test set
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.preprocessing import LabelEncoder
+
+import load_data
+import pre_processing_utils as ppu
+import team_training
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--team-id', type=int, default=965)
+    args = parser.parse_args()
+
+    # the csv tables as the notebooks load them today
+    default = dict(zip(load_data.TABLES, load_data.load_data(args.mode)))
+    start = time.perf_counter()
+    compact = load_data.load_tables(args.mode, compact=True)
+    for table in load_data.ACTION_TABLES:
+        compact[table]
+    compact_seconds = time.perf_counter() - start
+
+    print(f"{'table':>10} {'rows':>9} {'default MB':>11} {'compact MB':>11} {'reduction':>10}")
+    for table in load_data.ACTION_TABLES:
+        default_mb = default[table].memory_usage(deep=True).sum() / 1024 ** 2
+        compact_mb = compact[table].memory_usage(deep=True).sum() / 1024 ** 2
+        print(f'{table:>10} {len(default[table]):>9,} {default_mb:>11.1f} {compact_mb:>11.1f} '
+              f'{1 - compact_mb / default_mb:>10.0%}')
+    print(f'compact load (incl. conversion): {compact_seconds:.2f}s')
+
+    print(f"\n{'mode':>12} {'default':>9} {'compact':>9}   (team {args.team_id}, R^2 / accuracy)")
+    for mode in team_training.TEAM_MODES:
+        scores = [_score(tables, mode, args.team_id) for tables in (default, compact)]
+        print(f'{mode:>12} {scores[0]:>9.4f} {scores[1]:>9.4f}')
+
+
+def _score(tables, mode, team_id):
+    table = ppu.MODE_TABLES[mode]
+    X_train, y_train, X_test, y_test = ppu.create_team_data('team_id', team_id, tables[table], tables[f'{table}_test'],
+                                                            ppu.MODE_TARGETS[mode])
+    pipeline = team_training.make_team_pipeline(mode)
+    if mode in ('team-action', 'team-end'):
+        label_encoder = LabelEncoder().fit(np.asarray(y_train))
+        pipeline.fit(X_train, label_encoder.transform(np.asarray(y_train)))
+        return accuracy_score(np.asarray(y_test), label_encoder.inverse_transform(pipeline.predict(X_test)))
+    pipeline.fit(X_train, y_train)
+    return r2_score(y_test, pipeline.predict(X_test))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# benchmark: csv loading vs the columnar cache in load_data
+#
+# run from the repository root, e.g.
+#   python -m benchmarks.load_data_cache --mode local
+#
+# every scenario runs in a fresh interpreter so the wall time and the peak RSS are not polluted by the previous one
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = {
+    'csv':         "load_data.load_data(mode)",
+    'cache-cold':  "load_data.load_data(mode, cache=True, cache_dir=cache_dir)",
+    'cache-warm':  "load_data.load_data(mode, cache=True, cache_dir=cache_dir)",
+    'cache-lazy':  "t = load_data.load_tables(mode, cache_dir=cache_dir); t.vaep; t.games; t.target_players",
+}
+
+
+def run_scenario(scenario, mode, cache_dir):
+    """
+    Run one scenario in this process and print its timings as json
+    """
+    import load_data
+
+    start = time.perf_counter()
+    exec(SCENARIOS[scenario], {'load_data': load_data, 'mode': mode, 'cache_dir': cache_dir})
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KB on linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'scenario': scenario, 'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args.scenario, args.mode, args.cache_dir)
+        return
+
+    cache_dir = tempfile.mkdtemp(prefix='load_data_cache_')
+    results = {scenario: [] for scenario in SCENARIOS}
+    try:
+        for _ in range(args.repeat):
+            # cold starts from an empty cache, the other scenarios reuse the one it writes
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            for scenario in SCENARIOS:
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.load_data_cache', '--mode', args.mode,
+                     '--scenario', scenario, '--cache-dir', cache_dir],
+                    check=True, capture_output=True, text=True, cwd=os.getcwd())
+                results[scenario].append(json.loads(out.stdout.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"{'scenario':<12} {'best (s)':>10} {'median (s)':>11} {'peak RSS (MB)':>14}")
+    for scenario, runs in results.items():
+        seconds = sorted(run['seconds'] for run in runs)
+        rss = max(run['peak_rss_mb'] for run in runs)
+        print(f'{scenario:<12} {seconds[0]:>10.3f} {seconds[len(seconds) // 2]:>11.3f} {rss:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# benchmark: GridSearchCV vs successive halving (+ XGBoost early stopping) on one team's Notebook 5 grid
+#
+#   python -m benchmarks.model_search --team-id 1475 --jobs -1
+#
+# reports the wall time of both searches and how many of the grid search's top candidates the halving search ranks
+# in its own top - the full grid takes hours, use --max-depth to shrink it for a quick run
+import argparse
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import xgboost as xgb
+from sklearn.decomposition import PCA
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+
+import load_data
+import model_search
+import pre_processing_utils as ppu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--team-id', type=int, default=1475)
+    parser.add_argument('--max-depth', type=int, nargs='+', default=[2, 4, 6, 8, 10])
+    parser.add_argument('--jobs', type=int, default=-1)
+    parser.add_argument('--top', type=int, default=5, help='size of the top of the ranking to compare')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+    X_train, y_train, _, _ = ppu.create_team_data('team_id', args.team_id, tables.vaep, tables.vaep_test, 'vaep_value')
+
+    # the Notebook 5 grids
+    param_grid = [
+        {
+            'model': [RandomForestRegressor(random_state=1, n_jobs=-1)],
+            'model__max_depth': args.max_depth,
+            'model__max_features': [None, 'sqrt'],
+            'model__n_estimators': list(range(80, 150, 20)),
+            },
+        {
+            'model': [xgb.XGBRegressor(random_state=1)],
+            'model__max_depth': args.max_depth,
+            'model__gamma': [0.01, 0.1, 1],
+            'model__eta': [0.1, 0.3],
+            'model__reg_alpha': [0, 1.1],
+            },
+        ]
+
+    cachedir = tempfile.mkdtemp()
+    estimator = Pipeline([('preprocessor', ppu.make_ct('team-vaep')), ('dim_reducer', PCA()),
+                          ('model', LinearRegression())], memory=cachedir)
+
+    start = time.perf_counter()
+    grid = GridSearchCV(estimator, param_grid, cv=5, n_jobs=args.jobs).fit(X_train, y_train)
+    grid_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    halving = model_search.halving_search(estimator, param_grid, X_train, y_train, cv=5, n_jobs=args.jobs)
+    halving_seconds = time.perf_counter() - start
+
+    shutil.rmtree(cachedir)
+
+    grid_results = pd.DataFrame(grid.cv_results_).sort_values('rank_test_score')
+    halving_results = pd.DataFrame(halving.cv_results_)
+    # only the candidates of the last round were scored on all the data
+    last_round = halving_results[halving_results['iter'] == halving_results['iter'].max()]
+    halving_top = last_round.sort_values('mean_test_score', ascending=False)['params'].map(_describe)
+
+    grid_top = grid_results['params'].map(_describe).head(args.top)
+    overlap = len(set(grid_top) & set(halving_top.head(args.top)))
+
+    print(f'team {args.team_id}: {len(X_train):,} rows, {len(grid_results)} candidates')
+    print(f'GridSearchCV:  {grid_seconds:.1f}s  best {_describe(grid.best_params_)}  score {grid.best_score_:.4f}')
+    print(f'halving:       {halving_seconds:.1f}s  best {_describe(halving.best_params_)}  '
+          f'candidates per round {halving.n_candidates_}')
+    print(f'same best candidate: {_describe(grid.best_params_) == _describe(halving.best_params_)}  '
+          f'top {args.top} overlap: {overlap}/{min(args.top, len(halving_top))}')
+
+
+def _describe(params):
+    # the model objects differ between the searches (n_jobs, early stopping), compare them by class name
+    return tuple(sorted((name, type(value).__name__.replace('EarlyStopping', '') if hasattr(value, 'get_params') else value)
+                        for name, value in params.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# check + benchmark: opponent_id / home from the games table vs the list comprehensions in Notebook 2
+#
+#   python -m benchmarks.opponent_id
+#
+# recomputes both columns for every actions table in data/ and compares them with the values stored in the csv files
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering
+import load_data
+
+
+def notebook_opponent_and_home(df, df_games):
+    """
+    The opponent / home comprehensions from Notebook 2, kept here as the reference implementation
+    """
+    matches = list(df['game_id'].unique())
+    match_teams = {match: list(df[df['game_id'] == match]['team_id'].unique()) for match in matches}
+    opponent_id = [match_teams[k][1] if match_teams[k][0] == row['team_id'] else match_teams[k][0] \
+        for i, row in df.iterrows() \
+            for k, v in match_teams.items() \
+                if row['game_id'] == k]
+    home = [1 if np.array(df_games[df_games.index == row['game_id']]['home_team_id'] == row['team_id'])[0] \
+        else 0 for i, row in df.iterrows() \
+            for match in matches if row['game_id'] == match]
+    return opponent_id, home
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--loop-games', type=int, default=5, help='number of games to time the notebook version on')
+    args = parser.parse_args()
+
+    xt, xt_test, vaep, vaep_test, games, games_test, players, players_test, target_players = load_data.load_data(args.mode)
+    all_games = pd.concat([games, games_test]).drop_duplicates('game_id')
+
+    failed = False
+    for name, df in (('vaep', vaep), ('vaep_test', vaep_test), ('xt', xt), ('xt_test', xt_test)):
+        actions = df[['game_id', 'team_id']].copy()
+
+        start = time.perf_counter()
+        feature_engineering.add_opponent_and_home(actions, all_games)
+        seconds = time.perf_counter() - start
+
+        opponent_mismatches = int((actions['opponent_id'] != df['opponent_id']).sum())
+        home_mismatches = int((actions['home'] != df['home']).sum())
+        failed |= bool(opponent_mismatches or home_mismatches)
+
+        # time the notebook version on a few games and extrapolate - it grows with rows x games
+        sample_games = df['game_id'].unique()[:args.loop_games]
+        sample = df[df['game_id'].isin(sample_games)]
+        start = time.perf_counter()
+        notebook_opponent_and_home(sample, all_games.set_index('game_id'))
+        loop_seconds = (time.perf_counter() - start) * (len(df) / len(sample)) * (df['game_id'].nunique() / len(sample_games))
+
+        print(f'{name:<10} rows={len(df):>8,}  opponent_id mismatches={opponent_mismatches}  home mismatches={home_mismatches}  '
+              f'join={seconds:.3f}s  notebook (estimated)={loop_seconds:.1f}s')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
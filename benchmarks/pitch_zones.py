@@ -0,0 +1,92 @@
+# benchmark: vectorised pitch zone assignment vs the iterrows loop from Notebook 2
+#
+#   python -m benchmarks.pitch_zones --rows 1000000
+#
+# the loop is only timed on a sample (--loop-rows) and extrapolated, running it over a million rows takes minutes
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import pitch_zones
+
+
+def notebook_zones(df, x_col, y_col):
+    """
+    The zone loop from Notebook 2, kept here as the reference implementation
+    """
+    zones = []
+    for i, row in df.iterrows():
+        if ((row[x_col] >=0) & (row[x_col] < 35)) & ((row[y_col]>=0) & (row[y_col] < 23)):
+            zones.append('zone_1')
+        elif ((row[x_col] >=0) & (row[x_col] < 35)) & ((row[y_col]>=23) & (row[y_col] < 46)):
+            zones.append('zone_2')
+        elif ((row[x_col] >=0) & (row[x_col] < 35)) & ((row[y_col]>=46) & (row[y_col] <= 69)):
+            zones.append('zone_3')
+        elif ((row[x_col] >=35) & (row[x_col] < 70)) & ((row[y_col]>=0) & (row[y_col] < 23)):
+            zones.append('zone_4')
+        elif ((row[x_col] >=35) & (row[x_col] < 70)) & ((row[y_col]>=23) & (row[y_col] < 46)):
+            zones.append('zone_5')
+        elif ((row[x_col] >=35) & (row[x_col] < 70)) & ((row[y_col]>=46) & (row[y_col] <= 69)):
+            zones.append('zone_6')
+        elif ((row[x_col] >=70) & (row[x_col] <= 105)) & ((row[y_col]>=0) & (row[y_col] < 23)):
+            zones.append('zone_7')
+        elif ((row[x_col] >=70) & (row[x_col] <= 105)) & ((row[y_col]>=23) & (row[y_col] < 46)):
+            zones.append('zone_8')
+        elif ((row[x_col] >=70) & (row[x_col] <= 105)) & ((row[y_col]>=46) & (row[y_col] <= 69)):
+            zones.append('zone_9')
+        else:
+            zones.append('no_zone')
+    return zones
+
+
+def make_actions(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'start_x': rng.uniform(-2, 107, n_rows),
+        'start_y': rng.uniform(-2, 71, n_rows),
+        'end_x': rng.uniform(-2, 107, n_rows),
+        'end_y': rng.uniform(-2, 71, n_rows),
+    })
+
+    # make sure every bin edge and missing values are covered
+    edges_x = np.array([0, 35, 70, 105, np.nan])
+    edges_y = np.array([0, 23, 46, 69, np.nan])
+    n_edges = min(n_rows // 4, 10000)
+    for col, edges in (('start_x', edges_x), ('end_x', edges_x), ('start_y', edges_y), ('end_y', edges_y)):
+        idx = rng.choice(n_rows, n_edges, replace=False)
+        df.loc[idx, col] = rng.choice(edges, n_edges)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--loop-rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    df = make_actions(args.rows)
+
+    start = time.perf_counter()
+    pitch_zones.add_pitch_zones(df)
+    vectorised = time.perf_counter() - start
+
+    sample = df.sample(min(args.loop_rows, len(df)), random_state=0)
+    start = time.perf_counter()
+    start_zones = notebook_zones(sample, 'start_x', 'start_y')
+    end_zones = notebook_zones(sample, 'end_x', 'end_y')
+    loop = (time.perf_counter() - start) * len(df) / len(sample)
+
+    assert (sample['start_pitch_zone'].to_numpy() == np.array(start_zones, dtype=object)).all()
+    assert (sample['end_pitch_zone'].to_numpy() == np.array(end_zones, dtype=object)).all()
+
+    print(f'rows:                       {len(df):,}')
+    print(f'vectorised (start + end):   {vectorised:.3f}s')
+    print(f'iterrows loop (estimated):  {loop:.1f}s  - timed on {len(sample):,} rows')
+    print(f'speed-up:                   {loop / vectorised:,.0f}x')
+    print(f'labels identical on the {len(sample):,} row sample')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# load test: concurrent clients against the prediction service
+#
+#   python -m benchmarks.prediction_service --version 20230101-120000 --clients 16 --requests 200
+#
+# starts the service in-process (or targets a running one with --url) and fires random (target player, club) requests
+# from --clients threads, then reports throughput, the client side p50 / p99 and the server's own stats. Run with and
+# without --warm to see the cold (micro-batched predict) and warm (result cache) latencies
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import load_data
+import prediction_service
+import team_training
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models-dir', default=team_training.MODELS_DIR)
+    parser.add_argument('--version', required=True)
+    parser.add_argument('--url', default=None, help='a running service, e.g. http://127.0.0.1:8050')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--warm', action='store_true', help='warm the result cache before the load test')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables('local')
+    summary = pd.read_csv(f'{args.models_dir}/{args.version}/summary.csv')
+    team_ids = summary['team_id'].unique()
+    player_ids = tables.target_players['player_id'].unique()
+    player_ids = player_ids[np.isin(player_ids, tables.vaep['player_id'].unique())]
+
+    server = service = None
+    url = args.url
+    if url is None:
+        service = prediction_service.PredictionService(tables, args.models_dir, args.version,
+                                                       max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+        if args.warm:
+            start = time.perf_counter()
+            service.warm(player_ids)
+            print(f'result cache warmed in {time.perf_counter() - start:.1f}s')
+        server = prediction_service.make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    latencies = [[] for _ in range(args.clients)]
+    errors = []
+
+    def client(i):
+        rng = np.random.default_rng(i)
+        for _ in range(args.requests):
+            query = f'player_id={rng.choice(player_ids)}&team_id={rng.choice(team_ids)}'
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(f'{url}/predict?{query}') as response:
+                    response.read()
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            latencies[i].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    all_latencies = np.concatenate([np.array(client_latencies) for client_latencies in latencies]) * 1000
+    print(f'{len(all_latencies):,} requests from {args.clients} clients in {seconds:.1f}s '
+          f'({len(all_latencies) / seconds:.0f} req/s), {len(errors)} errors')
+    print(f'client p50 {np.percentile(all_latencies, 50):.1f}ms  p99 {np.percentile(all_latencies, 99):.1f}ms')
+    with urllib.request.urlopen(f'{url}/stats') as response:
+        print('server', json.dumps(json.load(response)))
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# benchmark suite: the main pipeline stages on a synthetic dataset, recorded per git revision
+#
+#   python -m benchmarks.suite --seasons 1                  # generate (once) and time every stage
+#   python -m benchmarks.suite --seasons 10 --repeat 1
+#   python -m benchmarks.suite --compare                    # stage times of the last revisions side by side
+#
+# runs offline: the dataset comes from benchmarks/synthetic.py and is generated into data/synthetic/ the first time a
+# size is used. Timed stages: csv and cached loading, pitch zone assignment, the n-k context (lag) features, team and
+# player slicing, and for every set_ct_mode mode the column transformer fit, one fit of its Notebook 6 model (XGBoost,
+# on the biggest team / busiest player) and a batch prediction over the whole test table. Each run appends one JSON
+# line - git revision, machine, library versions, dataset size and the stage times (best of --repeat) - to
+# benchmarks/results.jsonl, and --compare flags the stages that got slower than the previous revision.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import LabelEncoder
+
+import feature_engineering
+import load_data
+import pitch_zones
+import pre_processing_utils as ppu
+import team_training
+from benchmarks import synthetic
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(REPO_DIR, 'benchmarks', 'results.jsonl')
+SYNTHETIC_DIR = os.path.join('data', 'synthetic')
+
+
+def dataset_dir(n_seasons, n_teams, actions_per_game, seed):
+    """
+    Returns the directory of a synthetic dataset size, generating it the first time
+    """
+    out_dir = os.path.join(SYNTHETIC_DIR, f's{n_seasons}-t{n_teams}-a{actions_per_game}-seed{seed}')
+    if not os.path.exists(os.path.join(out_dir, 'data', 'target_players.csv')):
+        print(f'generating {out_dir}')
+        synthetic.write_dataset(out_dir, n_seasons, n_teams, actions_per_game, seed=seed, verbose=True)
+    return out_dir
+
+
+def run_suite(workdir, repeat=3, model_repeat=1, modes=ppu.CT_MODES):
+    """
+    Time every stage on the dataset in workdir (a directory holding data/*.csv, as written by synthetic.write_dataset)
+
+    Inputs:
+    - workdir:       the dataset directory, load_data reads workdir/data
+    - repeat:        runs of each data stage, the best one is kept
+    - model_repeat:  runs of each model fit
+    - modes:         the set_ct_mode modes to fit
+
+    Returns {stage: {'seconds': best, 'median_seconds': median, 'rows': rows}}
+    """
+    stages = {}
+
+    def timed(name, function, n=repeat, rows=None):
+        seconds = []
+        for _ in range(n):
+            start = time.perf_counter()
+            value = function()
+            seconds.append(time.perf_counter() - start)
+        rows = _rows(value) if rows is None else rows
+        stages[name] = {'seconds': min(seconds), 'median_seconds': float(np.median(seconds)), 'rows': rows}
+        print(f'{name:<28} {min(seconds):>9.3f}s  {rows or "":>10}')
+        return value
+
+    with _cwd(workdir):
+        cache_dir = tempfile.mkdtemp(prefix='benchmark-cache-')
+        try:
+            tables = dict(zip(load_data.TABLES, timed('load', lambda: load_data.load_data('local'))))
+            load_data.load_data('local', cache=True, cache_dir=cache_dir)
+            timed('load_cached', lambda: load_data.load_data('local', cache=True, cache_dir=cache_dir))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    vaep, vaep_test = tables['vaep'], tables['vaep_test']
+    base = vaep[[col for col in vaep.columns if not col.startswith('n-')]]
+    coordinates = base[['start_x', 'start_y', 'end_x', 'end_y']]
+    timed('pitch_zones', lambda: pitch_zones.add_pitch_zones(coordinates.copy()))
+    timed('context_features', lambda: feature_engineering.build_context_features(base))
+
+    team_ids = vaep['team_id'].unique()
+    player_ids = tables['target_players']['player_id'].unique()
+    timed('team_slicing', lambda: [ppu.create_team_data('team_id', team_id, vaep, vaep_test, 'vaep_value')[0]
+                                   for team_id in team_ids])
+    timed('player_slicing', lambda: [ppu.create_player_data('classification', vaep, vaep_test, player_id)[0]
+                                     for player_id in player_ids])
+
+    # the models are fitted on the biggest team and the busiest player
+    team_id = vaep['team_id'].value_counts().idxmax()
+    player_id = vaep['player_id'].value_counts().idxmax()
+    for mode in modes:
+        table = ppu.MODE_TABLES[mode]
+        X_train, y_train = _mode_data(mode, tables[table], tables[f'{table}_test'], team_id, player_id)
+        model_class, params = team_training.FINAL_MODELS['team-' + mode.split('-', 1)[1]]
+
+        ct = timed(f'ct_fit[{mode}]', lambda: ppu.make_ct(mode).fit(X_train), rows=len(X_train))
+        X_train_ct = ct.transform(X_train)
+        if model_class is xgb.XGBClassifier:
+            y_train = LabelEncoder().fit_transform(y_train)
+        model = timed(f'model_fit[{mode}]', lambda: model_class(**params).fit(X_train_ct, y_train), n=model_repeat,
+                      rows=len(X_train))
+
+        pipeline = make_pipeline(ct, model)
+        X_test = tables[f'{table}_test'].dropna()
+        timed(f'predict[{mode}]', lambda: pipeline.predict(X_test))
+
+    return stages
+
+
+def record(stages, args, path=RESULTS):
+    """
+    Append one run to the results file - returns the record
+    """
+    result = {
+        'revision': _git('rev-parse', '--short', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                     'sklearn': sklearn.__version__, 'xgboost': xgb.__version__},
+        'dataset': {'seasons': args.seasons, 'teams': args.teams, 'actions_per_game': args.actions_per_game,
+                    'seed': args.seed},
+        'repeat': args.repeat,
+        'stages': stages,
+        }
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    return result
+
+
+def compare(path=RESULTS, dataset=None, n_revisions=5, threshold=1.2):
+    """
+    Stage times of the last n_revisions revisions on one dataset size (the latest run's by default), with the ratio of
+    the latest to the previous revision
+
+    Returns the comparison DataFrame and the list of stages slower than threshold x the previous revision
+    """
+    with open(path) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    if dataset is None:
+        dataset = results[-1]['dataset']
+
+    # the latest run of each revision on that dataset, in the order the revisions were first run
+    by_revision = {}
+    for result in results:
+        if result['dataset'] == dataset:
+            revision = result['revision'] + ('+' if result['dirty'] else '')
+            by_revision[revision] = result
+    revisions = list(by_revision)[-n_revisions:]
+
+    table = pd.DataFrame({revision: {stage: timing['seconds'] for stage, timing in by_revision[revision]['stages'].items()}
+                          for revision in revisions})
+    regressions = []
+    if len(revisions) > 1:
+        table['ratio'] = table[revisions[-1]] / table[revisions[-2]]
+        regressions = table.index[table['ratio'] > threshold].tolist()
+    return table, regressions
+
+
+def _mode_data(mode, train_df, test_df, team_id, player_id):
+    target = ppu.MODE_TARGETS[mode]
+    if mode.startswith('team-'):
+        X_train, y_train, X_test, y_test = ppu.create_team_data('team_id', team_id, train_df, test_df, target)
+        return X_train, y_train
+    if target in ('type_name_encoded', 'end_pitch_zone'):
+        X_train, y_action, y_end, X_test, y_test_action, y_test_end = ppu.create_player_data(
+            'classification', train_df, test_df, player_id)
+        return X_train, y_action if target == 'type_name_encoded' else y_end
+    X_train, y_train, X_test, y_test = ppu.create_player_data('regression', train_df, test_df, player_id,
+                                                              reg_target=target)
+    return X_train, y_train
+
+
+def _rows(value):
+    if isinstance(value, (tuple, list)):
+        return sum(len(item) for item in value if hasattr(item, 'shape')) or None
+    if hasattr(value, 'shape'):
+        return int(value.shape[0])
+    return None
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', '-C', REPO_DIR] + list(args), capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+@contextmanager
+def _cwd(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--actions-per-game', type=int, default=1600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each data stage, the best one is recorded')
+    parser.add_argument('--model-repeat', type=int, default=1, help='runs of each model fit')
+    parser.add_argument('--modes', nargs='+', default=ppu.CT_MODES, choices=ppu.CT_MODES)
+    parser.add_argument('--results', default=RESULTS, help='JSON lines file the runs are appended to')
+    parser.add_argument('--compare', action='store_true', help='compare the recorded runs instead of running')
+    parser.add_argument('--threshold', type=float, default=1.2, help='--compare flags stages slower than this ratio')
+    parser.add_argument('--fail-on-regression', action='store_true', help='--compare exits with 1 on a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        table, regressions = compare(args.results, threshold=args.threshold)
+        with pd.option_context('display.width', 200, 'display.max_rows', 100):
+            print(table.round(3))
+        if regressions:
+            print(f'slower than {args.threshold}x the previous revision: {", ".join(regressions)}')
+        sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+    workdir = dataset_dir(args.seasons, args.teams, args.actions_per_game, args.seed)
+    stages = run_suite(workdir, args.repeat, args.model_repeat, args.modes)
+    result = record(stages, args, args.results)
+    print(f"recorded {result['revision']}{'+' if result['dirty'] else ''} in {args.results}")
+
+
+if __name__ == '__main__':
+    main()
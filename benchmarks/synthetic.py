@@ -0,0 +1,274 @@
+# synthetic dataset: SPADL-like actions with the schema of the Notebook 2 tables, for benchmarking without the s3 data
+#
+#   python -m benchmarks.synthetic --out data/synthetic/s1 --seasons 1
+#   cd data/synthetic/s1 && python -c "import load_data; load_data.load_data('local')"
+#
+# writes the nine load_data tables (data/vaep.csv, data/xt.csv, data/games.csv, ...) under --out. Every season is a
+# double round robin league (380 games with 20 teams) of random but plausible actions - a pass heavy action type mix,
+# possessions alternating between the two teams, coordinates on the 105 x 68 pitch, VAEP values and xT values - that
+# then goes through the same pitch zone / opponent / context feature steps as the real tables. Seasons are generated and
+# appended one at a time, so memory stays at one season whether it writes 1 or 100 seasons. The last test_fraction of
+# each season's games go to the _test tables.
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import socceraction.spadl.config as spadlconfig
+
+import incremental_ingest
+
+# relative frequency of the action types, roughly as in the StatsBomb open data
+TYPE_WEIGHTS = {
+    'pass': 0.50, 'dribble': 0.17, 'throw_in': 0.03, 'tackle': 0.03, 'take_on': 0.03, 'clearance': 0.03,
+    'interception': 0.02, 'cross': 0.02, 'foul': 0.02, 'bad_touch': 0.02, 'freekick_short': 0.02, 'shot': 0.015,
+    'goalkick': 0.01, 'keeper_pick_up': 0.01, 'corner_crossed': 0.005, 'keeper_save': 0.005,
+    }
+BODYPART_WEIGHTS = {'foot': 0.85, 'head': 0.1, 'other': 0.05}
+MOVE_TYPES = ('pass', 'dribble', 'cross')
+
+SQUAD_SIZE = 18
+PLAYERS_PER_GAME = 14
+FIRST_TEAM_ID = 100
+FIRST_GAME_ID = 1000000
+
+
+def generate_season(season_id, n_teams=20, actions_per_game=1600, seed=0, first_game_id=FIRST_GAME_ID):
+    """
+    Base SPADL actions (with VAEP values), games and players of one double round robin season
+
+    Inputs:
+    - season_id:         season_id of the games
+    - n_teams:           number of teams in the league, every pair plays home and away
+    - actions_per_game:  mean number of actions per game (poisson)
+    - seed:              random seed - the same arguments always give the same season
+
+    Returns actions, games, players
+    """
+    rng = np.random.default_rng([seed, season_id])
+    team_ids = FIRST_TEAM_ID + np.arange(n_teams)
+
+    home, away = np.meshgrid(team_ids, team_ids, indexing='ij')
+    fixture = home != away
+    home, away = home[fixture], away[fixture]
+    order = rng.permutation(len(home))
+    home, away = home[order], away[order]
+    n_games = len(home)
+    game_ids = first_game_id + np.arange(n_games)
+
+    games = pd.DataFrame({
+        'game_id': game_ids,
+        'season_id': season_id,
+        'competition_id': 1,
+        'game_day': np.arange(n_games) // max(n_teams // 2, 1) + 1,
+        'game_date': pd.Timestamp(f'{2000 + season_id % 100}-08-01') + pd.to_timedelta(np.arange(n_games) // 10 * 3, 'D'),
+        'home_team_id': home,
+        'away_team_id': away,
+        'home_score': rng.poisson(1.5, n_games),
+        'away_score': rng.poisson(1.2, n_games),
+        'venue': 'Stadium ' + pd.Series(home).astype(str),
+        'referee': 'Referee ' + pd.Series(rng.integers(1, 30, n_games)).astype(str),
+        })
+
+    actions = _actions(rng, game_ids, home, away, actions_per_game)
+    players = _players(rng, game_ids, home, away)
+    return actions, games, players
+
+
+def build_tables(actions, games):
+    """
+    The Notebook 2 steps on base actions: pitch zones, opponent / home, type_name_encoded, x_dif / y_dif and the
+    n-1 ... n-5 context columns, for every action (vaep table) and for the successful moves with an xT value (xt table)
+
+    Returns vaep, xt
+    """
+    vaep = incremental_ingest.derive_features(actions, games)
+
+    moves = actions[actions['type_name'].isin(MOVE_TYPES) & (actions['result_name'] == 'success')]
+    moves = moves.drop(columns=['offensive_value', 'defensive_value', 'vaep_value'])
+    moves['xT_value'] = _threat(moves['end_x'], moves['end_y']) - _threat(moves['start_x'], moves['start_y'])
+    xt = incremental_ingest.derive_features(moves, games)
+
+    return vaep, xt
+
+
+def write_dataset(out_dir, n_seasons=1, n_teams=20, actions_per_game=1600, test_fraction=0.2, n_target_players=20,
+                  seed=0, verbose=False):
+    """
+    Generate n_seasons seasons and write them as the nine load_data tables in <out_dir>/data, one season at a time
+
+    Inputs:
+    - out_dir:           the directory to run load_data.load_data('local') from
+    - n_seasons:         number of seasons, season_ids 1 ... n_seasons
+    - n_teams:           teams per season (n_teams * (n_teams - 1) games)
+    - actions_per_game:  mean number of actions per game
+    - test_fraction:     share of each season's games (the last ones) in the _test tables
+    - n_target_players:  number of players in target_players
+    - seed:              random seed
+
+    Returns a dict with the number of rows written per table
+    """
+    data_dir = os.path.join(out_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    for table in ('vaep', 'vaep_test', 'xt', 'xt_test', 'games', 'games_test', 'players', 'players_test'):
+        if os.path.exists(os.path.join(data_dir, f'{table}.csv')):
+            os.remove(os.path.join(data_dir, f'{table}.csv'))
+
+    rows = {}
+    minutes = []
+    games_per_season = n_teams * (n_teams - 1)
+    for season_id in range(1, n_seasons + 1):
+        start = time.perf_counter()
+        actions, games, players = generate_season(season_id, n_teams, actions_per_game, seed,
+                                                  FIRST_GAME_ID + (season_id - 1) * games_per_season)
+        vaep, xt = build_tables(actions, games)
+
+        n_test = int(round(len(games) * test_fraction))
+        test_ids = games['game_id'].iloc[len(games) - n_test:]
+        for table, df in (('vaep', vaep), ('xt', xt), ('games', games), ('players', players)):
+            is_test = df['game_id'].isin(test_ids).to_numpy()
+            for suffix, part in (('', df[~is_test]), ('_test', df[is_test])):
+                if table == 'games':
+                    # games.csv is written with game_id as the index, like Notebook 2
+                    part = part.set_index('game_id')
+                _append_csv(part, os.path.join(data_dir, f'{table}{suffix}.csv'), index=table == 'games')
+                rows[table + suffix] = rows.get(table + suffix, 0) + len(part)
+
+        minutes.append(players[~players['game_id'].isin(test_ids)].groupby(['player_id', 'player_name'])['minutes_played'].sum())
+        if verbose:
+            print(f'season {season_id}/{n_seasons}: {len(actions):,} actions in {time.perf_counter() - start:.1f}s')
+
+    minutes = pd.concat(minutes).groupby(level=[0, 1]).sum().reset_index()
+    target_players = minutes.sample(min(n_target_players, len(minutes)), random_state=seed).sort_values('player_id')
+    target_players.to_csv(os.path.join(data_dir, 'target_players.csv'), index=False)
+    rows['target_players'] = len(target_players)
+
+    return rows
+
+
+def _actions(rng, game_ids, home, away, actions_per_game):
+    counts = rng.poisson(actions_per_game, len(game_ids))
+    n = int(counts.sum())
+    game = np.repeat(np.arange(len(game_ids)), counts)
+    action_id = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    half = np.repeat(counts // 2, counts)
+
+    # possessions: runs of actions by one team, with a turnover after ~7 actions on average
+    turnover = rng.random(n) < 0.15
+    is_home = (np.cumsum(turnover) + game) % 2 == 0
+    team_id = np.where(is_home, home[game], away[game])
+    # the 14 players of each team that play the game, out of a squad of 18
+    rotation = rng.integers(0, SQUAD_SIZE, len(game_ids))[game]
+    slot = (rotation + rng.integers(0, PLAYERS_PER_GAME, n)) % SQUAD_SIZE
+    player_id = team_id * 100 + slot
+
+    type_names = np.array(list(TYPE_WEIGHTS))
+    type_weights = np.array(list(TYPE_WEIGHTS.values()))
+    type_name = type_names[rng.choice(len(type_names), n, p=type_weights / type_weights.sum())]
+    is_shot = type_name == 'shot'
+    result_name = np.where(rng.random(n) < np.where(is_shot, 0.1, 0.75), 'success', 'fail').astype(object)
+    result_name[(type_name == 'pass') & (rng.random(n) < 0.01)] = 'offside'
+
+    bodypart_names = np.array(list(BODYPART_WEIGHTS))
+    bodypart_name = bodypart_names[rng.choice(len(bodypart_names), n, p=list(BODYPART_WEIGHTS.values()))]
+
+    # every team attacks left to right, shots are taken near the opponent's goal
+    start_x = np.where(is_shot, rng.uniform(80, spadlconfig.field_length, n), rng.uniform(0, spadlconfig.field_length, n))
+    start_y = np.where(is_shot, rng.normal(spadlconfig.field_width / 2, 8, n), rng.uniform(0, spadlconfig.field_width, n))
+    start_y = np.clip(start_y, 0, spadlconfig.field_width)
+    moves = np.isin(type_name, MOVE_TYPES)
+    end_x = np.where(moves, np.clip(start_x + rng.normal(8, 15, n), 0, spadlconfig.field_length),
+                     np.where(is_shot, spadlconfig.field_length, start_x))
+    end_y = np.where(moves, np.clip(start_y + rng.normal(0, 12, n), 0, spadlconfig.field_width),
+                     np.where(is_shot, spadlconfig.field_width / 2, start_y))
+
+    offensive_value = rng.normal(0.002, 0.01, n) + np.where(is_shot & (result_name == 'success'), 0.8, 0) \
+        + np.where(is_shot, rng.uniform(0, 0.1, n), 0)
+    defensive_value = rng.normal(0, 0.005, n)
+
+    game_id = game_ids[game]
+    return pd.DataFrame({
+        'game_id': game_id,
+        'original_event_id': pd.Series(game_id).astype(str) + '-' + pd.Series(action_id).astype(str),
+        'period_id': np.where(action_id < half, 1, 2),
+        'time_seconds': np.where(action_id < half, action_id, action_id - half) / np.maximum(half, 1) * 2700,
+        'team_id': team_id,
+        'player_id': player_id,
+        'start_x': start_x,
+        'start_y': start_y,
+        'end_x': end_x,
+        'end_y': end_y,
+        'type_id': _ids(type_name, spadlconfig.actiontypes),
+        'result_id': _ids(result_name, spadlconfig.results),
+        'bodypart_id': _ids(bodypart_name, spadlconfig.bodyparts),
+        'action_id': action_id,
+        'type_name': type_name,
+        'result_name': result_name,
+        'bodypart_name': bodypart_name,
+        'offensive_value': offensive_value,
+        'defensive_value': defensive_value,
+        'vaep_value': offensive_value + defensive_value,
+        })
+
+
+def _ids(names, config_names):
+    # the SPADL id of each name, its position in the socceraction config list
+    return pd.Series(names).map({name: i for i, name in enumerate(config_names)}).to_numpy()
+
+
+def _players(rng, game_ids, home, away):
+    n_games = len(game_ids)
+    frames = []
+    for team_ids in (home, away):
+        rotation = rng.integers(0, SQUAD_SIZE, n_games)
+        slot = (rotation[:, None] + np.arange(PLAYERS_PER_GAME)) % SQUAD_SIZE
+        starter = np.arange(PLAYERS_PER_GAME) < 11
+        minutes = np.where(starter, rng.integers(60, 96, slot.shape), rng.integers(0, 31, slot.shape))
+        player_id = team_ids[:, None] * 100 + slot
+        frames.append(pd.DataFrame({
+            'game_id': np.repeat(game_ids, PLAYERS_PER_GAME),
+            'team_id': np.repeat(team_ids, PLAYERS_PER_GAME),
+            'player_id': player_id.ravel(),
+            'player_name': 'Player ' + pd.Series(player_id.ravel()).astype(str),
+            'nickname': None,
+            'jersey_number': slot.ravel() + 1,
+            'is_starter': np.tile(starter, n_games),
+            'starting_position_id': np.where(np.tile(starter, n_games), slot.ravel() % 11 + 1, 0),
+            'starting_position_name': np.where(np.tile(starter, n_games), 'Center Midfield', 'Substitute'),
+            'minutes_played': minutes.ravel(),
+            }))
+    players = pd.concat(frames, ignore_index=True)
+    return players.sort_values(['game_id', 'team_id'], kind='stable', ignore_index=True)
+
+
+def _threat(x, y):
+    # a smooth stand-in for an xT grid: rises towards the opponent's goal and the middle of the pitch
+    x = np.asarray(x, dtype=float) / spadlconfig.field_length
+    y = (np.asarray(y, dtype=float) - spadlconfig.field_width / 2) / spadlconfig.field_width
+    return 0.3 * x ** 4 * np.exp(-(y / 0.3) ** 2)
+
+
+def _append_csv(df, path, index=False):
+    df.to_csv(path, mode='a', header=not os.path.exists(path), index=index)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', required=True, help='directory to write the data/ tables to')
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--actions-per-game', type=int, default=1600)
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = write_dataset(args.out, args.seasons, args.teams, args.actions_per_game, args.test_fraction,
+                         seed=args.seed, verbose=True)
+    print(f'written in {time.perf_counter() - start:.1f}s: ' + ', '.join(f'{table} {n:,}' for table, n in rows.items()))
+
+
+if __name__ == '__main__':
+    main()
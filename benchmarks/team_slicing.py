@@ -0,0 +1,59 @@
+# benchmark: slicing every team / player with PreparedData vs create_team_data / create_player_data
+#
+#   python -m benchmarks.team_slicing
+import argparse
+import time
+
+import pandas as pd
+
+import load_data
+import pre_processing_utils as ppu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--players', type=int, default=50, help='number of players to slice')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+    train_df, test_df = tables.vaep, tables.vaep_test
+    teams = sorted(train_df['team_id'].unique())
+    players = sorted(train_df['player_id'].unique())[:args.players]
+
+    start = time.perf_counter()
+    current_teams = [ppu.create_team_data('team_id', team_id, train_df, test_df, 'vaep_value') for team_id in teams]
+    current_team_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    current_players = [ppu.create_player_data('classification', train_df, test_df, player_id) for player_id in players]
+    current_player_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = ppu.PreparedData(train_df, test_df)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed_teams = [data.create_team_data('team_id', team_id, 'vaep_value') for team_id in teams]
+    indexed_team_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed_players = [data.create_player_data('classification', player_id) for player_id in players]
+    indexed_player_seconds = time.perf_counter() - start
+
+    # the slices must be identical
+    for current, indexed in zip(current_teams + current_players, indexed_teams + indexed_players):
+        for a, b in zip(current, indexed):
+            if isinstance(a, pd.DataFrame):
+                pd.testing.assert_frame_equal(a, b)
+            else:
+                pd.testing.assert_series_equal(a, b)
+
+    print(f'train rows: {len(train_df):,}  test rows: {len(test_df):,}')
+    print(f'{len(teams)} teams    current: {current_team_seconds:.3f}s  indexed: {indexed_team_seconds:.3f}s (+ first lookup index build)')
+    print(f'{len(players)} players  current: {current_player_seconds:.3f}s  indexed: {indexed_player_seconds:.3f}s')
+    print(f'PreparedData masks: {build_seconds:.3f}s - slices identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# benchmark: the Notebook 2 xT step (per-game play_left_to_right concat + ExpectedThreat fit, per table) vs XTEngine
+#
+#   python -m benchmarks.xt_engine --grids 16x12 8x6 24x18
+#
+# the vaep tables stand in for the raw SPADL actions - they are already left to right, but both paths flip them
+# again, so they do the same work. The fitted xT surfaces are checked to be the same.
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import socceraction.spadl as spadl
+import socceraction.xthreat as xthreat
+
+import load_data
+import xt_engine
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--grids', nargs='+', default=['16x12', '8x6', '24x18'])
+    args = parser.parse_args()
+    grids = [tuple(int(i) for i in grid.split('x')) for grid in args.grids]
+
+    tables = load_data.load_tables(args.mode)
+    spadl_columns = ['game_id', 'period_id', 'time_seconds', 'team_id', 'player_id', 'start_x', 'start_y', 'end_x',
+                     'end_y', 'type_id', 'result_id', 'bodypart_id', 'action_id']
+
+    print(f"{'table':>10} {'grid':>6} {'current s':>10} {'engine s':>9} {'max |dxT|':>10}")
+    for table, games_table in (('vaep', 'games'), ('vaep_test', 'games_test')):
+        actions = tables[table][spadl_columns]
+        df_games = tables[games_table].set_index('game_id')
+        # a fresh engine per table, like the per-table ExpectedThreat fit - the test games can share the training seasons,
+        # so one engine would fit the vaep_test surface on the vaep games as well
+        engine = xt_engine.XTEngine()
+
+        for i, (l, w) in enumerate(grids):
+            # the current path refits from the actions for every grid size
+            start = time.perf_counter()
+            actions_ltr = pd.concat([
+                spadl.play_left_to_right(actions[actions['game_id'] == game_id], game.home_team_id)
+                for game_id, game in df_games.iterrows()])
+            actions_ltr = spadl.add_names(actions_ltr)
+            xTModel = xthreat.ExpectedThreat(l=l, w=w)
+            xTModel.fit(actions_ltr)
+            current_seconds = time.perf_counter() - start
+
+            # the engine counts each game once, then only aggregates the counts for the other grid sizes
+            start = time.perf_counter()
+            if i == 0:
+                engine.add_games(actions, df_games)
+            engine_model = engine.fit(l=l, w=w)
+            engine_seconds = time.perf_counter() - start
+
+            max_diff = np.abs(engine_model.xT - xTModel.xT).max()
+            print(f'{table:>10} {f"{l}x{w}":>6} {current_seconds:>10.3f} {engine_seconds:>9.3f} {max_diff:>10.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+# chunked training - the team models on more data than fits in memory, streamed in fixed-size batches
+#
+#   python chunked_training.py --train data/partitioned/vaep --team-id 965 --mode team-vaep --batch-size 200000
+#   python chunked_training.py --train data/cache/vaep.parquet --test data/cache/vaep_test.parquet \
+#       --team-id 965 --mode team-end --model sgd
+#
+# the actions are read batch by batch - from a table partitioned by incremental_ingest.py, a parquet file or a csv
+# file - and filtered like create_team_data (the team's rows without missing values). A first pass fits the set_ct_mode
+# scaler and one-hot categories with partial_fit (ppu.ModeColumnTransformer) and collects the classifier labels, a
+# second pass trains on the transformed batches: XGBoost with the Notebook 6 parameters through an external memory
+# DMatrix (the batches are paged to a cache on disk), or an SGD model with partial_fit. Peak memory depends on the
+# batch size, not on the number of leagues and seasons.
+#
+# the artifact has the same layout as team_training.py's, so load_artifact / predict / transfer_scoring work on it.
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import xgboost as xgb
+from sklearn.base import BaseEstimator
+from sklearn.linear_model import SGDClassifier, SGDRegressor
+from sklearn.pipeline import make_pipeline
+
+import load_data
+import pre_processing_utils as ppu
+import team_training
+
+BATCH_SIZE = 100000
+
+MODELS = ['xgboost', 'sgd']
+
+
+def iter_batches(path, batch_size=BATCH_SIZE, season_ids=None):
+    """
+    Yield the rows of a table as dataframes of about batch_size rows
+
+    Inputs:
+    - path:        a table directory partitioned by incremental_ingest.py (e.g. data/partitioned/vaep), a parquet file
+                   or a csv file
+    - batch_size:  rows per batch
+    - season_ids:  only read these seasons - partitioned tables only
+    """
+    if path.endswith('.csv'):
+        yield from pd.read_csv(path, chunksize=batch_size)
+        return
+
+    if os.path.isdir(path):
+        out_dir, table = os.path.split(os.path.normpath(path))
+        paths = load_data.partition_paths(out_dir, table, season_ids)
+    else:
+        paths = [path]
+
+    # the partitions are small (one game), so they are gathered until a batch is full
+    frames, n_rows = [], 0
+    for file_path in paths:
+        for record_batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size):
+            frames.append(record_batch.to_pandas())
+            n_rows += len(frames[-1])
+            if n_rows >= batch_size:
+                yield pd.concat(frames, ignore_index=True)
+                frames, n_rows = [], 0
+    if frames:
+        yield pd.concat(frames, ignore_index=True)
+
+
+def iter_team_batches(path, team_col, team_id, target, batch_size=BATCH_SIZE, season_ids=None):
+    """
+    create_team_data on a stream of batches: yields X, y of the team's rows without missing values, batch by batch
+    """
+    for df in iter_batches(path, batch_size, season_ids):
+        team_set = df[df[team_col] == team_id].dropna()
+        if len(team_set):
+            yield team_set.drop(columns=[target]), team_set[target]
+
+
+def fit_transformer(batches, mode, classification=False):
+    """
+    Fit the mode's column transformer on a stream of X, y batches with partial_fit
+
+    Returns the fitted ppu.ModeColumnTransformer, the sorted labels (classification) or None, and the number of rows
+    """
+    ct = ppu.ModeColumnTransformer(mode)
+    classes = None
+    n_rows = 0
+    for X, y in batches:
+        ct.partial_fit(X)
+        n_rows += len(X)
+        if classification:
+            labels = np.asarray(pd.unique(y))
+            classes = np.unique(labels if classes is None else np.concatenate([classes, labels]))
+    if not n_rows:
+        raise ValueError(f'no complete rows for mode {mode}')
+    return ct, classes, n_rows
+
+
+class BoosterModel(BaseEstimator):
+    """
+    An xgb.Booster as the final step of a pipeline - predict returns the values (regression) or the class indices
+    (classification, multi:softprob), like the label-encoded XGBClassifier of team_training.py. train_team_chunked
+    trains the booster from batches, fit trains one with the same parameters on in-memory X, y (class indices for the
+    classifiers).
+    """
+
+    def __init__(self, booster=None, classification=False, params=None, num_boost_round=100):
+        self.booster = booster
+        self.classification = classification
+        self.params = params
+        self.num_boost_round = num_boost_round
+
+    def fit(self, X, y):
+        params = dict(self.params or {})
+        if self.classification:
+            params.setdefault('objective', 'multi:softprob')
+            params.setdefault('num_class', int(np.max(y)) + 1)
+        self.booster = xgb.train(params, xgb.DMatrix(X, label=np.asarray(y)), num_boost_round=self.num_boost_round)
+        return self
+
+    def __sklearn_is_fitted__(self):
+        return self.booster is not None
+
+    def predict(self, X):
+        y_pred = self.booster.predict(xgb.DMatrix(X))
+        if self.classification:
+            return np.argmax(y_pred, axis=1)
+        return y_pred
+
+
+class _BatchIter(xgb.DataIter):
+    """
+    Feeds the transformed batches to an external memory DMatrix - xgboost calls reset and walks the stream again for
+    every pass it needs
+    """
+
+    def __init__(self, make_batches, cache_prefix):
+        self._make_batches = make_batches
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = self._make_batches()
+        try:
+            X, y = next(self._batches)
+        except StopIteration:
+            return 0
+        input_data(data=X, label=y)
+        return 1
+
+    def reset(self):
+        self._batches = None
+
+
+def train_team_chunked(path, team_id, mode, model='xgboost', batch_size=BATCH_SIZE, season_ids=None, n_epochs=5,
+                       cache_dir=None, n_jobs=None):
+    """
+    Train one team's model for one mode on a table streamed in batches
+
+    Inputs:
+    - path:        the table of the mode (vaep or xt), see iter_batches
+    - team_id:     the team to train
+    - mode:        a team mode of team_training.FINAL_MODELS
+    - model:       'xgboost' (the Notebook 6 model, external memory) or 'sgd' (SGDRegressor / SGDClassifier)
+    - batch_size:  rows read per batch
+    - season_ids:  only train on these seasons - partitioned tables only
+    - n_epochs:    passes over the data for the sgd model
+    - cache_dir:   directory for the external memory pages, defaults to a temporary directory
+    - n_jobs:      XGBoost threads
+
+    Returns the artifact dict of team_training.py (pipeline, classes, team_id, mode, target, n_train)
+    """
+    if model not in MODELS:
+        raise ValueError(f'model must be one of {MODELS}, got {model!r}')
+
+    target = ppu.MODE_TARGETS[mode]
+    model_class, params = team_training.FINAL_MODELS[mode]
+    classification = model_class is xgb.XGBClassifier
+
+    def team_batches():
+        return iter_team_batches(path, 'team_id', team_id, target, batch_size, season_ids)
+
+    # first pass: scaler statistics, categories and labels
+    ct, classes, n_train = fit_transformer(team_batches(), mode, classification)
+
+    def transformed_batches():
+        for X, y in team_batches():
+            yield ct.transform(X), (np.searchsorted(classes, np.asarray(y)) if classification else np.asarray(y))
+
+    # second pass: training
+    if model == 'sgd':
+        estimator = SGDClassifier(random_state=1) if classification else SGDRegressor(random_state=1)
+        for _ in range(n_epochs):
+            for X, y in transformed_batches():
+                if classification:
+                    estimator.partial_fit(X, y, classes=np.arange(len(classes)))
+                else:
+                    estimator.partial_fit(X, y)
+    else:
+        booster_params = {key: value for key, value in params.items() if key != 'n_estimators'}
+        booster_params['tree_method'] = 'hist'
+        if n_jobs is not None:
+            booster_params['nthread'] = n_jobs
+        if classification:
+            booster_params.update(objective='multi:softprob', num_class=len(classes))
+        else:
+            booster_params['objective'] = 'reg:squarederror'
+
+        num_boost_round = params.get('n_estimators', 100)
+        work_dir = cache_dir or tempfile.mkdtemp(prefix='chunked_training_')
+        try:
+            booster = _train_external_memory(booster_params, transformed_batches, os.path.join(work_dir, 'cache'),
+                                             num_boost_round)
+        finally:
+            if cache_dir is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        estimator = BoosterModel(booster, classification, booster_params, num_boost_round)
+
+    return {
+        'pipeline': make_pipeline(ct, estimator),
+        'classes': classes,
+        'team_id': team_training._native(team_id),
+        'mode': mode,
+        'target': target,
+        'n_train': n_train,
+        }
+
+
+def _train_external_memory(params, make_batches, cache_prefix, num_boost_round):
+    # the DMatrix and its iterator only live in this call - the cache pages are released (and removed by XGBoost) when
+    # it returns, before the caller removes the cache directory
+    dtrain = xgb.DMatrix(_BatchIter(make_batches, cache_prefix))
+    return xgb.train(params, dtrain, num_boost_round=num_boost_round)
+
+
+def score_chunked(artifact, batches):
+    """
+    Test score of an artifact on a stream of X, y batches - R^2 for the regressors, accuracy for the classifiers
+
+    Returns the score and the number of rows
+    """
+    n_rows = 0
+    correct = 0
+    sums = np.zeros(3)  # squared error, y, y^2
+    for X, y in batches:
+        y = np.asarray(y)
+        y_pred = team_training.predict(artifact, X)
+        n_rows += len(y)
+        if artifact['classes'] is None:
+            y = y.astype(float)
+            sums += [np.sum((y - y_pred) ** 2), np.sum(y), np.sum(y ** 2)]
+        else:
+            correct += np.sum(y_pred == y)
+
+    if not n_rows:
+        return np.nan, 0
+    if artifact['classes'] is not None:
+        return correct / n_rows, n_rows
+    squared_error, total, total_squares = sums
+    return 1 - squared_error / (total_squares - total ** 2 / n_rows), n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--train', required=True, help='the training table: partitioned directory, parquet or csv')
+    parser.add_argument('--test', default=None, help='the test table, to score the model on')
+    parser.add_argument('--team-id', type=int, required=True)
+    parser.add_argument('--mode', required=True, choices=team_training.TEAM_MODES)
+    parser.add_argument('--model', default='xgboost', choices=MODELS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--seasons', type=int, nargs='+', default=None, help='season_ids, partitioned tables only')
+    parser.add_argument('--epochs', type=int, default=5, help='passes over the data for --model sgd')
+    parser.add_argument('--out-dir', default=team_training.MODELS_DIR)
+    parser.add_argument('--version', default=None)
+    parser.add_argument('--jobs', type=int, default=None, help='XGBoost threads')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    artifact = train_team_chunked(args.train, args.team_id, args.mode, args.model, args.batch_size, args.seasons,
+                                  args.epochs, n_jobs=args.jobs)
+    print(f"{artifact['n_train']:,} rows trained in {time.perf_counter() - start:.1f}s")
+
+    if args.test:
+        score, n_test = score_chunked(artifact, iter_team_batches(args.test, 'team_id', args.team_id,
+                                                                  artifact['target'], args.batch_size))
+        print(f'test score {score:.4f} on {n_test:,} rows')
+
+    version = args.version or time.strftime('%Y%m%d-%H%M%S')
+    print(f'written to {team_training.write_artifact(artifact, os.path.join(args.out_dir, version))}')
+
+
+if __name__ == '__main__':
+    # run from the module, so the artifacts pickle chunked_training.BoosterModel rather than __main__.BoosterModel
+    import chunked_training
+    chunked_training.main()
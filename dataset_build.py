@@ -0,0 +1,174 @@
+# dataset build - SPADL conversion and VAEP features, labels and ratings for every game (Notebook 2), on a process pool
+#
+#   python dataset_build.py --games 37:4 37:42 --shard-dir data/shards/train --out data/rated_actions.parquet
+#
+# every game is loaded and converted exactly once, in a worker process, and its actions, VAEP features and labels are
+# written to a per-game shard. An interrupted build picks up where it stopped: complete shards are never rebuilt.
+import argparse
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+import socceraction.spadl as spadl
+from socceraction.data.statsbomb import StatsBombLoader
+from socceraction.vaep import VAEP
+
+NB_PREV_ACTIONS = 5
+
+SHARD_TABLES = ['actions', 'features', 'labels']
+
+# one StatsBomb loader per worker process
+_loader = None
+
+
+def convert_game(game_id, game, shard_dir, loader_kwargs=None):
+    """
+    Load one game's events, convert them to SPADL actions and compute the VAEP features and labels, then write the
+    three tables to the game's shard. Runs in the worker processes.
+
+    Inputs:
+    - game_id:        the game to convert
+    - game:           the game's row of the games table (as a Series)
+    - shard_dir:      the directory holding the per-game shards
+    - loader_kwargs:  arguments for StatsBombLoader, e.g. {'getter': 'local', 'root': 'statsbomb/data'}
+
+    Returns the game_id
+    """
+    global _loader
+
+    game_dir = _game_dir(shard_dir, game_id)
+    if shard_complete(shard_dir, game_id):
+        return game_id
+
+    if _loader is None:
+        _loader = StatsBombLoader(**(loader_kwargs or {}))
+
+    # load the game's events and convert them to actions
+    game_events = _loader.events(game_id)
+    game_actions = spadl.statsbomb.convert_to_actions(game_events, game['home_team_id'])
+    game_actions = spadl.add_names(game_actions)
+
+    # compute features and labels
+    VAEP_model = VAEP(nb_prev_actions=NB_PREV_ACTIONS)
+    tables = {
+        'actions': game_actions,
+        'features': VAEP_model.compute_features(game, game_actions),
+        'labels': VAEP_model.compute_labels(game, game_actions),
+        }
+
+    os.makedirs(game_dir, exist_ok=True)
+    for name, df in tables.items():
+        path = os.path.join(game_dir, f'{name}.parquet')
+        df.reset_index(drop=True).to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    # the marker is written last, a shard without it is rebuilt
+    open(os.path.join(game_dir, '_SUCCESS'), 'w').close()
+
+    return game_id
+
+
+def shard_complete(shard_dir, game_id):
+    return os.path.exists(os.path.join(_game_dir(shard_dir, game_id), '_SUCCESS'))
+
+
+def read_shards(shard_dir, game_ids, table):
+    """
+    Returns one of the shard tables ('actions', 'features' or 'labels') for a list of games, in game order
+    """
+    return pd.concat(
+        [pd.read_parquet(os.path.join(_game_dir(shard_dir, game_id), f'{table}.parquet')) for game_id in game_ids],
+        ignore_index=True)
+
+
+def build_dataset(df_games, shard_dir, loader_kwargs=None, n_jobs=None, VAEP_model=None):
+    """
+    Convert every game in df_games on a process pool, then fit (unless a fitted model is passed) and apply the VAEP
+    model using the shards - the events are never loaded or converted a second time for the ratings.
+
+    Inputs:
+    - df_games:       games table indexed by game_id, as returned by SBL.games(...).set_index('game_id')
+    - shard_dir:      where the per-game shards are written
+    - loader_kwargs:  arguments for StatsBombLoader
+    - n_jobs:         number of worker processes, defaults to the number of cpus
+    - VAEP_model:     an already fitted VAEP model, e.g. the train model when building the test set
+
+    Returns rated_df (actions + offensive_value, defensive_value, vaep_value), VAEP_model
+    """
+    todo = [game_id for game_id in df_games.index if not shard_complete(shard_dir, game_id)]
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(convert_game, game_id, df_games.loc[game_id], shard_dir, loader_kwargs) for game_id in todo]
+            for future in tqdm(as_completed(futures), total=len(futures), desc='converting games'):
+                # re-raise any worker error here - the shards already written are kept for the next run
+                future.result()
+
+    if VAEP_model is None:
+        VAEP_model = VAEP(nb_prev_actions=NB_PREV_ACTIONS)
+        VAEP_model.fit(read_shards(shard_dir, df_games.index, 'features'), read_shards(shard_dir, df_games.index, 'labels'))
+
+    # rate each game from its stored actions and features
+    rated = []
+    for game_id, game in tqdm(list(df_games.iterrows()), desc='rating games'):
+        game_actions = read_shards(shard_dir, [game_id], 'actions')
+        game_features = read_shards(shard_dir, [game_id], 'features')
+        ratings = VAEP_model.rate(game, game_actions, game_features)
+        rated.append(pd.concat([game_actions, ratings.reset_index(drop=True)], axis=1))
+
+    rated_df = pd.concat(rated, ignore_index=True)
+
+    return rated_df, VAEP_model
+
+
+def load_games(competition_seasons, loader_kwargs=None):
+    """
+    Returns the games table for a list of (competition_id, season_id) pairs, indexed by game_id
+    """
+    SBL = StatsBombLoader(**(loader_kwargs or {}))
+    return pd.concat([SBL.games(competition_id=competition_id, season_id=season_id).set_index('game_id')
+                      for competition_id, season_id in competition_seasons], axis=0)
+
+
+def _game_dir(shard_dir, game_id):
+    return os.path.join(shard_dir, str(game_id))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', nargs='+', required=True, metavar='COMPETITION:SEASON',
+                        help='competition and season ids to build, e.g. 37:4 37:42')
+    parser.add_argument('--shard-dir', required=True)
+    parser.add_argument('--out', required=True, help='parquet file for the rated actions')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--getter', default='remote', choices=['remote', 'local'])
+    parser.add_argument('--root', default=None, help='StatsBomb open-data directory, for --getter local')
+    parser.add_argument('--model-in', default=None, help='pickled VAEP model to rate with, instead of fitting one')
+    parser.add_argument('--model-out', default=None, help='where to pickle the fitted VAEP model')
+    args = parser.parse_args()
+
+    loader_kwargs = {'getter': args.getter}
+    if args.root:
+        loader_kwargs['root'] = args.root
+
+    competition_seasons = [tuple(int(i) for i in pair.split(':')) for pair in args.games]
+    df_games = load_games(competition_seasons, loader_kwargs)
+
+    VAEP_model = None
+    if args.model_in:
+        with open(args.model_in, 'rb') as f:
+            VAEP_model = pickle.load(f)
+
+    rated_df, VAEP_model = build_dataset(df_games, args.shard_dir, loader_kwargs, args.jobs, VAEP_model)
+    rated_df.to_parquet(args.out, index=False)
+
+    if args.model_out:
+        with open(args.model_out, 'wb') as f:
+            pickle.dump(VAEP_model, f)
+
+
+if __name__ == '__main__':
+    main()
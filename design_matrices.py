@@ -0,0 +1,333 @@
+# design matrices - the transformed training / test matrices of the team models, written once and memory-mapped
+#
+#   python design_matrices.py --teams all --out-dir data/matrices
+#   python design_matrices.py --teams 965 --modes team-vaep team-end --sparse-output
+#
+#   X, y, meta = design_matrices.load_matrix('data/matrices', 965, 'team-vaep', seasons=[90])
+#   search.fit(X, y)                                            # e.g. model_search.PersistentGridSearch on the model
+#   pipe = make_pipeline(design_matrices.load_transformer(meta), model)     # predicts from the raw frames again
+#
+# for every team and team mode the create_team_data slice is transformed once with the mode's column transformer
+# (fitted on the team's training rows, ppu.SharedColumnTransformer for the modes of the same table) and written as
+#
+#   <out_dir>/<team_id>/<mode>/meta.json            columns, labels, season row ranges, transformer state
+#   <out_dir>/<team_id>/<mode>/<split>.X.npy        dense float32 matrix, or for a sparse (CSR) matrix
+#   <out_dir>/<team_id>/<mode>/<split>.data.npy / .indices.npy / .indptr.npy
+#   <out_dir>/<team_id>/<mode>/<split>.y.npy        the target - class indices into meta['classes'] for the classifiers
+#   <out_dir>/<team_id>/<mode>/<split>.game_id.npy  the game of every row, e.g. for group k-fold
+#
+# for the train and test splits. The rows of a split are grouped by season (in the original order within a season), so
+# one season or a run of consecutive seasons is a row range of the files: load_matrix memory-maps the arrays and
+# returns that range without copying, and worker processes loading the same matrix share the same pages. The float32
+# matrices give the same XGBoost models as the float64 pipelines, XGBoost converts its input to float32.
+import argparse
+import json
+import os
+import platform
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+from scipy import sparse
+from sklearn.pipeline import make_pipeline
+
+import load_data
+import pre_processing_utils as ppu
+import team_training
+
+MATRICES_DIR = 'data/matrices'
+
+SPLITS = ['train', 'test']
+
+# the arrays of a sparse matrix, in the order of the csr_matrix constructor
+CSR_ARRAYS = ['data', 'indices', 'indptr']
+
+
+def materialise(tables, team_ids, modes=team_training.TEAM_MODES, out_dir=MATRICES_DIR, sparse_output=None):
+    """
+    Write the design matrices of every (team, mode) pair, replacing the ones already written
+
+    Inputs:
+    - tables:         anything indexable by table name holding the vaep / xt train and test tables and games /
+                      games_test for their seasons, e.g. load_data.load_tables('local')
+    - team_ids:       the teams to write
+    - modes:          team modes of ppu.CT_MODES
+    - out_dir:        root directory of the matrices
+    - sparse_output:  None keeps make_ct's sparse / dense decision, True always writes CSR, False always dense
+
+    Returns a summary DataFrame, one row per (team, mode)
+    """
+    unknown = [mode for mode in modes if mode not in ppu.CT_MODES or not mode.startswith('team-')]
+    if unknown:
+        raise ValueError(f'modes must be team modes of {ppu.CT_MODES}, got {unknown}')
+
+    summary = []
+    for table in sorted({ppu.MODE_TABLES[mode] for mode in modes}):
+        table_modes = [mode for mode in modes if ppu.MODE_TABLES[mode] == table]
+        data = ppu.PreparedData(tables[table], tables[f'{table}_test'])
+        seasons = {'train': season_ids(data.train_df, tables['games']),
+                   'test': season_ids(data.test_df, tables['games_test'])}
+
+        for team_id in team_ids:
+            start = time.perf_counter()
+            positions = dict(zip(SPLITS, data.team_positions('team_id', team_id)))
+            if not len(positions['train']):
+                summary += [{'team_id': team_training._native(team_id), 'mode': mode, 'n_train': 0, 'n_test': 0,
+                             'seconds': 0.0, 'path': None} for mode in table_modes]
+                continue
+
+            # rows grouped by season, in the original order within a season
+            frames, season_ranges = {}, {}
+            for split, df in (('train', data.train_df), ('test', data.test_df)):
+                split_seasons = seasons[split][positions[split]]
+                order = np.argsort(split_seasons, kind='stable')
+                frames[split] = df.take(positions[split][order])
+                season_ranges[split] = _season_ranges(split_seasons[order])
+
+            shared = ppu.SharedColumnTransformer(table_modes, sparse_output)
+            blocks = {'train': shared.fit_blocks(frames['train'])}
+            if len(frames['test']):
+                blocks['test'] = shared.transform_blocks(frames['test'])
+
+            for mode in table_modes:
+                path = _write_mode(out_dir, team_id, mode, shared, frames, blocks, season_ranges)
+                summary.append({
+                    'team_id': team_training._native(team_id),
+                    'mode': mode,
+                    'n_train': len(frames['train']),
+                    'n_test': len(frames['test']),
+                    # the team's slice and shared transform, for all the modes of the table
+                    'seconds': time.perf_counter() - start,
+                    'path': path,
+                    })
+
+    return pd.DataFrame(summary)
+
+
+def season_ids(df, games):
+    """
+    Returns the season_id of every row of an action table as an int array, from its season_id column or the games
+    table - -1 for games without a season
+    """
+    if 'season_id' in df.columns:
+        seasons = df['season_id']
+    else:
+        seasons = df['game_id'].map(games.drop_duplicates('game_id').set_index('game_id')['season_id'])
+    return seasons.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def load_meta(out_dir, team_id, mode):
+    """
+    Returns the meta.json of a (team, mode) pair
+    """
+    with open(os.path.join(_mode_dir(out_dir, team_id, mode), 'meta.json')) as f:
+        return json.load(f)
+
+
+def load_matrix(out_dir, team_id, mode, split='train', seasons=None, mmap=True):
+    """
+    Memory-map the design matrix of a (team, mode) pair
+
+    Inputs:
+    - out_dir:   root directory of the matrices
+    - team_id:   the team
+    - mode:      the team mode
+    - split:     'train' or 'test'
+    - seasons:   only these season_ids, defaults to every season - consecutive seasons are a view on the files, others
+                 are copied into memory
+    - mmap:      False reads the arrays into memory instead
+
+    Returns X (a float32 array or CSR matrix), y and the meta dict
+    """
+    if split not in SPLITS:
+        raise ValueError(f'split must be one of {SPLITS}, got {split!r}')
+
+    mode_dir = _mode_dir(out_dir, team_id, mode)
+    meta = load_meta(out_dir, team_id, mode)
+    split_meta = meta['splits'][split]
+    mmap_mode = 'r' if mmap else None
+
+    def array(name):
+        return np.load(os.path.join(mode_dir, f'{split}.{name}.npy'), mmap_mode=mmap_mode)
+
+    if meta['format'] == 'csr':
+        X = sparse.csr_matrix(tuple(array(name) for name in CSR_ARRAYS),
+                              shape=(split_meta['n_rows'], meta['n_features']), copy=False)
+    else:
+        X = array('X')
+    y = array('y')
+
+    if seasons is None:
+        return X, y, meta
+
+    ranges = [(start, stop) for season_id, start, stop in split_meta['seasons'] if season_id in set(seasons)]
+    if not ranges:
+        return X[:0], y[:0], meta
+
+    # consecutive seasons are one row range - a view, no copy
+    if all(stop == next_start for (_, stop), (next_start, _) in zip(ranges, ranges[1:])):
+        start, stop = ranges[0][0], ranges[-1][1]
+        return _rows(X, start, stop), y[start:stop], meta
+
+    rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    return X[rows], y[rows], meta
+
+
+def load_game_ids(out_dir, team_id, mode, split='train'):
+    """
+    Returns the game_id of every row of a split, memory-mapped - e.g. the groups of a GroupKFold
+    """
+    return np.load(os.path.join(_mode_dir(out_dir, team_id, mode), f'{split}.game_id.npy'), mmap_mode='r')
+
+
+def load_transformer(meta):
+    """
+    Returns the fitted column transformer the matrices were transformed with, to predict from raw frames
+    """
+    return ppu.transformer_from_state(meta['transformer'])
+
+
+def decode_labels(meta, y):
+    """
+    The original labels of class indices (the y of a classifier mode, or its predictions) - y as is for a regressor
+    """
+    if meta['classes'] is None:
+        return y
+    return np.asarray(meta['classes'], dtype=meta['label_dtype'])[np.asarray(y, dtype=int)]
+
+
+def train_from_matrices(out_dir, team_id, mode, seasons=None, n_jobs=None):
+    """
+    Fit the Notebook 6 model of a (team, mode) pair on its memory-mapped training matrix
+
+    Returns the artifact dict of team_training.py (pipeline, classes, team_id, mode, target, n_train), so
+    team_training.write_artifact / predict work on it
+    """
+    X, y, meta = load_matrix(out_dir, team_id, mode, 'train', seasons)
+    model_class, params = team_training.FINAL_MODELS[mode]
+    model = model_class(n_jobs=n_jobs, **params).fit(X, y)
+
+    return {
+        'pipeline': make_pipeline(load_transformer(meta), model),
+        'classes': None if meta['classes'] is None else np.asarray(meta['classes'], dtype=meta['label_dtype']),
+        'team_id': meta['team_id'],
+        'mode': mode,
+        'target': meta['target'],
+        'n_train': X.shape[0],
+        }
+
+
+def _write_mode(out_dir, team_id, mode, shared, frames, blocks, season_ranges):
+    target = ppu.MODE_TARGETS[mode]
+    ct = shared.mode_transformer(mode)
+
+    # the classifier labels are stored as indices into the training classes, -1 for a test label never trained on
+    classes = None
+    if team_training.FINAL_MODELS[mode][0] is xgb.XGBClassifier:
+        classes = np.unique(frames['train'][target].to_numpy())
+
+    mode_dir = _mode_dir(out_dir, team_id, mode)
+    tmp_dir = mode_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    splits = {}
+    for split in SPLITS:
+        df = frames[split]
+        if split in blocks:
+            X = shared.select(blocks[split], mode).astype(np.float32)
+        else:
+            X = np.zeros((0, len(ct.get_feature_names_out())), dtype=np.float32)
+        if ct.sparse_output_:
+            X = sparse.csr_matrix(X)
+            for name in CSR_ARRAYS:
+                np.save(os.path.join(tmp_dir, f'{split}.{name}.npy'), getattr(X, name))
+        else:
+            np.save(os.path.join(tmp_dir, f'{split}.X.npy'), np.ascontiguousarray(X))
+
+        y = df[target].to_numpy()
+        if classes is not None:
+            codes = np.searchsorted(classes, y).clip(0, len(classes) - 1)
+            y = np.where(classes[codes] == y, codes, -1).astype(np.int32)
+        np.save(os.path.join(tmp_dir, f'{split}.y.npy'), y)
+        np.save(os.path.join(tmp_dir, f'{split}.game_id.npy'), df['game_id'].to_numpy())
+
+        splits[split] = {'n_rows': len(df), 'nnz': int(X.nnz) if sparse.issparse(X) else X.size,
+                         'seasons': season_ranges[split]}
+
+    meta = {
+        'team_id': team_training._native(team_id),
+        'mode': mode,
+        'target': target,
+        'table': ppu.MODE_TABLES[mode],
+        'format': 'csr' if ct.sparse_output_ else 'dense',
+        'dtype': 'float32',
+        'n_features': len(ct.get_feature_names_out()),
+        'columns': ct.get_feature_names_out().tolist(),
+        'classes': None if classes is None else classes.tolist(),
+        'label_dtype': None if classes is None else str(classes.dtype),
+        'splits': splits,
+        'transformer': ppu.transformer_state(ct),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'libraries': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                      'scikit-learn': sklearn.__version__},
+        }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    # swap the complete directory in, so a reader never sees half of a new matrix
+    shutil.rmtree(mode_dir, ignore_errors=True)
+    os.replace(tmp_dir, mode_dir)
+    return mode_dir
+
+
+def _mode_dir(out_dir, team_id, mode):
+    return os.path.join(out_dir, str(team_id), mode)
+
+
+def _season_ranges(seasons):
+    # [season_id, start, stop] row ranges of a season-sorted array
+    values, starts = np.unique(seasons, return_index=True)
+    stops = np.append(starts[1:], len(seasons))
+    return [[int(value), int(start), int(stop)] for value, start, stop in zip(values, starts, stops)]
+
+
+def _rows(X, start, stop):
+    # rows start:stop of a dense or CSR matrix as a view on its arrays - X[start:stop] would copy a sparse matrix
+    if not sparse.issparse(X):
+        return X[start:stop]
+    begin, end = X.indptr[start], X.indptr[stop]
+    return sparse.csr_matrix((X.data[begin:end], X.indices[begin:end], X.indptr[start:stop + 1] - begin),
+                             shape=(stop - start, X.shape[1]), copy=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--teams', nargs='+', required=True, help="team ids to write, or 'all'")
+    parser.add_argument('--modes', nargs='+', default=team_training.TEAM_MODES, choices=team_training.TEAM_MODES)
+    parser.add_argument('--out-dir', default=MATRICES_DIR)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--sparse-output', dest='sparse_output', action='store_const', const=True, default=None,
+                        help='always write CSR matrices')
+    output.add_argument('--dense-output', dest='sparse_output', action='store_const', const=False,
+                        help='always write dense matrices')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+    if args.teams == ['all']:
+        team_ids = sorted(tables.vaep['team_id'].unique())
+    else:
+        team_ids = [int(team_id) for team_id in args.teams]
+
+    start = time.perf_counter()
+    summary = materialise(tables, team_ids, args.modes, args.out_dir, args.sparse_output)
+    print(summary.to_string(index=False))
+    print(f'{len(summary)} matrices in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
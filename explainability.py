@@ -0,0 +1,346 @@
+# explainability - per club feature importance reports for the team models of a model version, on a process pool
+#
+#   python explainability.py --version 20230101-120000                       # TreeSHAP, every club and mode
+#   python explainability.py --version 20230101-120000 --method permutation --max-rows 1000 --jobs 4
+#
+#   importances = explainability.feature_importances(pipe_vaep, X_test, y_test)      # one pipeline, e.g. Notebook 5
+#
+# for every (club, mode) artifact written by team_training.py a capped random sample of the club's create_team_data
+# rows is transformed once, and the importances are measured on the transformed matrix:
+#
+# - shap:         XGBoost's own TreeSHAP (pred_contribs) - the mean absolute SHAP value of each feature
+# - permutation:  the drop of the test score (R^2 / accuracy) when a feature's values are shuffled between the rows
+#
+# the one-hot columns are aggregated back to the feature they encode (the n-3_start_pitch_zone_zone_1 ... _zone_9
+# dummies are one n-3_start_pitch_zone feature): their SHAP values are summed per row, and their columns are shuffled
+# together. The features are reported with their lag (n-3) and base feature (start_pitch_zone) for coarser groupings.
+#
+# the report of each artifact is cached next to the models, keyed by the artifact file's hash and the settings
+#
+#   <models_dir>/<version>/explanations/<team_id>/<mode>.<method>.csv / .json
+#
+# so after a retrain only the models that changed are explained again. The frames are written once to Arrow IPC files
+# the workers memory-map, as in team_training.py.
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import xgboost as xgb
+from scipy import sparse
+from sklearn.base import is_classifier
+from sklearn.metrics import accuracy_score, r2_score
+
+import load_data
+import pre_processing_utils as ppu
+import team_training
+
+METHODS = ['shap', 'permutation']
+
+# rows explained per (club, mode)
+MAX_ROWS = 2000
+
+N_REPEATS = 5
+
+EXPLANATIONS_DIR = 'explanations'
+
+
+def feature_importances(pipeline, X, y=None, method='shap', classes=None, max_rows=MAX_ROWS, n_repeats=N_REPEATS,
+                        seed=0):
+    """
+    Feature importances of a fitted make_pipeline(column transformer, model), per original feature
+
+    Inputs:
+    - pipeline:   the fitted pipeline - the column transformer of make_ct / get_column_transformer /
+                  ppu.ModeColumnTransformer, and an XGBoost model (any model for 'permutation')
+    - X:          the rows to explain, as given to the pipeline
+    - y:          the targets of X - only needed for 'permutation'
+    - method:     'shap' or 'permutation'
+    - classes:    the labels the classifier's predictions are indices into (team_training artifacts), None when it
+                  predicts the labels themselves
+    - max_rows:   the size of the random sample of X that is explained
+    - n_repeats:  shuffles per feature for 'permutation'
+    - seed:       seed of the sample and the shuffles
+
+    Returns a DataFrame with feature, lag, base_feature, importance and rank, most important first
+    """
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}, got {method!r}')
+
+    rng = np.random.default_rng(seed)
+    if len(X) > max_rows:
+        rows = np.sort(rng.choice(len(X), max_rows, replace=False))
+        X = X.iloc[rows]
+        y = None if y is None else np.asarray(y)[rows]
+
+    ct, model = pipeline[:-1], pipeline[-1]
+    matrix = ct.transform(X)
+    sources = source_features(pipeline[-2])
+    features = list(dict.fromkeys(sources))
+    groups = [np.flatnonzero(np.asarray(sources) == feature) for feature in features]
+
+    if method == 'shap':
+        booster = _booster(model)
+        if booster is None:
+            raise ValueError(f'shap needs an XGBoost model, got {type(model).__name__}')
+        importance = _shap_importance(booster, matrix, groups)
+    else:
+        if y is None:
+            raise ValueError('permutation importances need y')
+        importance = _permutation_importance(model, matrix, _encode(y, classes), groups, n_repeats, rng)
+
+    report = pd.DataFrame({'feature': features, 'importance': importance})
+    lags = report['feature'].str.extract(r'^(n-\d+)_(.*)$')
+    report['lag'] = lags[0]
+    report['base_feature'] = lags[1].fillna(report['feature'])
+    report = report.sort_values('importance', ascending=False, kind='stable').reset_index(drop=True)
+    report['rank'] = np.arange(1, len(report) + 1)
+    return report[['feature', 'lag', 'base_feature', 'importance', 'rank']]
+
+
+def source_features(ct):
+    """
+    Returns the original feature of every output column of a fitted column transformer - the one-hot columns of a
+    categorical feature all map to it
+    """
+    if isinstance(ct, ppu.ModeColumnTransformer):
+        return list(ct.numeric_features_) + [col for col, categories in zip(ct.categorical_features_,
+                                                                            ct.encoder_.categories_)
+                                             for _ in categories]
+    if isinstance(ct, ppu.CachedColumnTransformer):
+        ct = ct.transformer_
+
+    sources = []
+    for name, transformer, columns in ct.transformers_:
+        if transformer == 'drop' or name == 'remainder':
+            continue
+        if hasattr(transformer, 'categories_'):
+            sources += [col for col, categories in zip(columns, transformer.categories_) for _ in categories]
+        else:
+            sources += list(columns)
+    return sources
+
+
+def explain_version(tables, models_dir, version, team_ids=None, modes=None, method='shap', max_rows=MAX_ROWS,
+                    n_repeats=N_REPEATS, split='train', seed=0, n_jobs=None):
+    """
+    Feature importances of every (club, mode) artifact of a model version, computed on a process pool and cached
+
+    Inputs:
+    - tables:     anything indexable by table name holding vaep, vaep_test, xt and xt_test, e.g.
+                  load_data.load_tables('local') - only read when an artifact is not in the cache
+    - models_dir: root directory of the model versions
+    - version:    the version written by team_training.train_teams
+    - team_ids:   the clubs, defaults to every club of the version
+    - modes:      the team modes, defaults to every mode of the version
+    - method:     'shap' or 'permutation'
+    - max_rows:   rows explained per (club, mode)
+    - n_repeats:  shuffles per feature for 'permutation'
+    - split:      explain the club's 'train' or 'test' rows
+    - seed:       seed of the samples and the shuffles
+    - n_jobs:     number of worker processes, defaults to the number of cpus
+
+    Returns the importances of all the artifacts in one DataFrame, with team_id and mode columns
+    """
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}, got {method!r}')
+
+    version_dir = os.path.join(models_dir, version)
+    settings = {'method': method, 'max_rows': max_rows, 'n_repeats': n_repeats if method == 'permutation' else None,
+                'split': split, 'seed': seed}
+
+    reports, jobs = [], []
+    for team_id, mode, path in _artifacts(version_dir, team_ids, modes):
+        cache_path = os.path.join(version_dir, EXPLANATIONS_DIR, str(team_id), f'{mode}.{method}')
+        key = dict(settings, artifact_sha1=_file_hash(path))
+        cached = _read_cache(cache_path, key)
+        if cached is not None:
+            reports.append(cached)
+        else:
+            jobs.append((team_id, mode, path, cache_path, key))
+
+    if jobs:
+        reports += _run_jobs(tables, jobs, settings, n_jobs)
+
+    if not reports:
+        return pd.DataFrame(columns=['team_id', 'mode', 'feature', 'lag', 'base_feature', 'importance', 'rank'])
+    return pd.concat(reports, ignore_index=True).sort_values(['team_id', 'mode', 'rank']).reset_index(drop=True)
+
+
+def explain_job(team_id, mode, path, positions, cache_path, key):
+    """
+    Explain one artifact on its rows of the memory-mapped frames and write the report to the cache. Runs in the worker
+    processes.
+
+    Returns the report DataFrame
+    """
+    artifact = joblib.load(path)
+    table = ppu.MODE_TABLES[mode]
+    name = table if key['split'] == 'train' else f'{table}_test'
+    rows = team_training._frames[name].take(pa.array(positions)).to_pandas()
+
+    target = artifact['target']
+    report = feature_importances(artifact['pipeline'], rows.drop(columns=[target]), rows[target], key['method'],
+                                 artifact['classes'], key['max_rows'], key['n_repeats'] or N_REPEATS, key['seed'])
+    report.insert(0, 'mode', mode)
+    report.insert(0, 'team_id', team_id)
+    _write_cache(cache_path, key, report)
+    return report
+
+
+def _run_jobs(tables, jobs, settings, n_jobs):
+    # the club slices of the tables the jobs need, written once for the workers
+    frame_dir = tempfile.mkdtemp(prefix='explainability_')
+    try:
+        paths, positions = {}, {}
+        for table in sorted({ppu.MODE_TABLES[mode] for team_id, mode, path, cache_path, key in jobs}):
+            data = ppu.PreparedData(tables[table], tables[f'{table}_test'])
+            name, df = (table, data.train_df) if settings['split'] == 'train' else (f'{table}_test', data.test_df)
+            paths[name] = os.path.join(frame_dir, f'{name}.arrow')
+            team_training._write_frame(df, paths[name])
+            for team_id in {team_id for team_id, mode, path, cache_path, key in jobs}:
+                train_positions, test_positions = data.team_positions('team_id', team_id)
+                positions[table, team_id] = train_positions if settings['split'] == 'train' else test_positions
+
+        reports = []
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=team_training._open_frames,
+                                 initargs=(paths,)) as pool:
+            futures = [pool.submit(explain_job, team_id, mode, path, positions[ppu.MODE_TABLES[mode], team_id],
+                                   cache_path, key)
+                       for team_id, mode, path, cache_path, key in jobs
+                       if len(positions[ppu.MODE_TABLES[mode], team_id])]
+            for future in as_completed(futures):
+                reports.append(future.result())
+        return reports
+    finally:
+        shutil.rmtree(frame_dir)
+
+
+def _artifacts(version_dir, team_ids, modes):
+    # (team_id, mode, path) of the artifacts of a version
+    for path in sorted(glob.glob(os.path.join(version_dir, '*', '*.joblib'))):
+        team_dir, file_name = os.path.split(path)
+        mode = file_name[:-len('.joblib')]
+        try:
+            team_id = int(os.path.basename(team_dir))
+        except ValueError:
+            continue
+        if (team_ids is None or team_id in team_ids) and (modes is None or mode in modes):
+            yield team_id, mode, path
+
+
+def _shap_importance(booster, matrix, groups):
+    # mean |SHAP| per feature - the contributions of a feature's columns are summed per row first (SHAP values add up)
+    contributions = booster.predict(xgb.DMatrix(matrix), pred_contribs=True)
+    # regressors (rows, columns + bias), multi-class (rows, classes, columns + bias)
+    contributions = contributions.reshape(-1, contributions.shape[-1])[:, :-1]
+    return np.array([np.abs(contributions[:, group].sum(axis=1)).mean() for group in groups])
+
+
+def _permutation_importance(model, matrix, y, groups, n_repeats, rng):
+    # the columns of a feature are shuffled with the same row order, as if the original column had been shuffled
+    is_sparse = sparse.issparse(matrix)
+    dense = matrix.toarray() if is_sparse else np.array(matrix)
+    # chunked_training.BoosterModel is not a sklearn classifier, it says whether it is one
+    scorer = accuracy_score if is_classifier(model) or getattr(model, 'classification', False) else r2_score
+
+    def score(X):
+        # back to CSR for a sparse pipeline - XGBoost treats the missing entries of a CSR matrix as missing, not zero
+        return scorer(y, model.predict(sparse.csr_matrix(X) if is_sparse else X))
+
+    baseline = score(dense)
+    importance = np.zeros(len(groups))
+    for i, group in enumerate(groups):
+        original = dense[:, group].copy()
+        drops = []
+        for _ in range(n_repeats):
+            dense[:, group] = original[rng.permutation(len(dense))]
+            drops.append(baseline - score(dense))
+        dense[:, group] = original
+        importance[i] = np.mean(drops)
+    return importance
+
+
+def _booster(model):
+    if hasattr(model, 'get_booster'):
+        return model.get_booster()
+    # chunked_training.BoosterModel
+    if isinstance(getattr(model, 'booster', None), xgb.Booster):
+        return model.booster
+    return None
+
+
+def _encode(y, classes):
+    # the classifier targets as the indices its predictions are, -1 for labels it was never trained on
+    y = np.asarray(y)
+    if classes is None:
+        return y
+    classes = np.asarray(classes)
+    codes = np.searchsorted(classes, y).clip(0, len(classes) - 1)
+    return np.where(classes[codes] == y, codes, -1)
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_cache(cache_path, key):
+    if not (os.path.exists(cache_path + '.json') and os.path.exists(cache_path + '.csv')):
+        return None
+    with open(cache_path + '.json') as f:
+        if json.load(f) != key:
+            return None
+    return pd.read_csv(cache_path + '.csv')
+
+
+def _write_cache(cache_path, key, report):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    report.to_csv(cache_path + '.csv.tmp', index=False)
+    os.replace(cache_path + '.csv.tmp', cache_path + '.csv')
+    with open(cache_path + '.json', 'w') as f:
+        json.dump(key, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--models-dir', default=team_training.MODELS_DIR)
+    parser.add_argument('--version', required=True)
+    parser.add_argument('--teams', nargs='+', type=int, default=None, help='defaults to every club of the version')
+    parser.add_argument('--modes', nargs='+', default=None, choices=team_training.TEAM_MODES)
+    parser.add_argument('--method', default='shap', choices=METHODS)
+    parser.add_argument('--max-rows', type=int, default=MAX_ROWS)
+    parser.add_argument('--repeats', type=int, default=N_REPEATS, help='shuffles per feature for --method permutation')
+    parser.add_argument('--split', default='train', choices=['train', 'test'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--out', default=None, help='csv file for the importances of all the clubs')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    importances = explain_version(load_data.load_tables(args.mode), args.models_dir, args.version, args.teams,
+                                  args.modes, args.method, args.max_rows, args.repeats, args.split, args.seed,
+                                  args.jobs)
+    top = importances[importances['rank'] <= 5]
+    print(top.to_string(index=False))
+    print(f"{importances.groupby(['team_id', 'mode']).ngroups} models explained in {time.perf_counter() - start:.1f}s")
+
+    if args.out:
+        importances.to_csv(args.out, index=False)
+
+
+if __name__ == '__main__':
+    main()
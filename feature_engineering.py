@@ -0,0 +1,164 @@
+# feature engineering - the new columns added to the SPADL actions in Notebook 2
+import numpy as np
+import pandas as pd
+
+
+def add_opponent_and_home(actions, games):
+    """
+    Add the opponent_id and home columns to an actions dataframe (in place), by joining each action to its game in
+    the games table - linear in the number of actions.
+
+    Inputs:
+    - actions:  SPADL actions, needs game_id and team_id
+    - games:    the games table (games.csv / games_test.csv), with game_id as a column or as the index and the
+                home_team_id and away_team_id columns
+
+    Returns the actions dataframe
+    """
+    fixtures = _fixtures(games)
+
+    game_ids = actions['game_id']
+    missing = ~game_ids.isin(fixtures.index)
+    if missing.any():
+        raise ValueError(f'games table is missing game_id(s): {sorted(game_ids[missing].unique())[:10]}')
+
+    home_team = game_ids.map(fixtures['home_team_id']).to_numpy()
+    away_team = game_ids.map(fixtures['away_team_id']).to_numpy()
+    is_home = actions['team_id'].to_numpy() == home_team
+
+    # the opponent is the other team in the fixture
+    actions['opponent_id'] = np.where(is_home, away_team, home_team)
+    # binary flag if the team performing the action is the home team
+    actions['home'] = is_home.astype(int)
+
+    return actions
+
+
+def _fixtures(games):
+    if 'game_id' in games.columns:
+        games = games.set_index('game_id')
+    fixtures = games[['home_team_id', 'away_team_id']]
+    # the same game can appear in more than one games table (e.g. when train and test tables are concatenated)
+    return fixtures[~fixtures.index.duplicated()]
+
+
+# columns carried over from each of the previous actions as n-k_<column>
+CONTEXT_COLUMNS = [
+    'start_pitch_zone',
+    'end_pitch_zone',
+    'start_x',
+    'start_y',
+    'end_x',
+    'end_y',
+    'type_name',
+    'type_name_encoded',
+    'result_name',
+    'bodypart_name',
+    ]
+
+# action values carried over as well, when present - vaep values in the vaep tables, xT values in the xt tables
+VALUE_COLUMNS = [
+    'offensive_value',
+    'defensive_value',
+    'vaep_value',
+    'xT_value',
+    ]
+
+
+def add_action_features(actions):
+    """
+    Add type_name_encoded (pass/dribble/other, see Notebook 3 for the class imbalance) and the x_dif/y_dif distances
+    travelled by the ball (in place)
+
+    Returns the actions dataframe
+    """
+    type_name = actions['type_name'].to_numpy()
+    actions['type_name_encoded'] = np.where(type_name == 'pass', 'pass', np.where(type_name == 'dribble', 'dribble', 'other')).astype(object)
+    actions['x_dif'] = actions['end_x'] - actions['start_x']
+    actions['y_dif'] = actions['end_y'] - actions['start_y']
+    return actions
+
+
+def build_context_features(actions, n_prev=5):
+    """
+    Build the n-1_* ... n-{n_prev}_* context columns used by set_ct_mode - the previous actions in the same game.
+
+    All lags are computed from one set of per-game numpy arrays (a grouped shift over game_id), and the new columns
+    are added to the frame in a single concat, so no intermediate dataframe is created per lag.
+
+    Unlike the Notebook 2 loop, n-k_same_team and n-k_same_player are also computed within the game: the first k
+    actions of a game are False instead of being compared with the end of the previous game.
+
+    Inputs:
+    - actions:  SPADL actions with zones (see pitch_zones.add_pitch_zones), x_dif/y_dif and type_name_encoded are
+                added if they are missing
+    - n_prev:   number of previous actions to add
+
+    Returns a new dataframe with the context columns appended
+    """
+    if not {'x_dif', 'y_dif', 'type_name_encoded'}.issubset(actions.columns):
+        actions = add_action_features(actions.copy())
+
+    game_ids = actions['game_id'].to_numpy()
+    n_rows = len(game_ids)
+
+    # the shift needs the actions of a game to be contiguous - they are in every table we build, otherwise sort
+    # them (stable, so the order within a game is kept) and scatter the results back at the end
+    order = None
+    boundaries = np.flatnonzero(game_ids[1:] != game_ids[:-1]) + 1
+    if n_rows and len(boundaries) + 1 != len(pd.unique(game_ids)):
+        order = np.argsort(game_ids, kind='stable')
+        game_ids = game_ids[order]
+        boundaries = np.flatnonzero(game_ids[1:] != game_ids[:-1]) + 1
+
+    def column(name):
+        values = actions[name].to_numpy()
+        return values if order is None else values[order]
+
+    # position of each action within its game
+    starts = np.concatenate([[0], boundaries])
+    lengths = np.diff(np.concatenate([starts, [n_rows]]))
+    index = np.arange(n_rows)
+    position = index - np.repeat(starts, lengths)
+
+    x_dif = column('x_dif').astype(float)
+    y_dif = column('y_dif').astype(float)
+    team_id = column('team_id')
+    player_id = column('player_id')
+    shifted_columns = CONTEXT_COLUMNS + [col for col in VALUE_COLUMNS if col in actions.columns]
+    shifted_values = {col: column(col) for col in shifted_columns}
+
+    context = {}
+    for n in range(1, n_prev + 1):
+        valid = position >= n
+        source = np.where(valid, index - n, 0)
+
+        prev_x_dif = _shift(x_dif, source, valid)
+        prev_y_dif = _shift(y_dif, source, valid)
+
+        context[f'n-{n}_x_distance'] = prev_x_dif
+        context[f'n-{n}_y_distance'] = prev_y_dif
+        context[f'n-{n}_same_team'] = valid & (team_id[source] == team_id)
+        context[f'n-{n}_same_player'] = valid & (player_id[source] == player_id)
+        # NaN (no previous action) compares False, so it is encoded as 0 like in Notebook 2
+        context[f'n-{n}_x_fwd_direction'] = (prev_x_dif > 0).astype(int)
+        context[f'n-{n}_y_lft_right_direction'] = (prev_y_dif > 0).astype(int)
+        for col in shifted_columns:
+            context[f'n-{n}_{col}'] = _shift(shifted_values[col], source, valid)
+
+    if order is not None:
+        inverse = np.empty_like(order)
+        inverse[order] = index
+        context = {name: values[inverse] for name, values in context.items()}
+
+    return pd.concat([actions, pd.DataFrame(context, index=actions.index)], axis=1)
+
+
+def _shift(values, source, valid):
+    shifted = values[source]
+    if shifted.dtype.kind in 'biu':
+        shifted = shifted.astype(float)
+    elif shifted.dtype.kind not in 'fO':
+        shifted = shifted.astype(object)
+    shifted[~valid] = np.nan
+    return shifted
@@ -0,0 +1,247 @@
+# incremental ingest - add new matches to the vaep / xt / games / players tables without rebuilding them (Notebook 2)
+#
+#   python incremental_ingest.py --root statsbomb/data --games 37:90 --out data/partitioned \
+#       --vaep-model models/vaep.pkl --xt-model models/xt.pkl
+#
+# only the game_ids that are not in the output yet are processed, each on its own: SPADL conversion, VAEP ratings and
+# xT values from the already fitted models, left to right play, pitch zones, opponent / home and the n-1 ... n-5
+# context features (which never cross a game boundary). Every table is partitioned by season and game
+#
+#   <out>/<table>/season_id=<season_id>/game_id=<game_id>/part.parquet
+#
+# so ingest time depends on the number of new games, not on the history. A game is marked done in <out>/_ingested
+# once all its partitions are written - re-running is idempotent and an interrupted game is simply redone.
+#
+# with the default --out data/partitioned the new games reach everything that reads the tables through load_data:
+# load_data('partitioned') / load_tables('partitioned') (and --mode partitioned of the scripts) read the partitions,
+# with the load_data.TEST_SEASONS seasons as the *_test tables, and their parquet cache is rebuilt whenever a
+# partition is added or rewritten.
+#
+# the VAEP model is pickled by `dataset_build.py --model-out`, and the xT model can be fitted once from the existing
+# dataset_build shards with --fit-xt. Refitting either model on the new history is a separate (full) rebuild.
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+import socceraction.spadl as spadl
+import socceraction.xthreat as xthreat
+from socceraction.data.statsbomb import StatsBombLoader
+
+import dataset_build
+import feature_engineering
+import load_data
+import pitch_zones
+
+TABLES = ['vaep', 'xt', 'games', 'players']
+
+# the xT grid of Notebook 2
+XT_GRID = {'l': 16, 'w': 12}
+
+# the columns Notebook 2 adds to the actions, in order, before the n-k context columns
+DERIVED_COLUMNS = ['start_pitch_zone', 'end_pitch_zone', 'opponent_id', 'type_name_encoded', 'home', 'x_dif', 'y_dif']
+
+# per worker process: the StatsBomb loader and the unpickled models
+_loader = None
+_models = {}
+
+
+def ingested_games(out_dir):
+    """
+    Returns the set of game_ids already ingested into out_dir
+    """
+    marker_dir = os.path.join(out_dir, '_ingested')
+    if not os.path.isdir(marker_dir):
+        return set()
+    return {int(name[:-len('.json')]) for name in os.listdir(marker_dir) if name.endswith('.json')}
+
+
+def ingest(df_games, out_dir, vaep_model_path, xt_model_path, loader_kwargs=None, n_jobs=None):
+    """
+    Ingest every game of df_games that is not in out_dir yet, on a process pool.
+
+    Inputs:
+    - df_games:         games table indexed by game_id, as returned by dataset_build.load_games
+    - out_dir:          root of the partitioned tables
+    - vaep_model_path:  pickled fitted VAEP model
+    - xt_model_path:    pickled fitted ExpectedThreat model
+    - loader_kwargs:    arguments for StatsBombLoader, e.g. {'getter': 'local', 'root': 'statsbomb/data'}
+    - n_jobs:           number of worker processes, defaults to the number of cpus
+
+    Returns the list of the newly ingested game_ids
+    """
+    done = ingested_games(out_dir)
+    todo = [game_id for game_id in df_games.index if game_id not in done]
+    if not todo:
+        return []
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(ingest_game, game_id, df_games.loc[game_id], out_dir, vaep_model_path, xt_model_path,
+                               loader_kwargs)
+                   for game_id in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='ingesting games'):
+            # re-raise any worker error - the games already ingested are kept
+            future.result()
+
+    return todo
+
+
+def ingest_game(game_id, game, out_dir, vaep_model_path, xt_model_path, loader_kwargs=None):
+    """
+    Build and write the vaep, xt, games and players partitions of one game. Runs in the worker processes.
+
+    Returns the game_id
+    """
+    global _loader
+    if _loader is None:
+        _loader = StatsBombLoader(**(loader_kwargs or {}))
+
+    start = time.perf_counter()
+
+    # SPADL actions, VAEP features and labels - the same per-game shard as dataset_build
+    shard_dir = os.path.join(out_dir, '_shards')
+    dataset_build.convert_game(game_id, game, shard_dir, loader_kwargs)
+    game_actions = dataset_build.read_shards(shard_dir, [game_id], 'actions')
+    game_features = dataset_build.read_shards(shard_dir, [game_id], 'features')
+
+    ratings = _model(vaep_model_path).rate(game, game_actions, game_features)
+    rated = pd.concat([game_actions, ratings.reset_index(drop=True)], axis=1)
+    games = game.to_frame().T.rename_axis('game_id').reset_index().infer_objects()
+
+    # vaep table - every action with its VAEP values
+    vaep = derive_features(spadl.play_left_to_right(rated, game['home_team_id']), games)
+
+    # xt table - the successful ball moving actions with their xT values
+    actions_ltr = spadl.add_names(spadl.play_left_to_right(game_actions, game['home_team_id']))
+    moves = xthreat.get_successful_move_actions(actions_ltr)
+    moves['xT_value'] = _xt_values(_model(xt_model_path), moves)
+    xt = derive_features(moves, games)
+
+    players = _loader.players(game_id)
+
+    season_id = game['season_id']
+    for table, df in (('vaep', vaep), ('xt', xt), ('games', games), ('players', players)):
+        _write_partition(df, out_dir, table, season_id, game_id)
+
+    # the marker is written last, a game without it is redone
+    marker_dir = os.path.join(out_dir, '_ingested')
+    os.makedirs(marker_dir, exist_ok=True)
+    with open(os.path.join(marker_dir, f'{game_id}.json.tmp'), 'w') as f:
+        json.dump({'game_id': int(game_id), 'season_id': int(season_id), 'vaep_rows': len(vaep), 'xt_rows': len(xt),
+                   'seconds': time.perf_counter() - start}, f)
+    os.replace(os.path.join(marker_dir, f'{game_id}.json.tmp'), os.path.join(marker_dir, f'{game_id}.json'))
+
+    return game_id
+
+
+def derive_features(actions, games):
+    """
+    The Notebook 2 feature steps for the (left to right) actions of one or more games: pitch zones, opponent / home,
+    type_name_encoded, x_dif / y_dif and the n-1 ... n-5 context columns
+
+    Returns a new dataframe, columns in the order of vaep.csv / xt.csv
+    """
+    actions = actions.reset_index(drop=True)
+    base_columns = list(actions.columns)
+
+    pitch_zones.add_pitch_zones(actions)
+    feature_engineering.add_opponent_and_home(actions, games)
+    feature_engineering.add_action_features(actions)
+    actions = actions[base_columns + DERIVED_COLUMNS]
+
+    return feature_engineering.build_context_features(actions, n_prev=dataset_build.NB_PREV_ACTIONS)
+
+
+def read_table(out_dir, table, season_ids=None):
+    """
+    Read a partitioned table back as one dataframe, in (season, game) order - e.g. read_table(out_dir, 'vaep') is the
+    equivalent of vaep.csv (see load_data.read_partitioned; load_data('partitioned') reads the tables of data/partitioned)
+
+    Inputs:
+    - out_dir:     root of the partitioned tables
+    - table:       one of TABLES
+    - season_ids:  only read these seasons, defaults to all
+    """
+    return load_data.read_partitioned(out_dir, table, season_ids)
+
+
+def partition_paths(out_dir, table, season_ids=None):
+    """
+    Returns the parquet files of a partitioned table, in (season, game) order
+    """
+    return load_data.partition_paths(out_dir, table, season_ids)
+
+
+def fit_xt_model(shard_dir, df_games):
+    """
+    Fit the Notebook 2 xT model (16 x 12 grid) on the left to right actions of the dataset_build shards of df_games
+
+    Returns the fitted ExpectedThreat model
+    """
+    actions_ltr = pd.concat([
+        spadl.play_left_to_right(dataset_build.read_shards(shard_dir, [game_id], 'actions'), game['home_team_id'])
+        for game_id, game in df_games.iterrows()])
+
+    xT_model = xthreat.ExpectedThreat(**XT_GRID)
+    xT_model.fit(spadl.add_names(actions_ltr))
+    return xT_model
+
+
+def _model(path):
+    if path not in _models:
+        with open(path, 'rb') as f:
+            _models[path] = pickle.load(f)
+    return _models[path]
+
+
+def _xt_values(xT_model, moves):
+    # ExpectedThreat.predict was renamed to rate in later socceraction releases
+    if hasattr(xT_model, 'predict'):
+        return xT_model.predict(moves)
+    return xT_model.rate(moves)
+
+
+def _write_partition(df, out_dir, table, season_id, game_id):
+    partition_dir = os.path.join(out_dir, table, f'season_id={season_id}', f'game_id={game_id}')
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, 'part.parquet')
+    df.reset_index(drop=True).to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True, help='StatsBomb open-data format event directory')
+    parser.add_argument('--games', nargs='+', required=True, metavar='COMPETITION:SEASON',
+                        help='competition and season ids to look for new games in, e.g. 37:90')
+    parser.add_argument('--out', default=load_data.PARTITIONED_DIR, help='root directory of the partitioned tables')
+    parser.add_argument('--vaep-model', required=True, help='pickled VAEP model, from dataset_build.py --model-out')
+    parser.add_argument('--xt-model', required=True, help='pickled xT model')
+    parser.add_argument('--fit-xt', metavar='SHARD_DIR', default=None,
+                        help='fit the xT model on the dataset_build shards of the --games seasons, if --xt-model does '
+                             'not exist yet')
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    loader_kwargs = {'getter': 'local', 'root': args.root}
+    competition_seasons = [tuple(int(i) for i in pair.split(':')) for pair in args.games]
+    df_games = dataset_build.load_games(competition_seasons, loader_kwargs)
+
+    if args.fit_xt and not os.path.exists(args.xt_model):
+        built = [game_id for game_id in df_games.index if dataset_build.shard_complete(args.fit_xt, game_id)]
+        with open(args.xt_model, 'wb') as f:
+            pickle.dump(fit_xt_model(args.fit_xt, df_games.loc[built]), f)
+
+    start = time.perf_counter()
+    new_games = ingest(df_games, args.out, args.vaep_model, args.xt_model, loader_kwargs, args.jobs)
+    print(f'{len(new_games)} new games ingested in {time.perf_counter() - start:.1f}s '
+          f'({len(df_games) - len(new_games)} already in {args.out})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+# instrumentation - opt-in timing and memory records for the data loading, pre-processing and model steps
+#
+#   import instrumentation
+#   instrumentation.enable('data/profile.jsonl')
+#   ... load data, create team data, fit and predict as usual ...
+#   instrumentation.summary()
+#   instrumentation.disable()
+#
+#   python instrumentation.py data/profile.jsonl      # summary of the records of a batch job
+#
+# enable() wraps load_data, create_team_data / create_player_data, the column transformer fit / transform and the
+# model fit / predict calls, and every call is recorded with its wall time, CPU time, RSS, peak RSS, rows / columns
+# and cache hits. Nothing is wrapped until enable() is called and disable() puts the original functions back, so
+# turned off it costs nothing. Process pools started after enable() (fork) record into the same file.
+import argparse
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# (module, attribute, stage) of every instrumented call - methods only inherited by a class are wrapped on the class
+# that defines them
+TARGETS = [
+    ('load_data', 'load_data', 'load_data'),
+    ('load_data', 'CachedTables.__getitem__', 'load_data'),
+    ('pre_processing_utils', 'create_team_data', 'create_team_data'),
+    ('pre_processing_utils', 'create_player_data', 'create_player_data'),
+    ('pre_processing_utils', 'PreparedData.create_team_data', 'create_team_data'),
+    ('pre_processing_utils', 'PreparedData.create_player_data', 'create_player_data'),
+    ('pre_processing_utils', 'CachedColumnTransformer.fit', 'ct_fit'),
+    ('pre_processing_utils', 'CachedColumnTransformer.transform', 'ct_transform'),
+    ('sklearn.compose', 'ColumnTransformer.fit', 'ct_fit'),
+    ('sklearn.compose', 'ColumnTransformer.fit_transform', 'ct_fit'),
+    ('sklearn.compose', 'ColumnTransformer.transform', 'ct_transform'),
+    ('xgboost', 'XGBModel.fit', 'model_fit'),
+    ('xgboost', 'XGBModel.predict', 'model_predict'),
+    ('xgboost', 'XGBClassifier.fit', 'model_fit'),
+    ('xgboost', 'XGBClassifier.predict', 'model_predict'),
+    ('xgboost', 'XGBClassifier.predict_proba', 'model_predict'),
+    ('sklearn.ensemble._forest', 'BaseForest.fit', 'model_fit'),
+    ('sklearn.ensemble._forest', 'ForestRegressor.predict', 'model_predict'),
+    ('sklearn.ensemble._forest', 'ForestClassifier.predict_proba', 'model_predict'),
+    ('sklearn.linear_model', 'LinearRegression.fit', 'model_fit'),
+    ('sklearn.linear_model._base', 'LinearModel.predict', 'model_predict'),
+    ]
+
+records = []
+
+_patched = []
+_state = threading.local()
+_lock = threading.Lock()
+_output = {'path': None, 'file': None, 'pid': None}
+
+
+def enable(path=None):
+    """
+    Start recording - wraps every TARGETS call that can be imported
+
+    Inputs:
+    - path:  JSON lines file the records are appended to (as well as kept in instrumentation.records)
+    """
+    if _patched:
+        disable()
+    _output.update(path=path, file=None, pid=None)
+
+    for module_name, attribute, stage in TARGETS:
+        try:
+            owner = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        *owner_path, name = attribute.split('.')
+        for part in owner_path:
+            owner = getattr(owner, part, None)
+        if owner is None or name not in vars(owner):
+            continue
+
+        original = vars(owner)[name]
+        setattr(owner, name, _wrap(original, stage, f'{module_name}.{attribute}'))
+        _patched.append((owner, name, original))
+
+
+def disable():
+    """
+    Stop recording and put the original functions back
+    """
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    if _output['file'] is not None:
+        _output['file'].close()
+    _output.update(path=None, file=None, pid=None)
+
+
+def enabled():
+    return bool(_patched)
+
+
+@contextmanager
+def instrumented(path=None):
+    """
+    with instrumentation.instrumented('data/profile.jsonl'): ... - enable() for the duration of the block
+    """
+    enable(path)
+    try:
+        yield
+    finally:
+        disable()
+
+
+@contextmanager
+def stage(name):
+    """
+    Record a block of code as its own stage, e.g. one team of a batch job - the records of the calls inside it carry
+    the name in their context. Does nothing while instrumentation is off.
+    """
+    if not _patched:
+        yield
+        return
+
+    context = getattr(_state, 'context', ())
+    _state.context = context + (name,)
+    try:
+        with _measure(name, name, (), None):
+            yield
+    finally:
+        _state.context = context
+
+
+def summary(source=None):
+    """
+    Per stage totals of the records: calls, wall and CPU seconds, peak RSS, rows and cache hits
+
+    Inputs:
+    - source:  records (a list of dicts) or the path of a JSON lines file, defaults to the records of this session
+
+    Returns a DataFrame indexed by stage, slowest first
+    """
+    if source is None:
+        source = records
+    if isinstance(source, str):
+        source = load_records(source)
+    df = pd.DataFrame(source)
+    if df.empty:
+        return df
+
+    table = df.groupby('stage').agg(
+        calls=('wall_s', 'size'),
+        wall_s=('wall_s', 'sum'),
+        mean_wall_s=('wall_s', 'mean'),
+        cpu_s=('cpu_s', 'sum'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+        rows=('rows', 'sum'),
+        cache_hits=('cache_hits', 'sum'),
+        errors=('error', 'count'),
+        )
+    return table.sort_values('wall_s', ascending=False)
+
+
+def load_records(path):
+    """
+    Returns the records of a JSON lines file written by enable(path)
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _wrap(function, stage_name, qualname):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # only the outermost call of a stage is recorded, e.g. ColumnTransformer.fit calling its own fit_transform
+        active = getattr(_state, 'active', set())
+        if stage_name in active:
+            return function(*args, **kwargs)
+
+        _state.active = active | {stage_name}
+        try:
+            with _measure(stage_name, qualname, args, kwargs) as result:
+                result.append(function(*args, **kwargs))
+            return result[0]
+        finally:
+            _state.active = active
+
+    return wrapper
+
+
+@contextmanager
+def _measure(stage_name, qualname, args, kwargs):
+    result = []
+    hits = _cache_hits()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    error = None
+    try:
+        yield result
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        rows, cols = _shape(result[0]) if result else (None, None)
+        if rows is None and args:
+            rows, cols = _shape(_first_data(args, kwargs))
+
+        _record({
+            'stage': stage_name,
+            'call': qualname,
+            'context': '/'.join(getattr(_state, 'context', ())),
+            'start': time.time() - wall,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'rss_mb': _rss_mb(),
+            'peak_rss_mb': _peak_rss_mb(),
+            'rows': rows,
+            'cols': cols,
+            'cache_hits': _cache_hits() - hits,
+            'pid': os.getpid(),
+            'error': error,
+            })
+
+
+def _record(record):
+    with _lock:
+        records.append(record)
+        if _output['path'] is None:
+            return
+        # a forked worker opens its own handle on the file
+        if _output['file'] is None or _output['pid'] != os.getpid():
+            _output['file'] = open(_output['path'], 'a')
+            _output['pid'] = os.getpid()
+        _output['file'].write(json.dumps(record, default=str) + '\n')
+        _output['file'].flush()
+
+
+def _first_data(args, kwargs):
+    # the X of fit / transform / predict (after self), or the first dataframe argument of the other calls
+    for value in list(args) + list((kwargs or {}).values()):
+        if hasattr(value, 'shape'):
+            return value
+    return None
+
+
+def _shape(value):
+    if isinstance(value, (tuple, list)):
+        shapes = [_shape(item) for item in value if hasattr(item, 'shape')]
+        if shapes:
+            return sum(rows for rows, cols in shapes), max(cols or 0 for rows, cols in shapes)
+        return None, None
+    shape = getattr(value, 'shape', None)
+    if not shape:
+        return None, None
+    return int(shape[0]), int(shape[1]) if len(shape) > 1 else 1
+
+
+def _cache_hits():
+    # load_data's columnar cache and the fitted column transformer cache - only once those modules are in use
+    hits = 0
+    for module_name, function in (('load_data', 'cache_info'), ('pre_processing_utils', 'ct_cache_info')):
+        module = importlib.sys.modules.get(module_name)
+        if module is not None and hasattr(module, function):
+            hits += getattr(module, function)()['hits']
+    return hits
+
+
+def _rss_mb():
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def _peak_rss_mb():
+    # the process high water mark so far - ru_maxrss is in KB on linux
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='JSON lines file written by instrumentation.enable(path)')
+    args = parser.parse_args()
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summary(args.path).round(3))
+
+
+if __name__ == '__main__':
+    main()
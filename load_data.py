@@ -1,30 +1,304 @@
 # load data
+import glob
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-import config 
 
-def load_data(mode):
+TABLES = ['xt', 'xt_test', 'vaep', 'vaep_test', 'games', 'games_test', 'players', 'players_test', 'target_players']
+
+# the action tables, converted to the pre_processing_utils.feature_schema dtypes with compact=True
+ACTION_TABLES = ['xt', 'xt_test', 'vaep', 'vaep_test']
+
+CACHE_DIR = 'data/cache'
+
+MODES = ['local', 's3', 'partitioned']
+
+# the tables incremental_ingest.py writes, partitioned by season and game
+PARTITIONED_DIR = 'data/partitioned'
+PARTITIONED_TABLES = ['vaep', 'xt', 'games', 'players']
+
+# the season of the *_test tables in partitioned mode (FA WSL 2020/21, as in Notebook 2) - the other seasons of the
+# partitioned tables are the train tables
+TEST_SEASONS = [90]
+
+# columns stored as categoricals in the columnar cache
+CATEGORICAL_SUFFIXES = ('_pitch_zone', '_name', '_same_team')
+
+# tables read from the cache vs rebuilt from their source, since the start of the session
+_cache_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def load_data(mode, cache=False, cache_dir=CACHE_DIR, check='mtime', compact=False):
+    """
+    Inputs:
+    - mode:       's3' to read the config.py URLs (concurrently, through the s3_loader.py ETag cache), 'local' to read
+                  the csv files in data/, 'partitioned' to read the vaep / xt / games / players tables incremental_ingest.py
+                  writes to data/partitioned (TEST_SEASONS are the *_test tables) and target_players from data/
+    - cache:      read the tables through the columnar (parquet) cache in cache_dir, building it on first use
+    - cache_dir:  where the cached tables are written
+    - check:      how a cached table is validated against its source, 'mtime' (mtime + size) or 'hash' (content hash)
+    - compact:    convert the vaep / xt tables to the memory-compact dtypes of pre_processing_utils.feature_schema
+                  (categories, bool / int8 flags and float32 numbers)
+
+    Returns xt, xt_test, vaep, vaep_test, games, games_test, players, players_test, target_players
+    """
+    if cache:
+        tables = load_tables(mode, cache_dir=cache_dir, check=check, compact=compact)
+        if mode == 's3':
+            tables.prefetch()
+        return tables.as_tuple()
+
+    if mode == 's3':
+        # the objects are downloaded concurrently, and only when their ETag changed - see s3_loader.py
+        import s3_loader
+        frames = s3_loader.fetch_tables({table: _source(mode, table) for table in TABLES})
+    else:
+        frames = {table: _read(_path(mode, table)) for table in TABLES}
+
+    return tuple(_compact(frames[table]) if compact and table in ACTION_TABLES else frames[table] for table in TABLES)
+
+
+def load_tables(mode, cache_dir=CACHE_DIR, check='mtime', compact=False):
+    """
+    Lazy version of load_data - nothing is read until a table is first used, e.g.
+
+        tables = load_data.load_tables('local')
+        vaep = tables.vaep      # read from the cache (or the csv, on first use) here
+
+    Returns a CachedTables object
+    """
+    return CachedTables(mode, cache_dir=cache_dir, check=check, compact=compact)
+
+
+class CachedTables:
+    """
+    Lazy handles on the project tables. Each table is read on first attribute/item access and kept afterwards.
+
+    On a cache miss the source csv is parsed once and written to cache_dir as parquet, with categorical dtypes for the
+    *_pitch_zone, *_name and *_same_team columns. A sidecar json keeps the source fingerprint, so the cached table is
+    rebuilt whenever the source csv changes. With compact=True the vaep / xt tables are converted to the
+    pre_processing_utils.feature_schema dtypes as they are read.
+
+    In s3 mode the source is the s3_loader.py copy of the object, brought up to date with a conditional request (only
+    downloaded when its ETag changed), and the fingerprint is its ETag.
+    """
+
+    def __init__(self, mode, cache_dir=CACHE_DIR, check='mtime', compact=False):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}, got {mode!r}')
+        if check not in ('mtime', 'hash'):
+            raise ValueError(f"check must be 'mtime' or 'hash', got {check!r}")
+
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.check = check
+        self.compact = compact
+        self._frames = {}
+
+    def __getattr__(self, table):
+        if table.startswith('_') or table not in TABLES:
+            raise AttributeError(table)
+        return self[table]
+
+    def __getitem__(self, table):
+        if table not in TABLES:
+            raise KeyError(table)
+        if table not in self._frames:
+            df = _read_cached(self.mode, table, self.cache_dir, self.check)
+            self._frames[table] = _compact(df) if self.compact and table in ACTION_TABLES else df
+        return self._frames[table]
+
+    def __repr__(self):
+        return f'CachedTables(mode={self.mode!r}, loaded={self.loaded})'
+
+    @property
+    def loaded(self):
+        return [table for table in TABLES if table in self._frames]
+
+    def as_tuple(self):
+        return tuple(self[table] for table in TABLES)
+
+    def prefetch(self, tables=TABLES, max_workers=None):
+        """
+        Read several tables concurrently (e.g. the s3 objects, downloaded in parallel) - returns self
+        """
+        missing = [table for table in tables if table not in self._frames]
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers or len(missing)) as pool:
+                list(pool.map(self.__getitem__, missing))
+        return self
+
+
+def cache_info():
+    """
+    Returns the number of tables read from the columnar cache (hits) and rebuilt from their source (misses)
+    """
+    return dict(_cache_stats)
+
+
+def _source(mode, table):
     if mode == 's3':
-        xt              = pd.read_csv(config.xt)
-        xt_test         = pd.read_csv(config.xt_test)
-        vaep            = pd.read_csv(config.vaep)
-        vaep_test       = pd.read_csv(config.vaep_test)
-
-        games           = pd.read_csv(config.games)
-        games_test      = pd.read_csv(config.games_test)
-        players         = pd.read_csv(config.players)
-        players_test    = pd.read_csv(config.players_test)
-        target_players  = pd.read_csv(config.target_players)
-
-    if mode == 'local':
-        xt              = pd.read_csv('data/xt.csv')
-        xt_test         = pd.read_csv('data/xt_test.csv')
-        vaep            = pd.read_csv('data/vaep.csv')
-        vaep_test       = pd.read_csv('data/vaep_test.csv')
-
-        games           = pd.read_csv('data/games.csv')
-        games_test      = pd.read_csv('data/games_test.csv')
-        players         = pd.read_csv('data/players.csv')
-        players_test    = pd.read_csv('data/players_test.csv')
-        target_players  = pd.read_csv('data/target_players.csv')
-
-    return xt, xt_test, vaep, vaep_test, games, games_test, players, players_test, target_players
\ No newline at end of file
+        # config.py holds the s3 URLs and is not in git, so only import it when it is needed
+        import config
+        return getattr(config, table)
+
+    if mode == 'partitioned' and _base_table(table) in PARTITIONED_TABLES:
+        return os.path.join(PARTITIONED_DIR, _base_table(table))
+
+    if mode in ('local', 'partitioned'):
+        return f'data/{table}.csv'
+
+    raise ValueError(f'mode must be one of {MODES}, got {mode!r}')
+
+
+def _path(mode, table):
+    # what a local or partitioned table is read from - a csv file, or the list of the table's partition files
+    source = _source(mode, table)
+    if mode == 'partitioned' and _base_table(table) in PARTITIONED_TABLES:
+        base = _base_table(table)
+        test = table != base
+        seasons = [season_id for season_id in partition_seasons(PARTITIONED_DIR, base)
+                   if (season_id in TEST_SEASONS) == test]
+        return partition_paths(PARTITIONED_DIR, base, seasons)
+    return source
+
+
+def _base_table(table):
+    return table[:-len('_test')] if table.endswith('_test') else table
+
+
+def _read(path, usecols=None):
+    """
+    Read a table from a csv file, or from the list of its partition files (in order)
+    """
+    if isinstance(path, list):
+        if not path:
+            raise FileNotFoundError('no partitions for the table - run incremental_ingest.py first')
+        return pd.concat([pd.read_parquet(file_path, columns=usecols) for file_path in path], ignore_index=True)
+    return pd.read_csv(path, usecols=usecols)
+
+
+def read_partitioned(out_dir, table, season_ids=None):
+    """
+    Read a table partitioned by incremental_ingest.py back as one dataframe, in (season, game) order - e.g.
+    read_partitioned(out_dir, 'vaep') is the equivalent of vaep.csv
+
+    Inputs:
+    - out_dir:     root of the partitioned tables
+    - table:       one of PARTITIONED_TABLES
+    - season_ids:  only read these seasons, defaults to all
+    """
+    return _read(partition_paths(out_dir, table, season_ids))
+
+
+def partition_seasons(out_dir, table):
+    """
+    Returns the season_ids of a partitioned table, sorted
+    """
+    return sorted(_partition_value(path) for path in glob.glob(os.path.join(out_dir, table, 'season_id=*')))
+
+
+def partition_paths(out_dir, table, season_ids=None):
+    """
+    Returns the parquet files of a partitioned table, in (season, game) order
+    """
+    if season_ids is None:
+        season_ids = partition_seasons(out_dir, table)
+
+    paths = []
+    for season_id in sorted(season_ids):
+        game_dirs = glob.glob(os.path.join(out_dir, table, f'season_id={season_id}', 'game_id=*'))
+        paths += [os.path.join(game_dir, 'part.parquet') for game_dir in sorted(game_dirs, key=_partition_value)]
+    return paths
+
+
+def _partition_value(path):
+    return int(os.path.basename(path).split('=', 1)[1])
+
+
+def _resolve(mode, table, check):
+    """
+    Returns the source of a table, the local file (or partition files) to read it from and its fingerprint - in s3
+    mode the file is the s3_loader.py copy of the object (downloaded only when its ETag changed) and the fingerprint
+    its ETag
+    """
+    source = _source(mode, table)
+    if mode == 's3':
+        import s3_loader
+        etag, path = s3_loader.fetch_file(source)
+        return source, path, {'etag': etag} if etag else None
+    path = _path(mode, table)
+    return source, path, _fingerprint(path, check)
+
+
+def _fingerprint(source, check):
+    """
+    Identify the current version of a local source file, or of a list of partition files - None if it cannot be
+    determined, in which case the cache is not trusted (the remote sources are identified by their ETag, see _resolve)
+    """
+    if isinstance(source, list):
+        # a new, rewritten or removed partition changes the fingerprint
+        parts = [_fingerprint(path, check) for path in source]
+        if not parts or None in parts:
+            return None
+        digest = hashlib.sha1(json.dumps(list(zip(source, parts)), sort_keys=True).encode())
+        return {'partitions': len(parts), 'sha1': digest.hexdigest()}
+
+    if not os.path.exists(source):
+        return None
+
+    if check == 'hash':
+        digest = hashlib.sha1()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return {'sha1': digest.hexdigest()}
+
+    stat = os.stat(source)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _compact(df):
+    # the schema is built from the set_ct_mode feature lists - imported here so load_data does not need scikit-learn
+    import pre_processing_utils
+    return pre_processing_utils.apply_schema(df)
+
+
+def _categorise(df):
+    for col in df.columns:
+        if col.endswith(CATEGORICAL_SUFFIXES) and df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _read_cached(mode, table, cache_dir, check):
+    source, path, fingerprint = _resolve(mode, table, check)
+    data_path = os.path.join(cache_dir, f'{table}.parquet')
+    meta_path = os.path.join(cache_dir, f'{table}.json')
+
+    if fingerprint is not None and os.path.exists(data_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('source') == source and meta.get('fingerprint') == fingerprint:
+            with _stats_lock:
+                _cache_stats['hits'] += 1
+            return pd.read_parquet(data_path)
+
+    with _stats_lock:
+        _cache_stats['misses'] += 1
+    df = _categorise(_read(path))
+
+    # write to a temporary file first so an interrupted write never leaves a half written table behind
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = data_path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, data_path)
+    with open(meta_path, 'w') as f:
+        json.dump({'source': source, 'fingerprint': fingerprint}, f)
+
+    return df
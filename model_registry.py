@@ -0,0 +1,625 @@
+# model registry - the team_training.py pipelines in a compact form that loads without scikit-learn or XGBoost
+#
+#   python model_registry.py export --models-dir models --version 20230101-120000
+#   python model_registry.py cold-start --models-dir models --version 20230101-120000 --team 965
+#
+#   model_registry.save_artifact({'pipeline': pipe_vaep, 'mode': 'team-vaep', 'team_id': 965, 'classes': None},
+#                                'models/registry')                # a Notebook 6 pipeline
+#   artifact = model_registry.load_artifact('models/registry', 965, 'team-vaep')
+#   team_training.predict(artifact, X)                               # as with the joblib artifacts
+#
+# every (club, mode) pipeline is written as
+#
+#   <registry_dir>/<team_id>/<mode>.json       the fitted column transformer (features, scaler means and scales, one-hot
+#                                              categories, sparse / dense output - ppu.transformer_state), the classes,
+#                                              the objective and the margin bias of the booster
+#   <registry_dir>/<team_id>/<mode>.ubj        the booster in XGBoost's own UBJSON format (<mode>.booster.json, its
+#                                              JSON format, before XGBoost 1.6) - loads back into XGBoost
+#   <registry_dir>/<team_id>/<mode>.trees.npz  the booster's trees flattened into a few node arrays
+#
+# load_artifact reads the description and the tree arrays with json and numpy only (the booster file is parsed instead
+# when the arrays are missing, a few times slower): the scaler and the one-hot encoder are a few array operations, and
+# the trees are walked for all the rows and all the trees at once. Entries a sparse (CSR) transformer output leaves
+# out are missing values to XGBoost, so they go down the trees' default branch here too. The predictions are the
+# pipeline's, up to float rounding of the tree sums.
+#
+# the cold start of a club (a fresh interpreter importing this module, loading the club's four models and predicting
+# once with each) is measured by measure_cold_start and checked against COLD_START_BUDGET, so the scoring service and
+# the batch jobs keep starting fast.
+import argparse
+import glob
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REGISTRY_DIR = 'registry'
+
+# team_training.TEAM_MODES, repeated so loading does not import the training modules
+TEAM_MODES = ['team-vaep', 'team-xt', 'team-action', 'team-end']
+
+# seconds for a club's four models - interpreter start, import, load and one prediction each
+COLD_START_BUDGET = 0.5
+
+# what turns the margin into the predictions, per XGBoost objective
+OBJECTIVES = {
+    'reg:squarederror': 'identity', 'reg:linear': 'identity', 'reg:absoluteerror': 'identity',
+    'reg:pseudohubererror': 'identity', 'binary:logitraw': 'identity',
+    'reg:logistic': 'logistic', 'binary:logistic': 'logistic',
+    'multi:softprob': 'softmax', 'multi:softmax': 'softmax',
+    'count:poisson': 'exp', 'reg:gamma': 'exp', 'reg:tweedie': 'exp',
+    }
+
+# modules the loader must not need
+HEAVY_MODULES = ['sklearn', 'xgboost', 'scipy', 'pandas', 'joblib']
+
+# (rows x trees) nodes walked at once
+BLOCK_SIZE = 1 << 22
+
+
+class CompactPipeline:
+    """
+    The prediction side of a pipeline from its registry files - the column transformer and the trees in numpy.
+    predict returns what the pipeline's predict returns (class indices for the label-encoded classifiers).
+    """
+
+    def __init__(self, description, trees):
+        self.description = description
+        transformer = description['transformer']
+        self.numeric_features = transformer['numeric_features']
+        self.categorical_features = transformer['categorical_features']
+        self.mean = np.asarray(transformer['mean'], dtype=float)
+        self.scale = np.asarray(transformer['scale'], dtype=float)
+        self.categories = [np.asarray(values, dtype=dtype)
+                           for values, dtype in zip(transformer['categories'], transformer['category_dtypes'])]
+        self.sparse_output_ = transformer['sparse_output_']
+        self.offsets = len(self.numeric_features) + np.cumsum([0] + [len(values) for values in self.categories])
+
+        self.output = description['output']
+        self.labels = None if description['labels'] is None else np.asarray(description['labels'])
+        self.bias = np.asarray(description['bias'], dtype=float)
+        self.roots, self.groups = trees['roots'], trees['groups']
+        self.left, self.right, self.feature = trees['left'], trees['right'], trees['feature']
+        self.threshold, self.default_left = trees['threshold'], trees['default_left']
+        # the leaves are their own children, and their split condition is their value
+        self.is_leaf = self.left == np.arange(len(self.left))
+        self.value = np.where(self.is_leaf, self.threshold, 0).astype(np.float32)
+        self.group_matrix = np.eye(len(self.bias))[self.groups]
+
+    def transform(self, X):
+        """
+        The transformer's output as a dense float32 matrix, with NaN for the entries XGBoost sees as missing
+        """
+        n_rows = len(_column(X, (self.numeric_features + self.categorical_features)[0]))
+        matrix = np.zeros((n_rows, self.offsets[-1]))
+        for i, col in enumerate(self.numeric_features):
+            matrix[:, i] = (_column(X, col).astype(float) - self.mean[i]) / self.scale[i]
+        for i, col in enumerate(self.categorical_features):
+            codes = _encode(_column(X, col), self.categories[i])
+            known = codes >= 0
+            matrix[np.flatnonzero(known), self.offsets[i] + codes[known]] = 1
+
+        missing = matrix == 0 if self.sparse_output_ else None
+        matrix = matrix.astype(np.float32)
+        if missing is not None:
+            matrix[missing] = np.nan
+        return matrix
+
+    def predict_margin(self, X):
+        """
+        Returns the booster's margin (raw scores) - (rows,) or (rows, classes)
+        """
+        margin = self._margin(self.transform(X))
+        return margin[:, 0] if margin.shape[1] == 1 else margin
+
+    def predict(self, X):
+        margin = self._margin(self.transform(X))
+        if self.labels is not None:
+            if margin.shape[1] == 1:
+                return self.labels[(margin[:, 0] > 0).astype(int)]
+            return self.labels[margin.argmax(axis=1)]
+        if self.output == 'logistic':
+            margin = 1 / (1 + np.exp(-margin))
+        elif self.output == 'exp':
+            margin = np.exp(margin)
+        elif self.output == 'softmax':
+            return margin.argmax(axis=1)
+        return margin[:, 0].astype(np.float32)
+
+    def _margin(self, matrix):
+        # bias + the leaf values of every row in every tree, summed per output group
+        margin = np.tile(self.bias, (len(matrix), 1))
+        step = max(1, BLOCK_SIZE // max(1, len(self.roots)))
+        for start in range(0, len(matrix), step):
+            block = matrix[start:start + step]
+            rows = np.arange(len(block))[:, None]
+            node = np.tile(self.roots, (len(block), 1))
+            # the leaves point to themselves, so the rows that reached one stay there
+            while not self.is_leaf[node].all():
+                x = block[rows, self.feature[node]]
+                go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+                node = np.where(go_left, self.left[node], self.right[node])
+            margin[start:start + step] += self.value[node].astype(float) @ self.group_matrix
+        return margin
+
+
+def save_artifact(artifact, registry_dir):
+    """
+    Write a fitted pipeline to <registry_dir>/<team_id>/<mode>.json and its booster next to it
+
+    Inputs:
+    - artifact:      a team_training artifact - a dict with the fitted 'pipeline' (column transformer, XGBoost model),
+                     'mode', 'team_id', and 'classes' for the label-encoded classifiers (None otherwise) - or a
+                     chunked_training artifact, whose model is a BoosterModel
+    - registry_dir:  root directory of the registry
+
+    Returns the path of the description
+    """
+    import xgboost as xgb
+
+    import pre_processing_utils as ppu
+
+    pipeline, mode = artifact['pipeline'], artifact['mode']
+    ct, model = pipeline[0], pipeline[-1]
+    booster = _booster(model)
+    if booster is None:
+        raise ValueError(f'{type(model).__name__} is not an XGBoost model, only XGBoost pipelines can be registered')
+    # chunked_training.BoosterModel - a trained xgb.Booster and the parameters it was trained with
+    chunked = not hasattr(model, 'get_booster')
+
+    base = os.path.join(registry_dir, str(artifact['team_id']), mode)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    try:
+        raw, booster_file = booster.save_raw(raw_format='ubj'), f'{mode}.ubj'
+    except TypeError:
+        # XGBoost < 1.6 has no UBJSON, its JSON model format is read the same way
+        raw, booster_file = None, f'{mode}.booster.json'
+    booster_path = os.path.join(os.path.dirname(base), booster_file)
+    if raw is not None:
+        with open(booster_path + '.tmp', 'wb') as f:
+            f.write(bytes(raw))
+        os.replace(booster_path + '.tmp', booster_path)
+        learner = _read_ubjson(bytes(raw))['learner']
+    else:
+        # the format follows the extension
+        booster.save_model(booster_path[:-len('.json')] + '.tmp.json')
+        os.replace(booster_path[:-len('.json')] + '.tmp.json', booster_path)
+        learner = _read_booster(booster_path)
+
+    objective = learner['objective']['name']
+    if objective not in OBJECTIVES:
+        raise ValueError(f'objective {objective} is not supported, one of {sorted(OBJECTIVES)}')
+
+    # the trees predict uses - those up to the best iteration after early stopping
+    n_groups = max(1, int(learner['learner_model_param']['num_class']))
+    params = (model.params or {}) if chunked else model.get_params()
+    trees_per_iteration = n_groups * int(params.get('num_parallel_tree') or 1)
+    n_trees = len(learner['gradient_booster']['model']['trees'])
+    best_iteration = None
+    if not chunked:
+        # a BoosterModel is trained for a fixed number of rounds, without early stopping
+        try:
+            best_iteration = model.best_iteration
+        except AttributeError:
+            pass
+    if best_iteration is not None:
+        n_trees = min(n_trees, (best_iteration + 1) * trees_per_iteration)
+
+    if chunked:
+        # the BoosterModel classifiers predict the class indices, like the label-encoded XGBClassifier
+        labels = list(range(len(artifact['classes']))) if model.classification else None
+    else:
+        labels = np.asarray(model.classes_).tolist() if hasattr(model, 'classes_') else None
+
+    description = {
+        'team_id': artifact['team_id'],
+        'mode': mode,
+        'target': artifact.get('target', ppu.MODE_TARGETS.get(mode)),
+        'n_train': artifact.get('n_train'),
+        'classes': None if artifact['classes'] is None else np.asarray(artifact['classes']).tolist(),
+        'labels': labels,
+        'objective': objective,
+        'output': OBJECTIVES[objective],
+        'n_features': int(learner['learner_model_param']['num_feature']),
+        'n_trees': n_trees,
+        'bias': [0.0] * n_groups,
+        'booster': booster_file,
+        'trees': f'{mode}.trees.npz',
+        'xgboost_version': xgb.__version__,
+        'transformer': ppu.transformer_state(ct, mode),
+        }
+
+    # the margin of a row with every feature missing is the bias plus the trees' default leaves - the bias is whatever
+    # XGBoost adds to the trees (base_score, in the objective's margin space)
+    missing = np.full((1, description['n_features']), np.nan, dtype=np.float32)
+    margin = booster.predict(xgb.DMatrix(missing), output_margin=True,
+                             iteration_range=(0, n_trees // trees_per_iteration))
+    trees = _flatten_trees(learner, n_trees)
+    compact = CompactPipeline(description, trees)
+    description['bias'] = (np.asarray(margin, dtype=float).reshape(-1) - compact._margin(missing)[0]).tolist()
+
+    trees_path = os.path.join(os.path.dirname(base), description['trees'])
+    with open(trees_path + '.tmp', 'wb') as f:
+        np.savez(f, **trees)
+    os.replace(trees_path + '.tmp', trees_path)
+    with open(base + '.json.tmp', 'w') as f:
+        json.dump(description, f)
+    os.replace(base + '.json.tmp', base + '.json')
+    return base + '.json'
+
+
+def export_version(models_dir, version, team_ids=None, modes=None, registry_dir=None):
+    """
+    Write every joblib artifact of a team_training version to the registry
+
+    Inputs:
+    - models_dir:    root directory of the model versions
+    - version:       the version written by team_training.train_teams
+    - team_ids:      the clubs, defaults to every club of the version
+    - modes:         the team modes, defaults to every mode of the version
+    - registry_dir:  defaults to <models_dir>/<version>/registry
+
+    Returns a list of {team_id, mode, path, joblib_bytes, loaded_bytes (description and tree arrays), registry_bytes
+    (with the booster file), seconds}
+    """
+    import joblib
+
+    version_dir = os.path.join(models_dir, version)
+    registry_dir = registry_dir or os.path.join(version_dir, REGISTRY_DIR)
+    exported = []
+    for path in sorted(glob.glob(os.path.join(version_dir, '*', '*.joblib'))):
+        team_dir, file_name = os.path.split(path)
+        mode = file_name[:-len('.joblib')]
+        try:
+            team_id = int(os.path.basename(team_dir))
+        except ValueError:
+            continue
+        if (team_ids is not None and team_id not in team_ids) or (modes is not None and mode not in modes):
+            continue
+
+        start = time.perf_counter()
+        description_path = save_artifact(joblib.load(path), registry_dir)
+        with open(description_path) as f:
+            description = json.load(f)
+        team_dir = os.path.dirname(description_path)
+        exported.append({
+            'team_id': team_id,
+            'mode': mode,
+            'path': description_path,
+            'joblib_bytes': os.path.getsize(path),
+            'loaded_bytes': sum(os.path.getsize(os.path.join(team_dir, name))
+                                for name in (f'{mode}.json', description['trees'])),
+            'registry_bytes': sum(os.path.getsize(os.path.join(team_dir, name))
+                                  for name in (f'{mode}.json', description['booster'], description['trees'])),
+            'seconds': time.perf_counter() - start,
+            })
+    return exported
+
+
+def load_artifact(registry_dir, team_id, mode):
+    """
+    Returns the artifact of a registry entry - a dict as team_training.load_artifact returns, whose 'pipeline' is a
+    CompactPipeline - so team_training.predict, transfer_scoring and the prediction service use it unchanged
+    """
+    team_dir = os.path.join(registry_dir, str(team_id))
+    with open(os.path.join(team_dir, f'{mode}.json')) as f:
+        description = json.load(f)
+
+    trees_path = os.path.join(team_dir, description['trees'])
+    if os.path.exists(trees_path):
+        with np.load(trees_path) as arrays:
+            trees = dict(arrays)
+    else:
+        trees = _flatten_trees(_read_booster(os.path.join(team_dir, description['booster'])), description['n_trees'])
+    return {
+        'pipeline': CompactPipeline(description, trees),
+        'classes': None if description['classes'] is None else np.asarray(description['classes']),
+        'team_id': description['team_id'],
+        'mode': description['mode'],
+        'target': description['target'],
+        'n_train': description['n_train'],
+        }
+
+
+def load_team(registry_dir, team_id, modes=TEAM_MODES):
+    """
+    Returns {mode: artifact} for one club
+    """
+    return {mode: load_artifact(registry_dir, team_id, mode) for mode in modes}
+
+
+def load_booster(registry_dir, team_id, mode):
+    """
+    Returns the xgboost.Booster of a registry entry, e.g. for the SHAP values - this one needs XGBoost
+    """
+    import xgboost as xgb
+
+    with open(os.path.join(registry_dir, str(team_id), f'{mode}.json')) as f:
+        description = json.load(f)
+    booster = xgb.Booster()
+    with open(os.path.join(registry_dir, str(team_id), description['booster']), 'rb') as f:
+        booster.load_model(bytearray(f.read()))
+    return booster
+
+
+def measure_cold_start(registry_dir, team_id, modes=TEAM_MODES, budget=COLD_START_BUDGET):
+    """
+    Time the cold start of a club in a fresh interpreter: importing this module, loading the club's models and
+    predicting one row with each
+
+    Returns a dict with the total seconds (interpreter start included), the import / load / predict seconds, the heavy
+    modules that were imported on the way (HEAVY_MODULES, none expected), the budget and within_budget
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _PROBE, registry_dir, str(team_id)] + list(modes), env=env,
+                            capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - start
+
+    timings = json.loads(result.stdout.splitlines()[-1])
+    timings.update(seconds=seconds, budget=budget, within_budget=seconds <= budget)
+    return timings
+
+
+# the cold start measured in the fresh interpreter
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import model_registry
+print(json.dumps(model_registry._probe(sys.argv[1], int(sys.argv[2]), sys.argv[3:], start)))
+'''
+
+
+def _probe(registry_dir, team_id, modes, start):
+    imported = time.perf_counter()
+    artifacts = load_team(registry_dir, team_id, modes)
+    loaded = time.perf_counter()
+    for artifact in artifacts.values():
+        pipeline = artifact['pipeline']
+        row = {col: np.array([np.nan]) for col in pipeline.numeric_features}
+        row.update({col: np.array([None], dtype=object) for col in pipeline.categorical_features})
+        pipeline.predict(row)
+    predicted = time.perf_counter()
+    return {
+        'import_seconds': imported - start,
+        'load_seconds': loaded - imported,
+        'predict_seconds': predicted - loaded,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+        }
+
+
+def _booster(model):
+    import xgboost as xgb
+
+    if hasattr(model, 'get_booster'):
+        return model.get_booster()
+    # chunked_training.BoosterModel
+    if isinstance(getattr(model, 'booster', None), xgb.Booster):
+        return model.booster
+    return None
+
+
+def _column(X, col):
+    # a DataFrame column or a mapping's values, as a numpy array (missing values as NaN)
+    values = X[col]
+    if hasattr(values, 'to_numpy'):
+        return values.to_numpy(dtype=float, na_value=np.nan) if values.dtype.kind in 'biuf' else values.to_numpy()
+    return np.asarray(values)
+
+
+def _encode(values, categories):
+    # position of every value in the categories, -1 for the unknown values (OneHotEncoder(handle_unknown='ignore'))
+    nan_code = -1
+    if categories.dtype.kind == 'f' and len(categories) and np.isnan(categories[-1]):
+        # OneHotEncoder puts NaN last
+        nan_code, categories = len(categories) - 1, categories[:-1]
+
+    if categories.dtype.kind in 'biuf' and values.dtype.kind in 'biuf':
+        codes = np.full(len(values), -1)
+        if len(categories):
+            positions = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+            codes = np.where(categories[positions] == values, positions, -1)
+        if values.dtype.kind == 'f':
+            codes[np.isnan(values)] = nan_code
+        return codes
+
+    lookup = {value: code for code, value in enumerate(categories.tolist())}
+    return np.fromiter((nan_code if value != value else lookup.get(value, -1) for value in values.tolist()),
+                       dtype=np.int64, count=len(values))
+
+
+def _flatten_trees(learner, n_trees):
+    # the nodes of all the trees in flat arrays, with the children as positions in them - the leaves are their own
+    # children, and keep their value as split condition
+    booster = learner['gradient_booster']
+    if booster['name'] != 'gbtree':
+        raise ValueError(f"only gbtree boosters are supported, got {booster['name']}")
+    trees = booster['model']['trees'][:n_trees]
+    for tree in trees:
+        if np.any(np.asarray(tree.get('split_type', []))) or int(tree['tree_param'].get('size_leaf_vector', 1)) > 1:
+            raise ValueError('categorical splits and vector leaves are not supported')
+
+    sizes = np.array([len(tree['left_children']) for tree in trees], dtype=np.int64)
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32) if len(trees) else np.zeros(0, np.int32)
+    offsets = np.repeat(roots, sizes)
+
+    def concat(key, dtype):
+        return np.concatenate([np.asarray(tree[key], dtype=dtype) for tree in trees] + [np.zeros(0, dtype)])
+
+    left = concat('left_children', np.int32)
+    is_leaf = left == -1
+    nodes = np.arange(len(left), dtype=np.int32)
+    return {
+        'roots': roots,
+        'groups': np.asarray(booster['model']['tree_info'][:n_trees], dtype=np.int32),
+        'left': np.where(is_leaf, nodes, left + offsets).astype(np.int32),
+        'right': np.where(is_leaf, nodes, concat('right_children', np.int32) + offsets).astype(np.int32),
+        'feature': np.where(is_leaf, 0, concat('split_indices', np.int32)).astype(np.int32),
+        'threshold': concat('split_conditions', np.float32),
+        'default_left': concat('default_left', np.int8).astype(bool),
+        }
+
+
+def _read_booster(path):
+    # the learner of an XGBoost model file, UBJSON or JSON
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:1] == b'{' and data[1:2] in (b'"', b' ', b'\n', b'}'):
+        return json.loads(data)['learner']
+    return _read_ubjson(data)['learner']
+
+
+# UBJSON number markers -> struct format
+_UBJ_NUMBERS = {b'i': '>b', b'U': '>B', b'I': '>h', b'l': '>i', b'L': '>q', b'd': '>f', b'D': '>d'}
+
+
+def _read_ubjson(data):
+    """
+    Decode the UBJSON XGBoost writes - objects, arrays (the typed, counted number arrays straight into numpy),
+    numbers, strings, booleans and null
+    """
+    return _UBJSONReader(data).value(None)
+
+
+class _UBJSONReader:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def value(self, marker):
+        if marker is None:
+            marker = self._marker()
+        if marker in _UBJ_NUMBERS:
+            return self._number(marker)
+        if marker == b'S':
+            return self._string()
+        if marker == b'C':
+            self.pos += 1
+            return self.data[self.pos - 1:self.pos].decode()
+        if marker == b'H':
+            return float(self._string())
+        if marker in (b'T', b'F'):
+            return marker == b'T'
+        if marker == b'Z':
+            return None
+        if marker == b'[':
+            return self._array()
+        if marker == b'{':
+            return self._object()
+        raise ValueError(f'unexpected UBJSON marker {marker!r} at byte {self.pos - 1}')
+
+    def _marker(self):
+        marker = self.data[self.pos:self.pos + 1]
+        self.pos += 1
+        while marker == b'N':
+            marker = self.data[self.pos:self.pos + 1]
+            self.pos += 1
+        return marker
+
+    def _peek(self):
+        return self.data[self.pos:self.pos + 1]
+
+    def _number(self, marker):
+        fmt = _UBJ_NUMBERS[marker]
+        value, = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def _string(self):
+        length = self._number(self._marker())
+        self.pos += length
+        return self.data[self.pos - length:self.pos].decode('utf-8')
+
+    def _container(self):
+        # the optional $type and #count of an optimised container
+        value_type = count = None
+        if self._peek() == b'$':
+            value_type = self.data[self.pos + 1:self.pos + 2]
+            self.pos += 2
+        if self._peek() == b'#':
+            self.pos += 1
+            count = self._number(self._marker())
+        return value_type, count
+
+    def _array(self):
+        value_type, count = self._container()
+        if value_type in _UBJ_NUMBERS and count is not None:
+            dtype = np.dtype(_UBJ_NUMBERS[value_type])
+            values = np.frombuffer(self.data, dtype, count, self.pos)
+            self.pos += count * dtype.itemsize
+            return values.astype(dtype.newbyteorder('='))
+
+        values = []
+        if count is None:
+            while self._peek() != b']':
+                values.append(self.value(None))
+            self.pos += 1
+        else:
+            for _ in range(count):
+                values.append(self.value(value_type))
+        return values
+
+    def _object(self):
+        value_type, count = self._container()
+        obj = {}
+        while (self._peek() != b'}') if count is None else (len(obj) < count):
+            key = self._string()
+            obj[key] = self.value(value_type)
+        if count is None:
+            self.pos += 1
+        return obj
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help='write the joblib artifacts of a version to the registry')
+    cold_start = subparsers.add_parser('cold-start', help="time a club's cold start against the budget")
+    for subparser in (export, cold_start):
+        subparser.add_argument('--models-dir', default='models')
+        subparser.add_argument('--version', required=True)
+        subparser.add_argument('--registry-dir', default=None, help='defaults to <models-dir>/<version>/registry')
+        subparser.add_argument('--modes', nargs='+', default=None, choices=TEAM_MODES)
+        subparser.add_argument('--budget', type=float, default=COLD_START_BUDGET)
+    export.add_argument('--teams', nargs='+', type=int, default=None, help='defaults to every club of the version')
+    cold_start.add_argument('--team', type=int, required=True)
+    args = parser.parse_args()
+
+    registry_dir = args.registry_dir or os.path.join(args.models_dir, args.version, REGISTRY_DIR)
+    if args.command == 'export':
+        start = time.perf_counter()
+        exported = export_version(args.models_dir, args.version, args.teams, args.modes, registry_dir)
+        for entry in exported:
+            print(f"{entry['team_id']:>8} {entry['mode']:<12} joblib {entry['joblib_bytes']:>12,} bytes, loaded "
+                  f"{entry['loaded_bytes']:>12,} bytes ({entry['registry_bytes']:,} with the booster)  "
+                  f"{entry['seconds']:.2f}s")
+        print(f'{len(exported)} models exported to {registry_dir} in {time.perf_counter() - start:.1f}s')
+        if not exported:
+            return
+        team_id = exported[0]['team_id']
+        modes = [entry['mode'] for entry in exported if entry['team_id'] == team_id]
+    else:
+        team_id = args.team
+        modes = args.modes or [mode for mode in TEAM_MODES
+                               if os.path.exists(os.path.join(registry_dir, str(team_id), f'{mode}.json'))]
+
+    timings = measure_cold_start(registry_dir, team_id, modes, args.budget)
+    print(f"cold start of club {team_id} ({len(modes)} models): {timings['seconds']:.3f}s "
+          f"(import {timings['import_seconds']:.3f}s, load {timings['load_seconds']:.3f}s, "
+          f"predict {timings['predict_seconds']:.3f}s), budget {args.budget:.3f}s")
+    if timings['heavy_modules']:
+        print(f"imported on the way: {', '.join(timings['heavy_modules'])}")
+    if not timings['within_budget']:
+        sys.exit(f"cold start over budget: {timings['seconds']:.3f}s > {args.budget:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
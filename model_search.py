@@ -0,0 +1,376 @@
+# model search - hyper-parameter searches for the Notebook 5 param grids, with a persistent fold level result cache
+import hashlib
+import inspect
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import BaseEstimator, clone, is_classifier
+from sklearn.exceptions import FitFailedWarning
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv, train_test_split
+from sklearn.pipeline import Pipeline
+import xgboost as xgb
+
+SEARCH_CACHE_DIR = 'data/search_cache'
+
+# parameters that do not change the fitted model, left out of the cache key (memory is the mkdtemp() directory)
+_IGNORED_PARAMS = {'memory', 'verbose', 'verbosity', 'n_jobs', 'nthread'}
+
+
+class PersistentGridSearch:
+    """
+    Drop-in replacement for GridSearchCV(estimator, param_grid, cv=5) that keeps the score of every (candidate, fold)
+    fit on disk, keyed by (mode, team_id, fold, transformer params, model params, data hash).
+
+    Re-running a search - in a new session, or after adding a point to the grid - only fits the configurations that are
+    not in the cache, and cv_results_ is rebuilt from the cache in the same format as GridSearchCV's.
+    Failed fits follow error_score like GridSearchCV: a FitFailedWarning and error_score as the fold score (not cached),
+    or re-raised with error_score='raise'.
+
+    grid = PersistentGridSearch(estimator, param_grid, mode='team-vaep', team_id=1475, cv=5, verbose=1)
+    fitted_grid = grid.fit(X_train, y_train)
+    pd.DataFrame(fitted_grid.cv_results_).sort_values(by='rank_test_score')
+    """
+
+    def __init__(self, estimator, param_grid, mode, team_id, cv=5, scoring=None, n_jobs=None, refit=True,
+                 cache_dir=SEARCH_CACHE_DIR, verbose=0, error_score=np.nan):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.mode = mode
+        self.team_id = team_id
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        self.error_score = error_score
+
+    def fit(self, X, y):
+        scorer = check_scoring(self.estimator, scoring=self.scoring)
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        splits = list(cv.split(X, y))
+        data_hash = _data_hash(X, y)
+
+        candidates = list(ParameterGrid(self.param_grid))
+        estimators = [clone(self.estimator).set_params(**clone(params, safe=False)) for params in candidates]
+
+        # look every (candidate, fold) up in the cache, and only fit the missing ones
+        results = {}
+        todo = []
+        for i, estimator in enumerate(estimators):
+            transformer_token, model_token = _estimator_tokens(estimator)
+            for fold in range(len(splits)):
+                key = _cache_key({
+                    'mode': self.mode,
+                    'team_id': _token(self.team_id),
+                    'cv': repr(cv),
+                    'fold': fold,
+                    'scoring': repr(self.scoring),
+                    'transformer': transformer_token,
+                    'model': model_token,
+                    'data': data_hash,
+                    })
+                cached = self._read(key)
+                if cached is None:
+                    todo.append((i, fold, key))
+                else:
+                    results[i, fold] = cached
+
+        if self.verbose:
+            print(f'{len(candidates)} candidates x {len(splits)} folds: {len(results)} cached, fitting {len(todo)}')
+
+        fitted = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
+            delayed(_fit_and_score)(clone(estimators[i]), X, y, *splits[fold], scorer, self.error_score)
+            for i, fold, key in todo)
+
+        for (i, fold, key), result in zip(todo, fitted):
+            results[i, fold] = result
+            # failed fits are not cached, so they are retried on the next run
+            if not result.pop('fit_failed', False):
+                self._write(key, result)
+
+        self.cv_results_ = _cv_results(candidates, results, len(splits))
+        self.n_splits_ = len(splits)
+        self.n_cached_ = len(results) - len(todo)
+        self.n_fitted_ = len(todo)
+
+        self.best_index_ = int(np.nanargmax(self.cv_results_['mean_test_score']))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+
+        if self.refit:
+            self.best_estimator_ = clone(estimators[self.best_index_]).fit(X, y)
+
+        return self
+
+    def score(self, X, y):
+        return check_scoring(self.best_estimator_, scoring=self.scoring)(self.best_estimator_, X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _read(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(result, f)
+        os.replace(path + '.tmp', path)
+
+
+def _fit_and_score(estimator, X, y, train, test, scorer, error_score=np.nan):
+    start = time.perf_counter()
+    try:
+        estimator.fit(_rows(X, train), _rows(y, train))
+    except Exception as e:
+        # same contract as sklearn's error_score: re-raise, or warn and score the fold as error_score
+        if error_score == 'raise':
+            raise
+        warnings.warn(f'Estimator fit failed. The score on this train-test partition for these parameters will be set '
+                      f'to {error_score}. Details: \n{e!r}', FitFailedWarning)
+        return {'test_score': error_score, 'fit_time': time.perf_counter() - start, 'score_time': 0.0,
+                'fit_failed': True}
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    test_score = scorer(estimator, _rows(X, test), _rows(y, test))
+    score_time = time.perf_counter() - start
+
+    return {'test_score': float(test_score), 'fit_time': fit_time, 'score_time': score_time}
+
+
+def _cv_results(candidates, results, n_splits):
+    """
+    Build the GridSearchCV style cv_results_ dict from the (candidate, fold) results
+    """
+    n_candidates = len(candidates)
+
+    def array(field):
+        return np.array([[results[i, fold][field] for fold in range(n_splits)] for i in range(n_candidates)], dtype=float)
+
+    test_scores = array('test_score')
+    fit_times = array('fit_time')
+    score_times = array('score_time')
+
+    cv_results = {
+        'mean_fit_time': fit_times.mean(axis=1),
+        'std_fit_time': fit_times.std(axis=1),
+        'mean_score_time': score_times.mean(axis=1),
+        'std_score_time': score_times.std(axis=1),
+        }
+
+    param_names = sorted({name for params in candidates for name in params})
+    for name in param_names:
+        cv_results[f'param_{name}'] = np.ma.masked_array(
+            np.array([params.get(name) for params in candidates], dtype=object),
+            mask=[name not in params for params in candidates])
+    cv_results['params'] = candidates
+
+    for fold in range(n_splits):
+        cv_results[f'split{fold}_test_score'] = test_scores[:, fold]
+
+    mean_test_score = test_scores.mean(axis=1)
+    cv_results['mean_test_score'] = mean_test_score
+    cv_results['std_test_score'] = test_scores.std(axis=1)
+    # failed candidates rank last, like GridSearchCV
+    cv_results['rank_test_score'] = rankdata(-np.nan_to_num(mean_test_score, nan=-np.inf), method='min').astype(np.int32)
+
+    return cv_results
+
+
+def _estimator_tokens(estimator):
+    """
+    Split an estimator into a (transformer params, model params) pair of tokens - for a pipeline the last step is the
+    model and the other steps are the transformers
+    """
+    if isinstance(estimator, Pipeline):
+        steps = estimator.steps
+        return _token([(name, step) for name, step in steps[:-1]]), _token(steps[-1][1])
+    return _token(None), _token(estimator)
+
+
+def _token(value):
+    """
+    A json-able description of a value, estimators are described by their class and (non default and default)
+    parameters - stable across sessions, unlike pickles or reprs with memory addresses
+    """
+    if isinstance(value, BaseEstimator) or hasattr(value, 'get_params'):
+        params = value.get_params(deep=False)
+        return {
+            'class': f'{type(value).__module__}.{type(value).__qualname__}',
+            'params': {name: _token(param) for name, param in sorted(params.items()) if name not in _IGNORED_PARAMS},
+            }
+    if isinstance(value, (list, tuple)):
+        return [_token(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _token(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    return repr(value)
+
+
+def _cache_key(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def _data_hash(X, y):
+    digest = hashlib.sha1()
+    for data in (X, y):
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+            digest.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+        else:
+            digest.update(np.ascontiguousarray(data).tobytes())
+    return digest.hexdigest()
+
+
+def _rows(data, idx):
+    return data.iloc[idx] if hasattr(data, 'iloc') else data[idx]
+
+
+def halving_search(estimator, param_grid, X, y, factor=3, cv=5, scoring=None, n_jobs=-1, early_stopping=True,
+                   random_state=1, verbose=0):
+    """
+    Successive halving version of the Notebook 5 grid searches: every candidate starts on a small sample of the training
+    data, and only the best 1/factor of them move on to the next round with factor times more data. XGBoost candidates
+    also stop adding trees once the score on a held out validation split stops improving.
+
+    The candidates are fitted in parallel (n_jobs) with the inner n_jobs of the forests / boosters set to 1, so the
+    cores are not oversubscribed by n_jobs=-1 models inside a parallel search.
+
+    Inputs:
+    - estimator:       the pipeline to search over, as for GridSearchCV
+    - param_grid:      the param grid (list of dicts), as for GridSearchCV
+    - X, y:            training data
+    - factor:          the fraction of candidates kept (1/factor) and the data growth between rounds
+    - early_stopping:  wrap the XGBoost candidates in EarlyStoppingXGBRegressor / EarlyStoppingXGBClassifier
+
+    Returns the fitted HalvingGridSearchCV - cv_results_, best_params_, best_estimator_ as for GridSearchCV
+    """
+    # halving searches are still experimental in scikit-learn and need to be enabled explicitly
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import HalvingGridSearchCV
+
+    search = HalvingGridSearchCV(
+        _single_threaded(estimator, early_stopping),
+        _prepare_grid(param_grid, early_stopping),
+        factor=factor,
+        resource='n_samples',
+        min_resources='exhaust',
+        cv=cv,
+        scoring=scoring,
+        n_jobs=n_jobs,
+        random_state=random_state,
+        verbose=verbose)
+
+    return search.fit(X, y)
+
+
+class EarlyStoppingXGBRegressor(xgb.XGBRegressor):
+    """
+    XGBRegressor that holds out validation_fraction of its training data and stops boosting after stopping_rounds
+    rounds without improvement on it - n_estimators becomes the maximum number of trees
+    """
+
+    def __init__(self, *, validation_fraction=0.1, stopping_rounds=20, **kwargs):
+        super().__init__(**kwargs)
+        self.validation_fraction = validation_fraction
+        self.stopping_rounds = stopping_rounds
+
+    def fit(self, X, y, **fit_params):
+        return _fit_with_early_stopping(self, super().fit, X, y, fit_params)
+
+    def get_xgb_params(self):
+        return _without_early_stopping_params(super().get_xgb_params())
+
+
+class EarlyStoppingXGBClassifier(xgb.XGBClassifier):
+    """
+    XGBClassifier version of EarlyStoppingXGBRegressor
+    """
+
+    def __init__(self, *, validation_fraction=0.1, stopping_rounds=20, **kwargs):
+        super().__init__(**kwargs)
+        self.validation_fraction = validation_fraction
+        self.stopping_rounds = stopping_rounds
+
+    def fit(self, X, y, **fit_params):
+        return _fit_with_early_stopping(self, super().fit, X, y, fit_params)
+
+    def get_xgb_params(self):
+        return _without_early_stopping_params(super().get_xgb_params())
+
+
+def _fit_with_early_stopping(model, fit, X, y, fit_params):
+    X_fit, X_val, y_fit, y_val = train_test_split(X, y, test_size=model.validation_fraction, random_state=0)
+    fit_params = dict(fit_params, eval_set=[(X_val, y_val)], verbose=False)
+
+    # xgboost < 2 takes early_stopping_rounds in fit, newer versions only as a model parameter
+    if 'early_stopping_rounds' in inspect.signature(xgb.XGBModel.fit).parameters:
+        return fit(X_fit, y_fit, early_stopping_rounds=model.stopping_rounds, **fit_params)
+
+    early_stopping_rounds = model.early_stopping_rounds
+    model.early_stopping_rounds = model.stopping_rounds
+    try:
+        return fit(X_fit, y_fit, **fit_params)
+    finally:
+        model.early_stopping_rounds = early_stopping_rounds
+
+
+def _without_early_stopping_params(params):
+    # not booster parameters - keep xgboost from warning about them
+    params.pop('validation_fraction', None)
+    params.pop('stopping_rounds', None)
+    return params
+
+
+def _prepare_grid(param_grid, early_stopping):
+    grids = [param_grid] if isinstance(param_grid, dict) else param_grid
+    prepared = []
+    for grid in grids:
+        grid = dict(grid)
+        for name, values in grid.items():
+            if isinstance(values, (list, tuple)) and any(hasattr(value, 'get_params') for value in values):
+                grid[name] = [_single_threaded(value, early_stopping) if hasattr(value, 'get_params') else value
+                              for value in values]
+        prepared.append(grid)
+    return prepared
+
+
+def _single_threaded(estimator, early_stopping):
+    """
+    Copy of an estimator with n_jobs=1 on every step that has it, optionally swapping XGBoost models for their early
+    stopping versions
+    """
+    if isinstance(estimator, Pipeline):
+        estimator = clone(estimator)
+        estimator.steps = [(name, _single_threaded(step, early_stopping) if hasattr(step, 'get_params') else step)
+                           for name, step in estimator.steps]
+        return estimator
+
+    if early_stopping and type(estimator) is xgb.XGBRegressor:
+        estimator = EarlyStoppingXGBRegressor(**estimator.get_params())
+    elif early_stopping and type(estimator) is xgb.XGBClassifier:
+        estimator = EarlyStoppingXGBClassifier(**estimator.get_params())
+    else:
+        estimator = clone(estimator)
+
+    if 'n_jobs' in estimator.get_params(deep=False):
+        estimator.set_params(n_jobs=1)
+    return estimator
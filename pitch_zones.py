@@ -0,0 +1,80 @@
+# pitch zones
+import numpy as np
+
+# the pitch dimensions used for the zones in Notebook 2 - see pitch_zones.png
+PITCH_LENGTH = 105
+PITCH_WIDTH = 69
+
+
+def zone_edges(n_x=3, n_y=3, length=PITCH_LENGTH, width=PITCH_WIDTH):
+    """
+    Inputs:
+    - n_x:     number of zones along the length of the pitch (x)
+    - n_y:     number of zones along the width of the pitch (y)
+    - length:  pitch length
+    - width:   pitch width
+
+    Returns x_edges, y_edges - the bin edges of an equally split pitch, the default is the 9 zone layout from Notebook 2
+    """
+    return np.linspace(0, length, n_x + 1), np.linspace(0, width, n_y + 1)
+
+
+def zone_labels(x_edges, y_edges):
+    """
+    Returns the zone labels for a grid, numbered along y first: zone_1 is the bottom left zone and zone_{n_y+1} is the
+    zone in front of it
+    """
+    n_zones = (len(x_edges) - 1) * (len(y_edges) - 1)
+    return np.array([f'zone_{i}' for i in range(1, n_zones + 1)] + ['no_zone'], dtype=object)
+
+
+def assign_zones(x, y, x_edges=None, y_edges=None):
+    """
+    Map coordinates to pitch zone labels in one vectorised step.
+
+    Every bin is closed on the left and open on the right, except the last bin on each axis which is also closed on
+    the right (e.g. 46 <= y <= 69). Coordinates outside the grid, or missing, get 'no_zone' - the same labels as the
+    if/elif chain in Notebook 2.
+
+    Inputs:
+    - x, y:               array-likes of coordinates
+    - x_edges, y_edges:   increasing bin edges for each axis, defaults to zone_edges()
+
+    Returns a numpy object array of labels
+    """
+    if x_edges is None or y_edges is None:
+        default_x_edges, default_y_edges = zone_edges()
+        x_edges = default_x_edges if x_edges is None else x_edges
+        y_edges = default_y_edges if y_edges is None else y_edges
+
+    x_edges = np.asarray(x_edges, dtype=float)
+    y_edges = np.asarray(y_edges, dtype=float)
+    n_x = len(x_edges) - 1
+    n_y = len(y_edges) - 1
+
+    x_bin = _bin(np.asarray(x, dtype=float), x_edges)
+    y_bin = _bin(np.asarray(y, dtype=float), y_edges)
+
+    valid = (x_bin >= 0) & (x_bin < n_x) & (y_bin >= 0) & (y_bin < n_y)
+    codes = np.where(valid, x_bin * n_y + y_bin, n_x * n_y)
+
+    return zone_labels(x_edges, y_edges)[codes]
+
+
+def add_pitch_zones(df, x_edges=None, y_edges=None):
+    """
+    Add the start_pitch_zone and end_pitch_zone columns to an actions dataframe (in place)
+
+    Returns the dataframe
+    """
+    df['start_pitch_zone'] = assign_zones(df['start_x'].to_numpy(), df['start_y'].to_numpy(), x_edges, y_edges)
+    df['end_pitch_zone'] = assign_zones(df['end_x'].to_numpy(), df['end_y'].to_numpy(), x_edges, y_edges)
+    return df
+
+
+def _bin(values, edges):
+    # index i such that edges[i] <= value < edges[i+1], NaN ends up past the last bin
+    bins = np.searchsorted(edges, values, side='right') - 1
+    # the upper edge of the pitch belongs to the last bin
+    bins[values == edges[-1]] = len(edges) - 2
+    return bins
@@ -0,0 +1,213 @@
+# player matching - resolve hand-collected transfer names to StatsBomb player ids (the fuzzywuzzy step of Notebook 2)
+#
+#   python player_matching.py --out data/target_players.csv                 # the Notebook 2 transfer list
+#   python player_matching.py --names transfers.txt --threshold 80          # one name per line
+#
+#   index = player_matching.PlayerIndex(players_test)
+#   index.match('Lisa Weiss')      # [(player_id, player_name, score), ...]
+#   target_players = player_matching.resolve_transfers(TRANSFER_PLAYERS, players, players_test)
+#
+# names are normalised once (diacritics folded - "Lisa Weiß" -> "lisa weiss", "Benedicte Håland" -> "benedicte
+# haland" - lower case, punctuation removed) and indexed by character trigram. A lookup only scores the players
+# sharing the most trigrams with the name instead of every player in the tables, with fuzz.WRatio (the scorer of
+# process.extract in Notebook 2) or difflib when fuzzywuzzy is not installed. resolve_transfers keeps the best match
+# above the threshold for every name and adds the team each player played for before and after the transfer.
+import argparse
+import difflib
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+try:
+    from fuzzywuzzy import fuzz
+except ImportError:
+    fuzz = None
+
+import load_data
+
+# players transferred into WSL teams for the 20/21 season (the test set), collected from worldfootball.net - Notebook 2
+TRANSFER_PLAYERS = [
+    'Anna Patten', 'Carlotte Wubben-Moy', 'Lydia Williams', 'Noelle Maritz', 'Stephanie Catley', 'Fran Stenson',
+    'Mana Iwabuchi', 'Ramona Petzelberger', 'Anita Asante', 'Diana Silva', 'Freya Gregory', 'Stine Larsen',
+    'Caroline Siems', 'Lisa Weiß', 'Ruby Mace', 'Sophie Whitehouse', 'Veatriki Sarri', 'Ruesha Littlejohn',
+    'Emily Murphy', 'Jamie-Lee Napier', 'Rachel Corsie', 'Mollie Green', 'Chloe McCarron', 'Christie Murray',
+    'Emma Koivisto', 'Katie Startup', 'Rebekah Stott', 'Inessa Kaagman', 'Nora Heroum', 'Katie Robinson',
+    'Kiera Skeels', 'Molly Pike', 'Benedicte Håland', 'Emma Bissell', 'Aimee Palmer', 'Jemma Purfield',
+    'Laura Rafferty', 'Ella Rutherford', 'Zećira Mušović', 'Pernille Harder', 'Niamh Charles', 'Jessie Fleming',
+    'Melanie Leupolz', 'Alisha Lehmann', 'Jill Scott', 'Claire Emslie', 'Valérie Gauvin', 'Nicoline Sørensen',
+    'Damaris Egurrola', 'Poppy Pattinson', 'Rikke Sevecke', 'Ingrid Wold', 'Abby Dahlkemper', 'Alex Greenwood',
+    'Lucy Bronze', 'Samantha Mewis', 'Chloe Kelly', 'Esme Morgan', 'Emily Ramsey', 'Maria Thorisdottir',
+    'Fran Bentley', 'Alessia Russo', 'Ivana Fuso', 'Lucy Staniforth', 'Mollie Green', 'Carrie Jones', 'Ona Batlle',
+    'Danielle Carter', 'Deanna Cooper', 'Jessica Fishlock', 'Silvana Flores', 'Ga-Eul Jeon', 'Emma Mukandi',
+    'Erin Nayler', 'Lily Woodham', 'So-hyun Cho', 'Abbie McManus', 'Alanna Kennedy', 'Sophie Whitehouse',
+    'Alex Morgan', 'Shelina Zadorsky', 'Kerys Harrop', 'Aurora Mikalsen', 'Rachel Williams', 'Dagný Brynjarsdóttir',
+    'Anouk Denton', 'Jacynta Galabadaarachchi', 'Emily Ramsey', 'Lois Joel', 'Rachel Daly', 'Emily van Egmond',
+    'Hawa Cissoko', 'Kateřina Svitková', 'Mackenzie Arnold', 'Mia Cruickshank', 'Ruby Grant', 'Maz Pacheco',
+    ]
+
+# letters NFKD does not split into a base letter and an accent
+FOLDED_LETTERS = str.maketrans({'ß': 'ss', 'ø': 'o', 'Ø': 'O', 'æ': 'ae', 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE', 'đ': 'd',
+                                'Đ': 'D', 'ł': 'l', 'Ł': 'L', 'ð': 'd', 'Ð': 'D', 'þ': 'th', 'Þ': 'Th', 'ı': 'i'})
+
+# candidates scored per lookup, the players sharing the most trigrams with the name
+N_CANDIDATES = 25
+
+THRESHOLD = 70
+
+
+def normalise_name(name):
+    """
+    Returns the name folded to lower case ascii words, e.g. 'Zećira Mušović' -> 'zecira musovic', 'Jamie-Lee Napier'
+    -> 'jamie lee napier'
+    """
+    name = unicodedata.normalize('NFKD', str(name).translate(FOLDED_LETTERS))
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name.lower()).split())
+
+
+def trigrams(name):
+    """
+    Returns the set of character trigrams of a normalised name, with the word boundaries marked
+    """
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def score(a, b):
+    """
+    Similarity of two normalised names from 0 to 100 - fuzz.WRatio, or the best of difflib's ratio on the names and on
+    their sorted words when fuzzywuzzy is not installed
+    """
+    if fuzz is not None:
+        return fuzz.WRatio(a, b)
+    ratio = difflib.SequenceMatcher(None, a, b).ratio()
+    sorted_ratio = difflib.SequenceMatcher(None, ' '.join(sorted(a.split())), ' '.join(sorted(b.split()))).ratio()
+    return int(round(100 * max(ratio, 0.95 * sorted_ratio)))
+
+
+class PlayerIndex:
+    """
+    Trigram index over the distinct (player_id, player_name) pairs of a players table
+
+    index = PlayerIndex(pd.concat([players, players_test]))
+    index.match('Benedicte Haland', limit=2)
+    """
+
+    def __init__(self, players, n_candidates=N_CANDIDATES):
+        self.n_candidates = n_candidates
+        self.players = players[['player_id', 'player_name']].drop_duplicates().reset_index(drop=True)
+        self.names = [normalise_name(name) for name in self.players['player_name']]
+
+        postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for trigram in trigrams(name):
+                postings[trigram].append(i)
+        self._postings = {trigram: np.array(rows, dtype=np.int32) for trigram, rows in postings.items()}
+
+    def __len__(self):
+        return len(self.players)
+
+    def candidates(self, name):
+        """
+        Returns the positions of the players sharing the most trigrams with a normalised name
+        """
+        rows = [self._postings[trigram] for trigram in trigrams(name) if trigram in self._postings]
+        if not rows:
+            return np.array([], dtype=int)
+        shared = np.bincount(np.concatenate(rows), minlength=len(self))
+        candidates = np.flatnonzero(shared)
+        if len(candidates) > self.n_candidates:
+            candidates = np.sort(candidates[np.argpartition(-shared[candidates], self.n_candidates)[:self.n_candidates]])
+        return candidates
+
+    def match(self, name, limit=2, threshold=0):
+        """
+        The closest players to a name
+
+        Inputs:
+        - name:       the name to look up, as written
+        - limit:      the number of matches returned
+        - threshold:  minimum score of a match
+
+        Returns a list of (player_id, player_name, score), best first
+        """
+        name = normalise_name(name)
+        matches = [(self.players.at[i, 'player_id'], self.players.at[i, 'player_name'], score(name, self.names[i]))
+                   for i in self.candidates(name)]
+        matches = [match for match in matches if match[2] >= threshold]
+        # ties go to the player listed first in the table
+        return sorted(matches, key=lambda match: -match[2])[:limit]
+
+
+def resolve_transfers(transfer_names, players, players_test, threshold=THRESHOLD, exclude_positions=('Goalkeeper',)):
+    """
+    Resolve a transfer list to the target_players table in one call
+
+    Inputs:
+    - transfer_names:     the players' names as collected, e.g. TRANSFER_PLAYERS
+    - players:            the players table of the seasons before the transfers (train)
+    - players_test:       the players table of the season after the transfers (test) - the names are matched here
+    - threshold:          minimum match score, 70 as in Notebook 2
+    - exclude_positions:  starting positions whose appearances are left out, as Notebook 2 leaves out the goalkeepers
+
+    Returns target_players as written by Notebook 2 - player_id, player_name, minutes_played (in the test season),
+    sorted by minutes_played - with the pre_team_id / post_team_id the player played most minutes for before and after
+    the transfer (NaN for a player new to the tables), and the transfer name and score of the match
+    """
+    index = PlayerIndex(players_test)
+    matched = []
+    for transfer_name in dict.fromkeys(transfer_names):
+        best = index.match(transfer_name, limit=1, threshold=threshold)
+        if best:
+            player_id, player_name, match_score = best[0]
+            matched.append({'player_id': player_id, 'transfer_name': transfer_name, 'match_score': match_score})
+    # two names resolved to the same player keep the better match
+    matched = pd.DataFrame(matched, columns=['player_id', 'transfer_name', 'match_score'])
+    matched = matched.sort_values('match_score', ascending=False, kind='stable').drop_duplicates('player_id')
+
+    appearances = players_test[players_test['player_id'].isin(matched['player_id'])
+                               & ~players_test['starting_position_name'].isin(exclude_positions)]
+    target_players = (appearances.groupby(['player_id', 'player_name'])['minutes_played'].sum().reset_index()
+                      .sort_values(by='minutes_played', ascending=False))
+
+    target_players['pre_team_id'] = target_players['player_id'].map(main_team(players))
+    target_players['post_team_id'] = target_players['player_id'].map(main_team(players_test))
+    return target_players.merge(matched, on='player_id', how='left').reset_index(drop=True)
+
+
+def main_team(players):
+    """
+    Returns the team_id each player played the most minutes for, indexed by player_id
+    """
+    minutes = players.groupby(['player_id', 'team_id'])['minutes_played'].sum().reset_index()
+    minutes = minutes.sort_values('minutes_played', ascending=False, kind='stable').drop_duplicates('player_id')
+    return minutes.set_index('player_id')['team_id']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--names', default=None, help='file with one transfer name per line, defaults to TRANSFER_PLAYERS')
+    parser.add_argument('--threshold', type=int, default=THRESHOLD)
+    parser.add_argument('--out', default=None, help='csv file to write target_players to')
+    args = parser.parse_args()
+
+    transfer_names = TRANSFER_PLAYERS
+    if args.names:
+        with open(args.names, encoding='utf-8') as f:
+            transfer_names = [line.strip() for line in f if line.strip()]
+
+    tables = load_data.load_tables(args.mode)
+    target_players = resolve_transfers(transfer_names, tables.players, tables.players_test, args.threshold)
+    print(target_players.to_string(index=False))
+    print(f'{len(target_players)} of {len(set(transfer_names))} transfer names resolved')
+
+    if args.out:
+        target_players.to_csv(args.out, index=False)
+
+
+if __name__ == '__main__':
+    main()
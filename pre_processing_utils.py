@@ -1,3 +1,14 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import make_column_transformer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+
 def create_team_data(team_col: str, team_id: int, train_df, test_df, target: str):
 
     """
@@ -91,6 +102,116 @@ def create_player_data(mode, train_df, test_df, player_id, **kwargs):
 
         return X_train, y_train, X_test, y_test
 
+
+class PreparedData:
+    """
+    Index-backed version of create_team_data and create_player_data, for slicing the same train/test frames many times
+    (e.g. every team in the league).
+
+    The NaN mask and the combined n-k_same_player leakage mask are computed once per frame, and the first lookup on a
+    column sorts the kept rows by that column once and records the row range of every value. Each slice then only
+    touches its own rows instead of scanning the whole frame. The returned data is the same as the functions above,
+    rows in the same order.
+
+    data = ppu.PreparedData(modeling_train_df, modeling_test_df)
+    for team_id in teams:
+        X_train, y_train, X_test, y_test = data.create_team_data('team_id', team_id, 'vaep_value')
+    """
+
+    def __init__(self, train_df, test_df):
+        self.train_df = train_df
+        self.test_df = test_df
+        self._train = _RowIndex(train_df)
+        self._test = _RowIndex(test_df)
+
+    def create_team_data(self, team_col: str, team_id: int, target: str):
+        """
+        Same as create_team_data(team_col, team_id, train_df, test_df, target)
+
+        Returns  X_train, y_train, X_test, y_test
+        """
+        team_train_set = self._train.rows(team_col, team_id)
+        team_test_set = self._test.rows(team_col, team_id)
+
+        return (team_train_set.drop(columns=[target]), team_train_set[target],
+                team_test_set.drop(columns=[target]), team_test_set[target])
+
+    def team_positions(self, team_col: str, team_id: int):
+        """
+        Row positions of create_team_data's train and test sets in train_df and test_df, e.g. to slice a copy of the
+        frames held in another process
+
+        Returns  train_positions, test_positions
+        """
+        return self._train.positions(team_col, team_id), self._test.positions(team_col, team_id)
+
+    def create_player_data(self, mode, player_id, **kwargs):
+        """
+        Same as create_player_data(mode, train_df, test_df, player_id, **kwargs)
+        """
+        if mode == 'classification':
+            player_train_set = self._train.rows('player_id', player_id, exclude_same_player=True)
+            player_test_set = self._test.rows('player_id', player_id, exclude_same_player=True)
+
+            return (player_train_set.drop(columns=['type_name_encoded', 'end_pitch_zone']),
+                    player_train_set['type_name_encoded'], player_train_set['end_pitch_zone'],
+                    player_test_set.drop(columns=['type_name_encoded', 'end_pitch_zone']),
+                    player_test_set['type_name_encoded'], player_test_set['end_pitch_zone'])
+
+        if mode == 'regression':
+            reg_target = kwargs.get('reg_target', None)
+
+            player_train_set = self._train.rows('player_id', player_id)
+            player_test_set = self._test.rows('player_id', player_id)
+
+            return (player_train_set.drop(columns=[reg_target]), player_train_set[reg_target],
+                    player_test_set.drop(columns=[reg_target]), player_test_set[reg_target])
+
+
+class _RowIndex:
+    """
+    value -> row positions index over one frame, for rows without NaN (and optionally without leakage)
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.complete = df.notna().all(axis=1).to_numpy()
+
+        # rows where the same player performed one of the previous actions leak into the player models
+        same_player_cols = [f'n-{n}_same_player' for n in range(1, 6) if f'n-{n}_same_player' in df.columns]
+        self.no_leak = self.complete.copy()
+        for col in same_player_cols:
+            self.no_leak &= (df[col] != True).to_numpy()
+
+        self._indexes = {}
+
+    def rows(self, col, value, exclude_same_player=False):
+        return self.df.take(self.positions(col, value, exclude_same_player))
+
+    def positions(self, col, value, exclude_same_player=False):
+        key = (col, exclude_same_player)
+        if key not in self._indexes:
+            self._indexes[key] = self._build(col, self.no_leak if exclude_same_player else self.complete)
+
+        values, starts, stops, positions = self._indexes[key]
+        i = np.searchsorted(values, value)
+        if i < len(values) and values[i] == value:
+            return positions[starts[i]:stops[i]]
+        return positions[:0]
+
+    def _build(self, col, mask):
+        positions = np.flatnonzero(mask)
+        keys = self.df[col].to_numpy()[positions]
+
+        # stable sort keeps the original row order within each value
+        order = np.argsort(keys, kind='stable')
+        positions = positions[order]
+        values, starts = np.unique(keys[order], return_index=True)
+        stops = np.append(starts[1:], len(positions))
+
+        return values, starts, stops, positions
+
+
 def set_ct_mode(mode):
     """ 
     Modes:
@@ -638,3 +759,498 @@ def set_ct_mode(mode):
             'n-5_xT_value'
             ]
         return numeric_features, categorical_features, drop_features
+
+
+CT_MODES = [
+    'player-action',
+    'player-end',
+    'player-vaep',
+    'player-xt',
+    'team-action',
+    'team-end',
+    'team-vaep',
+    'team-xt',
+    ]
+
+# the target each team / player mode predicts, and the table it is trained on (the xt modes use the xT tables)
+MODE_TARGETS = {
+    'player-action': 'type_name_encoded',
+    'player-end': 'end_pitch_zone',
+    'player-vaep': 'vaep_value',
+    'player-xt': 'xT_value',
+    'team-action': 'type_name_encoded',
+    'team-end': 'end_pitch_zone',
+    'team-vaep': 'vaep_value',
+    'team-xt': 'xT_value',
+    }
+
+MODE_TABLES = {mode: 'xt' if mode.endswith('-xt') else 'vaep' for mode in CT_MODES}
+
+# fitted transformers, keyed by (mode, team_id, sparse_output, data fingerprint) - most recently used last
+_FITTED_CTS = OrderedDict()
+_FITTED_CTS_MAXSIZE = 64
+_ct_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def make_ct(mode, sparse_output=None):
+    """
+    The column transformer used throughout the notebooks for a set_ct_mode mode: StandardScaler on the numeric features,
+    OneHotEncoder(handle_unknown='ignore') on the categorical features, drop the rest.
+
+    Inputs:
+    - mode:           one of CT_MODES
+    - sparse_output:  None keeps the sklearn default (sparse when the output is mostly zeros), True always returns a
+                      sparse matrix, False always returns a dense array
+
+    Returns an unfitted ColumnTransformer
+    """
+    numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+
+    if sparse_output is None:
+        sparse_threshold = 0.3
+    else:
+        sparse_threshold = 1.0 if sparse_output else 0.0
+
+    return make_column_transformer(
+        (StandardScaler(), numeric_features),
+        (_one_hot_encoder(sparse_output), categorical_features),
+        ('drop', drop_features),
+        sparse_threshold=sparse_threshold)
+
+
+def get_column_transformer(mode, team_id=None, sparse_output=None, cache=True):
+    """
+    Factory for the column transformers of the eight set_ct_mode modes, replaces building make_column_transformer by hand
+    in every cell:
+
+        ct = ppu.get_column_transformer('team-vaep', team_id=post_transfer_team)
+        pipe_vaep = make_pipeline(ct, xgb.XGBRegressor(...))
+
+    With cache=True the fitted one-hot vocabularies and scaler statistics are memoised per (mode, team_id, data
+    fingerprint), so refitting on the same slice (e.g. the same grid search fold for every candidate) is skipped.
+
+    Returns a CachedColumnTransformer, or a plain ColumnTransformer when cache=False
+    """
+    if mode not in CT_MODES:
+        raise ValueError(f'mode must be one of {CT_MODES}, got {mode!r}')
+
+    if not cache:
+        return make_ct(mode, sparse_output)
+
+    return CachedColumnTransformer(mode, team_id=team_id, sparse_output=sparse_output)
+
+
+def ct_cache_info():
+    """
+    Returns the hits, misses and current size of the fitted column transformer cache
+    """
+    return dict(_ct_cache_stats, size=len(_FITTED_CTS))
+
+
+def clear_ct_cache():
+    _FITTED_CTS.clear()
+    _ct_cache_stats.update(hits=0, misses=0)
+
+
+class CachedColumnTransformer(BaseEstimator, TransformerMixin):
+    """
+    make_ct(mode) with memoised fits - see get_column_transformer. The fitted ColumnTransformer is available as
+    transformer_ (and named_transformers_ is passed through, as used for the feature importances in Notebook 5).
+    """
+
+    def __init__(self, mode, team_id=None, sparse_output=None):
+        self.mode = mode
+        self.team_id = team_id
+        self.sparse_output = sparse_output
+
+    def fit(self, X, y=None):
+        key = (self.mode, self.team_id, self.sparse_output, _fingerprint(X, self.mode))
+
+        if key in _FITTED_CTS:
+            _FITTED_CTS.move_to_end(key)
+            _ct_cache_stats['hits'] += 1
+        else:
+            _ct_cache_stats['misses'] += 1
+            _FITTED_CTS[key] = make_ct(self.mode, self.sparse_output).fit(X, y)
+            if len(_FITTED_CTS) > _FITTED_CTS_MAXSIZE:
+                _FITTED_CTS.popitem(last=False)
+
+        self.transformer_ = _FITTED_CTS[key]
+        return self
+
+    def transform(self, X):
+        return self.transformer_.transform(X)
+
+    def get_feature_names_out(self, input_features=None):
+        return self.transformer_.get_feature_names_out(input_features)
+
+    @property
+    def named_transformers_(self):
+        return self.transformer_.named_transformers_
+
+
+class SharedColumnTransformer:
+    """
+    The make_ct transformers of several modes trained on the same rows, fitted as one - e.g. team-vaep, team-action and
+    team-end, which are all trained on the create_team_data slice of the vaep frame. The union of the modes' numeric
+    and categorical features is scaled and one-hot encoded once, and each mode's matrix is that output masked to the
+    mode's own features, so its drop list (the leakage columns, the other modes' targets) is never selected.
+
+    The masked matrices are the same as make_ct(mode).fit_transform on the same rows - column for column, and sparse or
+    dense as the ColumnTransformer would decide.
+
+    shared = ppu.SharedColumnTransformer(['team-vaep', 'team-action', 'team-end'])
+    blocks = shared.fit_blocks(team_train_set)
+    model.fit(shared.select(blocks, 'team-vaep'), y_train)
+    pipe_vaep = make_pipeline(shared.mode_transformer('team-vaep'), model)
+    """
+
+    def __init__(self, modes, sparse_output=None):
+        self.modes = list(modes)
+        self.sparse_output = sparse_output
+
+        for mode in self.modes:
+            numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+            if MODE_TARGETS[mode] in numeric_features + categorical_features:
+                raise ValueError(f'{mode} uses its own target {MODE_TARGETS[mode]} as a feature')
+
+        # the union of the features, in the order of the modes
+        self.numeric_features = list(dict.fromkeys(col for mode in self.modes for col in set_ct_mode(mode)[0]))
+        self.categorical_features = list(dict.fromkeys(col for mode in self.modes for col in set_ct_mode(mode)[1]))
+
+    def fit_blocks(self, X):
+        """
+        Fit the scaler and the one-hot encoder on the union of the features
+
+        Returns the transformed (numeric, categorical) blocks of X, to select the modes' matrices from
+        """
+        self.scaler_ = StandardScaler().fit(X[self.numeric_features])
+        self.encoder_ = _one_hot_encoder(True).fit(X[self.categorical_features])
+        blocks = self.transform_blocks(X)
+        numeric, categorical = blocks
+
+        # the one-hot columns of every categorical feature, and the number of stored values in each of them
+        offsets = np.cumsum([0] + [len(categories) for categories in self.encoder_.categories_])
+        encoded_nnz = np.bincount(categorical.indices, minlength=categorical.shape[1])
+
+        self.masks_ = {}
+        self.sparse_outputs_ = {}
+        for mode in self.modes:
+            numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+            numeric_mask = np.array([self.numeric_features.index(col) for col in numeric_features], dtype=int)
+            categorical_mask = np.concatenate(
+                [np.arange(offsets[i], offsets[i + 1]) for i in map(self.categorical_features.index, categorical_features)]
+                + [np.array([], dtype=int)])
+            self.masks_[mode] = (numeric_mask, categorical_mask)
+
+            # the ColumnTransformer's sparse / dense decision on the training rows
+            nnz = numeric.shape[0] * len(numeric_mask) + encoded_nnz[categorical_mask].sum()
+            total = numeric.shape[0] * (len(numeric_mask) + len(categorical_mask))
+            self.sparse_outputs_[mode] = bool(total) and nnz / total < _sparse_threshold(self.sparse_output)
+
+        return blocks
+
+    def transform_blocks(self, X):
+        """
+        Returns the transformed (numeric, categorical) blocks of X, e.g. of the test rows
+        """
+        return self.scaler_.transform(X[self.numeric_features]), self.encoder_.transform(X[self.categorical_features]).tocsr()
+
+    def select(self, blocks, mode):
+        """
+        Returns the matrix of one mode from the blocks of fit_blocks / transform_blocks
+        """
+        numeric, categorical = blocks
+        numeric_mask, categorical_mask = self.masks_[mode]
+        return _hstack(numeric[:, numeric_mask], categorical[:, categorical_mask], self.sparse_outputs_[mode])
+
+    def mode_transformer(self, mode):
+        """
+        Returns a fitted ModeColumnTransformer for one mode, with the statistics and categories of the shared fit - for
+        the mode's prediction pipeline, it only reads the mode's own columns
+        """
+        numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+        numeric_mask, categorical_mask = self.masks_[mode]
+
+        ct = ModeColumnTransformer(mode, self.sparse_output)
+        ct.numeric_features_ = numeric_features
+        ct.categorical_features_ = categorical_features
+        ct.scaler_ = _fitted_scaler(numeric_features, self.scaler_, numeric_mask)
+        ct.encoder_ = _fitted_one_hot_encoder(
+            categorical_features, [self.encoder_.categories_[self.categorical_features.index(col)] for col in categorical_features])
+        ct.sparse_output_ = self.sparse_outputs_[mode]
+        return ct
+
+
+class ModeColumnTransformer(BaseEstimator, TransformerMixin):
+    """
+    make_ct(mode) as a single estimator: StandardScaler on the numeric features, OneHotEncoder(handle_unknown='ignore')
+    on the categorical features, drop the rest - the same output as the ColumnTransformer. Fitted on its own, or taken
+    out of a SharedColumnTransformer with mode_transformer.
+    """
+
+    def __init__(self, mode, sparse_output=None):
+        self.mode = mode
+        self.sparse_output = sparse_output
+
+    def fit(self, X, y=None):
+        self.numeric_features_, self.categorical_features_, drop_features = set_ct_mode(self.mode)
+
+        self.scaler_ = StandardScaler().fit(X[self.numeric_features_])
+        self.encoder_ = _one_hot_encoder(True).fit(X[self.categorical_features_])
+
+        numeric, categorical = self._blocks(X)
+        nnz = numeric.size + categorical.nnz
+        total = numeric.size + categorical.shape[0] * categorical.shape[1]
+        self.sparse_output_ = bool(total) and nnz / total < _sparse_threshold(self.sparse_output)
+        return self
+
+    def partial_fit(self, X, y=None):
+        """
+        Update the fit with one more batch of rows (see chunked_training.py): the scaler statistics and the categories
+        seen so far. The sparse / dense output follows make_ct's rule on all the batches - every fitted row has one
+        value per categorical feature, so the density only depends on the number of categories.
+        """
+        if not hasattr(self, 'scaler_'):
+            self.numeric_features_, self.categorical_features_, drop_features = set_ct_mode(self.mode)
+            self.scaler_ = StandardScaler()
+            self.categories_ = [None] * len(self.categorical_features_)
+
+        self.scaler_.partial_fit(X[self.numeric_features_])
+        for i, col in enumerate(self.categorical_features_):
+            values = np.asarray(pd.unique(X[col]))
+            self.categories_[i] = np.unique(values if self.categories_[i] is None
+                                            else np.concatenate([self.categories_[i], values]))
+        self.encoder_ = _fitted_one_hot_encoder(self.categorical_features_, self.categories_)
+
+        n_features = len(self.numeric_features_) + len(self.categorical_features_)
+        n_columns = len(self.numeric_features_) + sum(len(categories) for categories in self.categories_)
+        self.sparse_output_ = bool(n_columns) and n_features / n_columns < _sparse_threshold(self.sparse_output)
+        return self
+
+    def transform(self, X):
+        return _hstack(*self._blocks(X), self.sparse_output_)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array([f'standardscaler__{col}' for col in self.numeric_features_]
+                        + [f'onehotencoder__{name}' for name in self.encoder_.get_feature_names_out(self.categorical_features_)],
+                        dtype=object)
+
+    def _blocks(self, X):
+        return self.scaler_.transform(X[self.numeric_features_]), self.encoder_.transform(X[self.categorical_features_]).tocsr()
+
+
+def transformer_state(ct, mode=None):
+    """
+    The fitted state of a column transformer as plain JSON types - the features, the scaler statistics, the one-hot
+    categories and the sparse / dense output - to store next to data transformed with it (see design_matrices.py) or
+    next to a model (see model_registry.py)
+
+    Inputs:
+    - ct:    a fitted ModeColumnTransformer, CachedColumnTransformer or make_ct ColumnTransformer
+    - mode:  the set_ct_mode mode, for a ColumnTransformer (which does not know its mode)
+
+    Returns a dict, transformer_from_state rebuilds the transformer from it
+    """
+    if isinstance(ct, CachedColumnTransformer):
+        mode = mode or ct.mode
+        ct = ct.transformer_
+
+    if isinstance(ct, ModeColumnTransformer):
+        mode, sparse_output = ct.mode, ct.sparse_output
+        numeric_features, scaler = ct.numeric_features_, ct.scaler_
+        categorical_features, encoder = ct.categorical_features_, ct.encoder_
+    else:
+        sparse_output = {0.3: None, 1.0: True, 0.0: False}.get(ct.sparse_threshold)
+        columns = {name: list(columns) for name, transformer, columns in ct.transformers_}
+        numeric_features, scaler = columns['standardscaler'], ct.named_transformers_['standardscaler']
+        categorical_features, encoder = columns['onehotencoder'], ct.named_transformers_['onehotencoder']
+
+    return {
+        'mode': mode,
+        'sparse_output': sparse_output,
+        'sparse_output_': bool(ct.sparse_output_),
+        'numeric_features': list(numeric_features),
+        'mean': scaler.mean_.tolist(),
+        'var': scaler.var_.tolist(),
+        'scale': scaler.scale_.tolist(),
+        'n_samples_seen': np.asarray(scaler.n_samples_seen_).tolist(),
+        'categorical_features': list(categorical_features),
+        'categories': [np.asarray(values).tolist() for values in encoder.categories_],
+        'category_dtypes': [str(np.asarray(values).dtype) for values in encoder.categories_],
+        }
+
+
+def transformer_from_state(state):
+    """
+    Returns the fitted ModeColumnTransformer of a transformer_state dict - it transforms like the original
+    """
+    ct = ModeColumnTransformer(state['mode'], state['sparse_output'])
+    ct.numeric_features_ = list(state['numeric_features'])
+    ct.categorical_features_ = list(state['categorical_features'])
+
+    scaler = StandardScaler()
+    scaler.mean_ = np.asarray(state['mean'], dtype=float)
+    scaler.var_ = np.asarray(state['var'], dtype=float)
+    scaler.scale_ = np.asarray(state['scale'], dtype=float)
+    # an int, or an array per column when the fit data had missing values
+    n_samples_seen = np.asarray(state['n_samples_seen'])
+    scaler.n_samples_seen_ = n_samples_seen if n_samples_seen.ndim else int(n_samples_seen)
+    ct.scaler_ = _fitted_scaler(ct.numeric_features_, scaler, slice(None))
+
+    ct.encoder_ = _fitted_one_hot_encoder(
+        ct.categorical_features_,
+        [np.asarray(values, dtype=dtype) for values, dtype in zip(state['categories'], state['category_dtypes'])])
+    ct.sparse_output_ = state['sparse_output_']
+    return ct
+
+
+def _sparse_threshold(sparse_output):
+    # the sparse_threshold make_ct gives the ColumnTransformer
+    if sparse_output is None:
+        return 0.3
+    return 1.0 if sparse_output else 0.0
+
+
+def _hstack(numeric, categorical, sparse_output):
+    # ColumnTransformer._hstack of the scaler and encoder outputs
+    if sparse_output:
+        return sparse.hstack([numeric, categorical]).tocsr()
+    return np.hstack([numeric, categorical.toarray()])
+
+
+def _fitted_scaler(columns, scaler, mask):
+    """
+    A StandardScaler for some of the columns of a fitted one, with their statistics
+    """
+    subset = StandardScaler()
+    subset.mean_ = scaler.mean_[mask]
+    subset.var_ = scaler.var_[mask]
+    subset.scale_ = scaler.scale_[mask]
+    # an array per column when the fit data had missing values
+    subset.n_samples_seen_ = scaler.n_samples_seen_[mask] if np.ndim(scaler.n_samples_seen_) else scaler.n_samples_seen_
+    subset.n_features_in_ = len(columns)
+    subset.feature_names_in_ = np.asarray(columns, dtype=object)
+    return subset
+
+
+def _fitted_one_hot_encoder(columns, categories):
+    """
+    A sparse OneHotEncoder(handle_unknown='ignore') with the given categories per column, fitted without the data
+    """
+    encoder = _one_hot_encoder(True)
+    encoder.set_params(categories=[np.asarray(values) for values in categories])
+    return encoder.fit(pd.DataFrame({col: pd.Series(values[:1], dtype=np.asarray(values).dtype)
+                                     for col, values in zip(columns, categories)}))
+
+
+def _one_hot_encoder(sparse_output):
+    if sparse_output is None:
+        return OneHotEncoder(handle_unknown='ignore')
+    # the argument was renamed from sparse to sparse_output in scikit-learn 1.2
+    try:
+        return OneHotEncoder(handle_unknown='ignore', sparse_output=sparse_output)
+    except TypeError:
+        return OneHotEncoder(handle_unknown='ignore', sparse=sparse_output)
+
+
+def _fingerprint(X, mode):
+    """
+    Hash of the columns the mode's transformer reads
+    """
+    numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+    columns = [col for col in numeric_features + categorical_features if col in X.columns]
+
+    row_hashes = pd.util.hash_pandas_object(X[columns], index=False).to_numpy()
+    digest = hashlib.sha1(row_hashes.tobytes())
+    digest.update(repr((X.shape, columns)).encode())
+    return digest.hexdigest()
+
+
+# memory-compact dtypes for the vaep / xt tables, by column name - see feature_schema
+_BOOL_SUFFIXES = ('_same_team', '_same_player')
+_INT8_SUFFIXES = ('_direction',)
+_INT8_COLUMNS = ('home', 'period_id')
+_CATEGORY_SUFFIXES = ('_pitch_zone', '_name', 'type_name_encoded')
+_FLOAT32_SUFFIXES = ('_x', '_y', '_value', '_distance', '_dif', 'time_seconds')
+
+
+def feature_schema():
+    """
+    Compact dtypes for every column used by the set_ct_mode modes (features, targets and dropped columns):
+
+    - category:  pitch zones and names (*_pitch_zone, *_name, type_name_encoded)
+    - bool:      *_same_team, *_same_player
+    - int8:      direction flags, home and period_id
+    - float32:   coordinates, distances, action values and the other numeric features
+
+    Columns matching none of these (the ids) keep their dtype.
+
+    Returns a {column: dtype} dict
+    """
+    schema = {}
+    for mode in CT_MODES:
+        numeric_features, categorical_features, drop_features = set_ct_mode(mode)
+        for col in numeric_features + categorical_features + drop_features:
+            dtype = 'float32' if col in numeric_features else _schema_dtype(col)
+            if dtype is not None:
+                schema.setdefault(col, dtype)
+    return schema
+
+
+def apply_schema(df, schema=None):
+    """
+    Convert a vaep / xt table to the feature_schema dtypes - columns no mode uses (e.g. n-k_type_name) get the dtype of
+    their name, and a column with missing values is never made bool / int8
+
+    Returns a new dataframe
+    """
+    schema = feature_schema() if schema is None else schema
+
+    dtypes = {}
+    for col in df.columns:
+        dtype = schema[col] if col in schema else _schema_dtype(col)
+        if dtype is None or df[col].dtype == dtype:
+            continue
+        if dtype in ('bool', 'int8') and df[col].isna().any():
+            continue
+        dtypes[col] = dtype
+    return df.astype(dtypes)
+
+
+def _schema_dtype(col):
+    if col.endswith(_BOOL_SUFFIXES):
+        return 'bool'
+    if col.endswith(_INT8_SUFFIXES) or col in _INT8_COLUMNS:
+        return 'int8'
+    if col.endswith(_CATEGORY_SUFFIXES):
+        return 'category'
+    if col.endswith(_FLOAT32_SUFFIXES):
+        return 'float32'
+    return None
+
+
+def enable_copy_on_write():
+    """
+    Turn on pandas copy-on-write (pandas >= 1.5), so modeling_frame can hand out views instead of copies
+
+    Returns True if copy-on-write is on
+    """
+    try:
+        pd.set_option('mode.copy_on_write', True)
+    # pandas' OptionError subclasses both, and is only public (pd.errors.OptionError) from pandas 1.5
+    except (KeyError, AttributeError):
+        return False
+    return True
+
+
+def modeling_frame(df):
+    """
+    Replaces modeling_train_df = vaep.copy() - a view of df when copy-on-write is on (see enable_copy_on_write), so
+    nothing is copied until a column is modified, and a full copy otherwise
+    """
+    try:
+        copy_on_write = pd.get_option('mode.copy_on_write') is True
+    except (KeyError, AttributeError):
+        copy_on_write = False
+    return df.copy(deep=not copy_on_write)
@@ -0,0 +1,348 @@
+# prediction service - "how would player X perform at club Y", answered over HTTP from the team_training.py models
+#
+#   python prediction_service.py --version 20230101-120000 --port 8050
+#   python prediction_service.py --version 20230101-120000 --registry      # the model_registry.py copies, load faster
+#   curl 'http://localhost:8050/predict?player_id=15579&team_id=965'
+#   curl 'http://localhost:8050/stats'
+#
+# runs offline from the local (cached) datasets. Each player's pre-transfer actions are sliced once at start-up, the
+# clubs' pipelines are kept deserialised in an LRU pool, and concurrent requests are micro-batched so one predict call
+# per (club, mode) answers every request for that club in the batch. Answers are kept in an LRU result cache, which
+# --warm fills for every target player at start-up (one batched predict per club and mode) so those requests never
+# reach the pipelines.
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import load_data
+import team_training
+import transfer_scoring
+
+
+class PipelinePool:
+    """
+    LRU pool of deserialised club pipelines - {mode: artifact} per team_id, at most maxsize clubs in memory
+    """
+
+    def __init__(self, models_dir, version, maxsize=32, modes=team_training.TEAM_MODES, registry=False):
+        self.models_dir = models_dir
+        self.version = version
+        self.maxsize = maxsize
+        self.modes = modes
+        self.registry = registry
+        self.hits = 0
+        self.misses = 0
+        self._pipelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, team_id):
+        with self._lock:
+            if team_id in self._pipelines:
+                self._pipelines.move_to_end(team_id)
+                self.hits += 1
+                return self._pipelines[team_id]
+
+        # load outside the lock, so other clubs are not blocked while this one is read from disk
+        artifacts = transfer_scoring.load_team_models(self.models_dir, self.version, [team_id], self.modes,
+                                                      self.registry)[team_id]
+
+        with self._lock:
+            self.misses += 1
+            self._pipelines[team_id] = artifacts
+            self._pipelines.move_to_end(team_id)
+            if len(self._pipelines) > self.maxsize:
+                self._pipelines.popitem(last=False)
+        return artifacts
+
+    def info(self):
+        return {'size': len(self._pipelines), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class PredictionService:
+    """
+    Micro-batching predictor: predict() queues the request, and a single batching thread collects up to max_batch
+    requests (waiting at most max_wait_ms for more), groups them by club and scores each group with one
+    transfer_scoring.score_transfers call.
+
+    Inputs:
+    - tables:       the datasets, e.g. load_data.load_tables('local')
+    - models_dir:   root directory of the team_training.py model versions
+    - version:      the model version to serve
+    - pool_size:    number of clubs kept in the pipeline pool
+    - max_batch:    maximum number of requests per batch
+    - max_wait_ms:  how long the first request of a batch waits for others to join it
+    - cache_size:   number of (player, club) answers kept in the result cache
+    - registry:     load the clubs' pipelines from the model_registry.py copies (faster to load)
+    """
+
+    def __init__(self, tables, models_dir, version, pool_size=32, max_batch=64, max_wait_ms=2.0, cache_size=100000,
+                 registry=False):
+        self.pool = PipelinePool(models_dir, version, maxsize=pool_size, registry=registry)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+
+        summary = pd.read_csv(os.path.join(models_dir, version, 'summary.csv'))
+        self.team_ids = set(summary['team_id'].unique().tolist())
+
+        # every player's pre-transfer actions, sliced once
+        self.player_vaep = {player_id: df for player_id, df in tables.vaep.groupby('player_id', sort=False)}
+        self.player_xt = {player_id: df for player_id, df in tables.xt.groupby('player_id', sort=False)}
+        self.n_games = transfer_scoring.games_played(tables.players)
+        self._empty_vaep = tables.vaep.iloc[:0]
+        self._empty_xt = tables.xt.iloc[:0]
+
+        self.latencies = deque(maxlen=100000)
+        self.batch_sizes = deque(maxlen=100000)
+        self._requests = queue.Queue()
+        self._closed = False
+        # held while queueing a request and while closing, so no request is queued after the batching thread stops
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, player_id, team_id):
+        """
+        Returns the transfer_scoring summary of player_id at team_id as a dict - raises KeyError for an unknown player
+        or club, and RuntimeError once the service is closed
+        """
+        if self._closed:
+            raise RuntimeError('service closed')
+        if player_id not in self.player_vaep:
+            raise KeyError(f'unknown player_id {player_id}')
+        if team_id not in self.team_ids:
+            raise KeyError(f'no models for team_id {team_id}')
+
+        start = time.perf_counter()
+        result = self._cached(player_id, team_id)
+        if result is None:
+            future = Future()
+            with self._close_lock:
+                if self._closed:
+                    raise RuntimeError('service closed')
+                self._requests.put((player_id, team_id, future))
+            result = future.result()
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def warm(self, player_ids, team_ids=None):
+        """
+        Score every (player, club) pair up front - one score_transfers call per club - and keep the answers in the
+        result cache, e.g. service.warm(tables.target_players['player_id'])
+        """
+        player_ids = [player_id for player_id in dict.fromkeys(player_ids) if player_id in self.player_vaep]
+        for team_id in sorted(self.team_ids if team_ids is None else team_ids):
+            self._store(team_id, player_ids, self._score_team(team_id, player_ids))
+
+    def stats(self):
+        """
+        Returns the request count, p50 / p99 latency (ms), mean batch size and the pipeline pool info
+        """
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            'result_cache': {'size': len(self._results), 'maxsize': self.cache_size, 'hits': self.cache_hits},
+            'pipeline_pool': self.pool.info(),
+            }
+
+    def close(self):
+        with self._close_lock:
+            self._closed = True
+            self._requests.put(None)
+        self._thread.join()
+
+        # the requests the batching thread did not get to
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[2].set_exception(RuntimeError('service closed'))
+
+    def _run(self):
+        while not self._closed:
+            request = self._requests.get()
+            if request is None:
+                break
+            batch = [request]
+
+            # collect the requests arriving within max_wait of the first one
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._closed = True
+                    break
+                batch.append(request)
+
+            self.batch_sizes.append(len(batch))
+            self._score(batch)
+
+    def _score(self, batch):
+        by_team = {}
+        for player_id, team_id, future in batch:
+            by_team.setdefault(team_id, []).append((player_id, future))
+
+        for team_id, requests in by_team.items():
+            player_ids = list(dict.fromkeys(player_id for player_id, future in requests))
+            try:
+                results = self._store(team_id, player_ids, self._score_team(team_id, player_ids))
+            except Exception as e:
+                for player_id, future in requests:
+                    future.set_exception(e)
+                continue
+
+            for player_id, future in requests:
+                future.set_result(results[player_id])
+
+    def _score_team(self, team_id, player_ids):
+        return transfer_scoring.score_transfers(
+            {team_id: self.pool.get(team_id)},
+            pd.concat([self._empty_vaep] + [self.player_vaep[player_id] for player_id in player_ids]),
+            pd.concat([self._empty_xt] + [self.player_xt.get(player_id, self._empty_xt) for player_id in player_ids]),
+            player_ids,
+            n_games=self.n_games)
+
+    def _cached(self, player_id, team_id):
+        with self._results_lock:
+            result = self._results.get((player_id, team_id))
+            if result is not None:
+                self._results.move_to_end((player_id, team_id))
+                self.cache_hits += 1
+            return result
+
+    def _store(self, team_id, player_ids, scores):
+        results = {}
+        for player_id in player_ids:
+            row = scores.loc[(player_id, team_id)]
+            results[player_id] = dict({'player_id': _native(player_id), 'team_id': _native(team_id)},
+                                      **{col: _native(value) for col, value in row.items()})
+
+        with self._results_lock:
+            for player_id, result in results.items():
+                self._results[player_id, team_id] = result
+                self._results.move_to_end((player_id, team_id))
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return results
+
+
+def make_server(service, host='127.0.0.1', port=8050):
+    """
+    Returns a ThreadingHTTPServer answering GET /predict?player_id=..&team_id=.. (or POST /predict with the same JSON
+    body) and GET /stats for the service
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                return self._reply(200, service.stats())
+            if url.path == '/predict':
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                return self._predict(params)
+            self._reply(404, {'error': f'unknown path {url.path}'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/predict':
+                return self._reply(404, {'error': f'unknown path {self.path}'})
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self._reply(400, {'error': 'body must be JSON'})
+            self._predict(params)
+
+        def _predict(self, params):
+            try:
+                player_id, team_id = int(params['player_id']), int(params['team_id'])
+            except (KeyError, TypeError, ValueError):
+                return self._reply(400, {'error': 'player_id and team_id must be integers'})
+            try:
+                self._reply(200, service.predict(player_id, team_id))
+            except KeyError as e:
+                self._reply(404, {'error': e.args[0]})
+            except Exception as e:
+                # e.g. a club whose model file is missing - the client still gets an answer
+                self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # one line per request is too much under load
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def _native(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models-dir', default=team_training.MODELS_DIR)
+    parser.add_argument('--version', required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--pool-size', type=int, default=32)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--warm', action='store_true', help='score every target player against every club at start-up')
+    parser.add_argument('--registry', action='store_true', help='load the model_registry.py copies of the pipelines')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables('local')
+    service = PredictionService(tables, args.models_dir, args.version, args.pool_size, args.max_batch,
+                                args.max_wait_ms, registry=args.registry)
+    if args.warm:
+        start = time.perf_counter()
+        service.warm(tables.target_players['player_id'])
+        print(f'result cache warmed in {time.perf_counter() - start:.1f}s')
+    server = make_server(service, args.host, args.port)
+    print(f'serving model version {args.version} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        print(json.dumps(service.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+# s3 loader - concurrent download of the project tables for load_data('s3'), with an ETag checked disk cache
+#
+#   xt, xt_test, vaep, ... = load_data.load_data('s3')            # uses this module
+#   frames = s3_loader.fetch_tables({'vaep': 'https://...', 'games': 's3://bucket/games.csv'})
+#
+#   python s3_loader.py                                          # fetch the config.py tables, print what was downloaded
+#   python s3_loader.py --local-root /tmp/bucket                 # offline, a directory standing in for the bucket
+#
+# every table is fetched in its own thread. The bytes are decoded into a DataFrame as they arrive - pandas reads the
+# response stream, and every chunk it reads is also written to the cache file - so download and parsing overlap, and
+# the tables overlap each other. The ETag of each object is kept next to its cached copy and sent back with the next
+# request (If-None-Match): an unchanged object answers 304 Not Modified and is read from the disk cache, only the
+# objects that changed are downloaded again. load_data('s3', cache=True) uses fetch_file instead: the cached copy is
+# brought up to date without being parsed, and its ETag is the fingerprint of load_data's parquet cache, so an unchanged
+# object is neither downloaded nor parsed.
+#
+# backends, picked by the URL scheme:
+# - http(s)://  public / pre-signed object URLs, with urllib
+# - s3://       boto3 (optional), with the usual AWS credentials
+# - file:// or a path, or any URL with --local-root / LocalBackend(root) - a directory standing in for the bucket, with
+#               the file's size and mtime as its ETag, to run everything offline
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+import load_data
+
+CACHE_DIR = 'data/s3_cache'
+
+# bytes read from a response per call
+CHUNK_SIZE = 1 << 20
+
+# objects downloaded vs answered 304 Not Modified and read from the disk cache, since the start of the session
+_fetch_stats = {'downloads': 0, 'not_modified': 0}
+_stats_lock = threading.Lock()
+
+
+class HTTPBackend:
+    """
+    GET with If-None-Match on http(s) URLs
+    """
+
+    def open(self, url, etag=None):
+        """
+        Returns (etag, stream) - or None when the object still has the given etag
+        """
+        request = urllib.request.Request(url, headers={'If-None-Match': etag} if etag else {})
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        return response.headers.get('ETag'), response
+
+
+class S3Backend:
+    """
+    get_object with IfNoneMatch on s3://bucket/key URLs - needs boto3
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            if boto3 is None:
+                raise ImportError('s3:// URLs need boto3 - or use public https URLs or a LocalBackend')
+            client = boto3.client('s3')
+        self.client = client
+
+    def open(self, url, etag=None):
+        parsed = urllib.parse.urlparse(url)
+        kwargs = {'Bucket': parsed.netloc, 'Key': parsed.path.lstrip('/')}
+        if etag:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            response = self.client.get_object(**kwargs)
+        except Exception as e:
+            # botocore's ClientError, with the HTTP status of the response
+            if getattr(e, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                return None
+            raise
+        return response['ETag'], response['Body']
+
+
+class LocalBackend:
+    """
+    A directory standing in for the bucket - file:// URLs and paths are read as they are, and with a root any URL is
+    read from <root>/<file name of the URL>. The ETag is the file's size and mtime, as a web server's.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def path(self, url):
+        parsed = urllib.parse.urlparse(url)
+        path = urllib.parse.unquote(parsed.path) if parsed.scheme in ('file', 's3', 'http', 'https') else url
+        if self.root is not None:
+            return os.path.join(self.root, os.path.basename(path))
+        return path
+
+    def open(self, url, etag=None):
+        path = self.path(url)
+        stat = os.stat(path)
+        current = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        if etag == current:
+            return None
+        return current, open(path, 'rb')
+
+
+def backend_for(url):
+    """
+    Returns the backend for a URL's scheme
+    """
+    scheme = urllib.parse.urlparse(url).scheme
+    if scheme in ('http', 'https'):
+        return HTTPBackend()
+    if scheme == 's3':
+        return S3Backend()
+    return LocalBackend()
+
+
+def fetch_tables(urls, cache_dir=CACHE_DIR, backend=None, max_workers=None):
+    """
+    Fetch and parse several csv objects concurrently
+
+    Inputs:
+    - urls:         {table: url}
+    - cache_dir:    where the objects and their ETags are cached, None to always download
+    - backend:      one backend for every URL (e.g. LocalBackend(root) offline), defaults to backend_for(url)
+    - max_workers:  concurrent fetches, defaults to one per table
+
+    Returns {table: DataFrame}, in the order of urls
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(urls))) as pool:
+        futures = {table: pool.submit(fetch_table, url, cache_dir, backend) for table, url in urls.items()}
+        return {table: future.result() for table, future in futures.items()}
+
+
+def fetch_table(url, cache_dir=CACHE_DIR, backend=None):
+    """
+    Fetch and parse one csv object - from the disk cache when its ETag has not changed
+
+    Returns a DataFrame
+    """
+    backend = backend or backend_for(url)
+    if cache_dir is None:
+        etag, stream = backend.open(url)
+        with contextlib.closing(stream):
+            return pd.read_csv(stream)
+
+    data_path, meta_path = _cache_paths(cache_dir, url)
+    opened = _open(backend, url, _cached_etag(data_path, meta_path))
+    if opened is None:
+        return pd.read_csv(data_path)
+
+    etag, stream = opened
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{data_path}.{os.getpid()}.{id(stream)}.tmp'
+    try:
+        with contextlib.closing(stream), open(tmp_path, 'wb') as sink:
+            tee = _TeeReader(stream, sink)
+            df = pd.read_csv(tee)
+            # whatever pandas did not need still belongs in the cached copy
+            tee.drain()
+        os.replace(tmp_path, data_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _write_meta(meta_path, url, etag)
+    return df
+
+
+def fetch_files(urls, cache_dir=CACHE_DIR, backend=None, max_workers=None):
+    """
+    fetch_file for several objects concurrently
+
+    Returns {table: (etag, path)}, in the order of urls
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(urls))) as pool:
+        futures = {table: pool.submit(fetch_file, url, cache_dir, backend) for table, url in urls.items()}
+        return {table: future.result() for table, future in futures.items()}
+
+
+def fetch_file(url, cache_dir=CACHE_DIR, backend=None):
+    """
+    Bring the cached copy of an object up to date without parsing it - it is only downloaded when its ETag changed -
+    e.g. for load_data's columnar cache, which only parses the csv when the ETag differs from the one it was built from
+
+    Returns (etag, path of the cached copy)
+    """
+    backend = backend or backend_for(url)
+    data_path, meta_path = _cache_paths(cache_dir, url)
+    etag = _cached_etag(data_path, meta_path)
+    opened = _open(backend, url, etag)
+    if opened is None:
+        return etag, data_path
+
+    etag, stream = opened
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{data_path}.{os.getpid()}.{id(stream)}.tmp'
+    try:
+        with contextlib.closing(stream), open(tmp_path, 'wb') as sink:
+            shutil.copyfileobj(stream, sink, CHUNK_SIZE)
+        os.replace(tmp_path, data_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _write_meta(meta_path, url, etag)
+    return etag, data_path
+
+
+def fetch_info():
+    """
+    Returns the number of objects downloaded and answered 304 Not Modified (read from the disk cache)
+    """
+    return dict(_fetch_stats)
+
+
+class _TeeReader:
+    """
+    File-like wrapper of a response stream that writes everything read from it to a sink
+    """
+
+    def __init__(self, stream, sink):
+        self.stream = stream
+        self.sink = sink
+
+    def read(self, size=-1):
+        data = self.stream.read(size) if size is not None and size >= 0 else self.stream.read()
+        self.sink.write(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def drain(self):
+        for data in iter(lambda: self.read(CHUNK_SIZE), b''):
+            pass
+
+    def __iter__(self):
+        return iter(lambda: self.read(CHUNK_SIZE), b'')
+
+
+def _open(backend, url, etag):
+    # the backend's conditional request, counted in the fetch stats
+    opened = backend.open(url, etag)
+    with _stats_lock:
+        _fetch_stats['not_modified' if opened is None else 'downloads'] += 1
+    return opened
+
+
+def _cached_etag(data_path, meta_path):
+    # the ETag of the cached copy, None when there is none
+    if os.path.exists(data_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return json.load(f).get('etag')
+    return None
+
+
+def _write_meta(meta_path, url, etag):
+    with open(meta_path, 'w') as f:
+        json.dump({'url': url, 'etag': etag, 'fetched': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+
+
+def _cache_paths(cache_dir, url):
+    # one file per URL, named after the object so the cache directory stays readable
+    name = os.path.basename(urllib.parse.urlparse(url).path) or 'object'
+    digest = hashlib.sha1(url.encode()).hexdigest()[:12]
+    base = os.path.join(cache_dir, f'{digest}-{name}')
+    return base, base + '.json'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--local-root', default=None, help='directory standing in for the bucket, to run offline')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        urls = {table: load_data._source('s3', table) for table in load_data.TABLES}
+    except ImportError:
+        # no config.py - the local root only needs the file names
+        if not args.local_root:
+            raise
+        urls = {table: f'{table}.csv' for table in load_data.TABLES}
+    backend = LocalBackend(args.local_root) if args.local_root else None
+
+    start = time.perf_counter()
+    frames = fetch_tables(urls, args.cache_dir, backend, args.workers)
+    for table, df in frames.items():
+        print(f'{table:<16} {len(df):>10,} rows')
+    info = fetch_info()
+    print(f"{info['downloads']} downloaded, {info['not_modified']} not modified, in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
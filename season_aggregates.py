@@ -0,0 +1,239 @@
+# season aggregates - per player / team / zone totals, per game and per 90 rates and action / end zone distributions
+#
+#   summaries = season_aggregates.load_summaries('local')      # from data/aggregates, rebuilt when a source changes
+#   summaries['players'].loc[(15579, 965, 90)]                  # one player's season at one club
+#
+#   python season_aggregates.py                                 # build (or check) the cache and print the top players
+#
+# replaces the hand normalisation of Notebook 6 (vaep sum / 30 pre transfer, / 22 post transfer, after filtering the
+# full frames for one player): the vaep and xt action tables of both splits are grouped once each into a compact cube
+#
+#   player_id, team_id, season_id, end_pitch_zone, type_name_encoded -> n_actions, vaep / offensive / defensive / xT sums
+#
+# and every summary is a small groupby of that cube. The per game and per 90 rates use the real appearances of the
+# players tables (games with minutes_played > 0, and their minutes) and the games table for the teams' games. The cube
+# and the summaries are written to the cache as parquet with the fingerprints of their sources, so reports and
+# dashboards read a few thousand rows instead of re-scanning the action tables.
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import load_data
+
+AGGREGATES_DIR = 'data/aggregates'
+
+KEYS = ['player_id', 'team_id', 'season_id']
+
+CUBE_KEYS = KEYS + ['end_pitch_zone', 'type_name_encoded']
+
+# summed columns of the cube -> prefix of their rates
+RATES = {'n_actions': 'actions', 'vaep_value': 'vaep', 'offensive_value': 'offensive',
+         'defensive_value': 'defensive', 'xT_value': 'xt'}
+
+VAEP_COLUMNS = ['game_id', 'player_id', 'team_id', 'end_pitch_zone', 'type_name_encoded', 'vaep_value',
+                'offensive_value', 'defensive_value']
+
+XT_COLUMNS = ['game_id', 'player_id', 'team_id', 'end_pitch_zone', 'type_name_encoded', 'xT_value']
+
+# the source tables, and the columns the aggregates need from them
+SOURCE_COLUMNS = {
+    'vaep': VAEP_COLUMNS, 'vaep_test': VAEP_COLUMNS,
+    'xt': XT_COLUMNS, 'xt_test': XT_COLUMNS,
+    'games': ['game_id', 'season_id', 'home_team_id', 'away_team_id'],
+    'games_test': ['game_id', 'season_id', 'home_team_id', 'away_team_id'],
+    'players': ['game_id', 'team_id', 'player_id', 'minutes_played'],
+    'players_test': ['game_id', 'team_id', 'player_id', 'minutes_played'],
+    }
+
+SUMMARIES = ['cube', 'players', 'teams', 'zones']
+
+
+def build_cube(tables):
+    """
+    Group the vaep and xt tables of both splits into the cube - one row per (player, team, season, end zone, action
+    type) with n_actions, vaep_value, offensive_value, defensive_value, n_xt_actions and xT_value
+
+    Inputs:
+    - tables:  anything indexable by table name holding vaep, vaep_test, xt, xt_test, games and games_test
+    """
+    games = _all_games(tables)
+    cubes = []
+    for table, aggregations in (('vaep', {'n_actions': ('vaep_value', 'size'), 'vaep_value': ('vaep_value', 'sum'),
+                                          'offensive_value': ('offensive_value', 'sum'),
+                                          'defensive_value': ('defensive_value', 'sum')}),
+                                ('xt', {'n_xt_actions': ('xT_value', 'size'), 'xT_value': ('xT_value', 'sum')})):
+        parts = []
+        for name in (table, f'{table}_test'):
+            df = tables[name]
+            df = df[[col for col in SOURCE_COLUMNS[name] if col != 'game_id']].assign(
+                season_id=_season_ids(df['game_id'], games))
+            parts.append(df.groupby(CUBE_KEYS, observed=True).agg(**aggregations))
+        cubes.append(pd.concat(parts).groupby(level=CUBE_KEYS, observed=True).sum())
+
+    cube = cubes[0].join(cubes[1], how='outer').fillna(0)
+    for col in ('n_actions', 'n_xt_actions'):
+        cube[col] = cube[col].astype(np.int64)
+    return cube.reset_index()
+
+
+def appearances(tables):
+    """
+    Games played (minutes_played > 0) and minutes of every player, per (player, team, season) - from the players tables
+    """
+    games = _all_games(tables)
+    players = pd.concat([tables['players'][SOURCE_COLUMNS['players']],
+                         tables['players_test'][SOURCE_COLUMNS['players_test']]], ignore_index=True)
+    players = players[players['minutes_played'] > 0]
+    players = players.assign(season_id=_season_ids(players['game_id'], games))
+    return players.groupby(KEYS).agg(games=('game_id', 'nunique'), minutes=('minutes_played', 'sum'))
+
+
+def team_games(tables):
+    """
+    Games of every team per season, from the games tables
+    """
+    games = _all_games(tables)
+    sides = pd.concat([games[['season_id', 'home_team_id']].rename(columns={'home_team_id': 'team_id'}),
+                       games[['season_id', 'away_team_id']].rename(columns={'away_team_id': 'team_id'})])
+    return sides.groupby(['team_id', 'season_id']).size().rename('games')
+
+
+def player_summary(cube, player_appearances):
+    """
+    One row per (player, team, season): games, minutes, the totals, their per game and per 90 rates, and the share of
+    each action type (action_<type>) and end zone (end_<zone>) in the player's actions
+    """
+    summary = _summary(cube, KEYS).join(player_appearances, how='left')
+    for col, prefix in RATES.items():
+        summary[f'{prefix}_per_game'] = summary[col] / summary['games']
+        summary[f'{prefix}_per_90'] = summary[col] / summary['minutes'] * 90
+    return summary
+
+
+def team_summary(cube, games):
+    """
+    One row per (team, season): games, the totals, their per game rates and the action type / end zone shares
+    """
+    summary = _summary(cube, ['team_id', 'season_id']).join(games, how='left')
+    for col, prefix in RATES.items():
+        summary[f'{prefix}_per_game'] = summary[col] / summary['games']
+    return summary
+
+
+def zone_summary(cube, keys=('team_id', 'season_id')):
+    """
+    One row per end zone of every team season (or of any keys of the cube, e.g. KEYS for the players): the totals, the
+    mean vaep / xT of the actions ending there and the zone's share of the actions
+    """
+    keys = list(keys)
+    summary = cube.groupby(keys + ['end_pitch_zone'], observed=True)[_value_columns(cube)].sum()
+    summary['vaep_mean'] = summary['vaep_value'] / summary['n_actions']
+    summary['xt_mean'] = summary['xT_value'] / summary['n_xt_actions']
+    summary['share'] = summary['n_actions'] / summary.groupby(level=keys, observed=True)['n_actions'].transform('sum')
+    return summary
+
+
+def build_summaries(tables):
+    """
+    Returns {'cube', 'players', 'teams', 'zones'} DataFrames for the tables (see build_cube)
+    """
+    cube = build_cube(tables)
+    return {
+        'cube': cube,
+        'players': player_summary(cube, appearances(tables)),
+        'teams': team_summary(cube, team_games(tables)),
+        'zones': zone_summary(cube),
+        }
+
+
+def load_summaries(mode='local', cache_dir=AGGREGATES_DIR, check='mtime'):
+    """
+    The summaries of the project tables, from the cache when none of the source tables changed - otherwise the
+    columns the aggregates need are read from the sources and the cache is rebuilt
+
+    Inputs:
+    - mode:       's3', 'local' or 'partitioned', as in load_data
+    - cache_dir:  where the summaries are written
+    - check:      how the local sources are compared with the cache, 'mtime' or 'hash' (see load_data) - the s3
+                  sources are compared by ETag, through the s3_loader.py cache
+
+    Returns {'cube', 'players', 'teams', 'zones'} DataFrames
+    """
+    # in s3 mode the objects are checked (and only downloaded when their ETag changed) concurrently
+    with ThreadPoolExecutor(max_workers=len(SOURCE_COLUMNS)) as pool:
+        resolved = dict(zip(SOURCE_COLUMNS, pool.map(lambda table: load_data._resolve(mode, table, check),
+                                                     SOURCE_COLUMNS)))
+    sources = {table: source for table, (source, path, fingerprint) in resolved.items()}
+    fingerprints = {table: fingerprint for table, (source, path, fingerprint) in resolved.items()}
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    meta = {'sources': sources, 'fingerprints': fingerprints}
+
+    trusted = all(fingerprint is not None for fingerprint in fingerprints.values())
+    if trusted and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return {name: pd.read_parquet(os.path.join(cache_dir, f'{name}.parquet')) for name in SUMMARIES}
+
+    # only the columns of the aggregates are parsed
+    tables = {table: load_data._read(path, usecols=SOURCE_COLUMNS[table]) for table, (source, path, fingerprint)
+              in resolved.items()}
+    summaries = build_summaries(tables)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, df in summaries.items():
+        path = os.path.join(cache_dir, f'{name}.parquet')
+        df.to_parquet(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    if trusted:
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    return summaries
+
+
+def _summary(cube, keys):
+    # totals per keys, and the action type / end zone shares of the actions
+    totals = cube.groupby(keys, observed=True)[_value_columns(cube)].sum()
+    for col, prefix in (('type_name_encoded', 'action'), ('end_pitch_zone', 'end')):
+        counts = cube.groupby(keys + [col], observed=True)['n_actions'].sum().unstack(fill_value=0)
+        shares = counts.div(counts.sum(axis=1), axis=0)
+        shares.columns = [f'{prefix}_{value}' for value in shares.columns]
+        totals = totals.join(shares.sort_index(axis=1))
+    return totals
+
+
+def _value_columns(cube):
+    return [col for col in cube.columns if col not in CUBE_KEYS]
+
+
+def _all_games(tables):
+    games = pd.concat([tables['games'], tables['games_test']], ignore_index=True)
+    return games.drop_duplicates('game_id')
+
+
+def _season_ids(game_ids, games):
+    # -1 for games missing from the games tables
+    return game_ids.map(games.set_index('game_id')['season_id']).fillna(-1).astype(np.int64).to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--cache-dir', default=AGGREGATES_DIR)
+    parser.add_argument('--check', default='mtime', choices=['mtime', 'hash'])
+    parser.add_argument('--top', type=int, default=10, help='players with the most vaep per 90 to print')
+    args = parser.parse_args()
+
+    summaries = load_summaries(args.mode, args.cache_dir, args.check)
+    players = summaries['players']
+    regulars = players[players['minutes'] >= 270]
+    columns = ['games', 'minutes', 'n_actions', 'vaep_per_game', 'vaep_per_90', 'xt_per_game', 'xt_per_90']
+    print(regulars.sort_values('vaep_per_90', ascending=False)[columns].head(args.top).round(3).to_string())
+    print(', '.join(f'{name}: {len(df):,} rows' for name, df in summaries.items()))
+
+
+if __name__ == '__main__':
+    main()
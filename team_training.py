@@ -0,0 +1,367 @@
+# team training - the four Notebook 6 pipelines (vaep, xt, action, end) for many clubs in one pass, on a process pool
+#
+#   python team_training.py --teams all --out-dir models --jobs 8
+#
+# the vaep / xt frames are written once to uncompressed Arrow IPC files that every worker memory-maps, so the full
+# frames are never pickled to the workers - each (team, mode) job only receives the row positions of its slice.
+#
+# with --shared, the vaep, action and end models of a team are one job: the team's slice is read once, the union of
+# the three modes' features is transformed once (ppu.SharedColumnTransformer) and the three models are fitted on their
+# column masks of that matrix in parallel threads - the same models and predictions as the separate jobs.
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import sklearn
+import xgboost as xgb
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import LabelEncoder
+
+import load_data
+import pre_processing_utils as ppu
+
+TEAM_MODES = ['team-vaep', 'team-xt', 'team-action', 'team-end']
+
+# the final models of Notebook 6
+FINAL_MODELS = {
+    'team-vaep': (xgb.XGBRegressor, {'max_depth': 8, 'gamma': 0.01, 'reg_alpha': 1.1, 'eta': 0.1}),
+    'team-xt': (xgb.XGBRegressor, {'max_depth': 5, 'reg_lambda': 200}),
+    'team-action': (xgb.XGBClassifier, {'max_depth': 3, 'eta': 0.3, 'gamma': 0.01}),
+    'team-end': (xgb.XGBClassifier, {'max_depth': 3, 'eta': 0.3, 'gamma': 0.01}),
+    }
+
+# the team modes trained on the same rows (the create_team_data slice of the vaep frame), trained as one job by
+# train_teams(shared=True)
+SHARED_MODES = ['team-vaep', 'team-action', 'team-end']
+
+MODELS_DIR = 'models'
+
+# the memory-mapped frames, opened once per worker process
+_frames = None
+
+
+def make_team_pipeline(mode, n_jobs=None):
+    """
+    Returns the unfitted Notebook 6 pipeline for a team mode: make_pipeline(column transformer, final XGBoost model)
+    """
+    model_class, params = FINAL_MODELS[mode]
+    return make_pipeline(ppu.make_ct(mode), model_class(n_jobs=n_jobs, **params))
+
+
+def train_teams(tables, team_ids, modes=TEAM_MODES, out_dir=MODELS_DIR, version=None, n_jobs=None, threads_per_job=1,
+                shared=False):
+    """
+    Train the Notebook 6 pipelines for every (team, mode) pair and write them as versioned artifacts:
+
+        <out_dir>/<version>/<team_id>/<mode>.joblib
+        <out_dir>/<version>/summary.csv       one row per job - rows, timings, test score
+        <out_dir>/<version>/manifest.json     teams, modes, models and library versions
+
+    Inputs:
+    - tables:           anything indexable by table name holding vaep, vaep_test, xt and xt_test, e.g.
+                        load_data.load_tables('local') - only the tables the modes need are read
+    - team_ids:         the teams to train
+    - modes:            the team modes to train for every team
+    - out_dir:          root directory of the model versions
+    - version:          version name, defaults to the current timestamp
+    - n_jobs:           number of worker processes, defaults to the number of cpus
+    - threads_per_job:  n_jobs of each XGBoost model - keep at 1 unless there are fewer jobs than workers
+    - shared:           train the SHARED_MODES of a team as one job on a shared transformed matrix (train_shared_job) -
+                        the cpus not used by the workers fit the job's models in parallel, e.g. n_jobs=cpus/3
+
+    Returns the summary DataFrame
+    """
+    unknown = [mode for mode in modes if mode not in FINAL_MODELS]
+    if unknown:
+        raise ValueError(f'modes must be in {TEAM_MODES}, got {unknown}')
+
+    version = version or time.strftime('%Y%m%d-%H%M%S')
+    version_dir = os.path.join(out_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    table_names = sorted({ppu.MODE_TABLES[mode] for mode in modes})
+    frame_dir = tempfile.mkdtemp(prefix='team_training_')
+    try:
+        # write the frames for the workers and find every team's rows, once per table
+        paths = {}
+        jobs = []
+        for table in table_names:
+            data = ppu.PreparedData(tables[table], tables[f'{table}_test'])
+            for name, df in ((table, data.train_df), (f'{table}_test', data.test_df)):
+                paths[name] = os.path.join(frame_dir, f'{name}.arrow')
+                _write_frame(df, paths[name])
+
+            table_modes = [mode for mode in modes if ppu.MODE_TABLES[mode] == table]
+            shared_modes = [mode for mode in table_modes if shared and mode in SHARED_MODES]
+            for team_id in team_ids:
+                train_positions, test_positions = data.team_positions('team_id', team_id)
+                if len(shared_modes) > 1:
+                    jobs.append((team_id, shared_modes, train_positions, test_positions))
+                for mode in table_modes:
+                    if len(shared_modes) < 2 or mode not in shared_modes:
+                        jobs.append((team_id, mode, train_positions, test_positions))
+
+        # largest jobs first, so a big club is not left running on its own at the end
+        jobs.sort(key=lambda job: len(job[2]), reverse=True)
+
+        # the cpus left over by the workers go to the threads fitting a shared job's models
+        mode_threads = max(1, min(len(SHARED_MODES), (os.cpu_count() or 1) // (n_jobs or os.cpu_count() or 1)))
+
+        summary = []
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_open_frames, initargs=(paths,)) as pool:
+            futures = [pool.submit(train_shared_job, team_id, mode, train_positions, test_positions, version_dir,
+                                   threads_per_job, mode_threads)
+                       if isinstance(mode, list) else
+                       pool.submit(train_job, team_id, mode, train_positions, test_positions, version_dir,
+                                   threads_per_job)
+                       for team_id, mode, train_positions, test_positions in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                summary += result if isinstance(result, list) else [result]
+    finally:
+        shutil.rmtree(frame_dir)
+
+    summary = pd.DataFrame(summary).sort_values(['team_id', 'mode']).reset_index(drop=True)
+    summary.to_csv(os.path.join(version_dir, 'summary.csv'), index=False)
+
+    manifest = {
+        'version': version,
+        'team_ids': [_native(team_id) for team_id in team_ids],
+        'modes': list(modes),
+        'models': {mode: [model_class.__name__, params] for mode, (model_class, params) in FINAL_MODELS.items()
+                   if mode in modes},
+        'libraries': {'python': platform.python_version(), 'pandas': pd.__version__,
+                      'scikit-learn': sklearn.__version__, 'xgboost': xgb.__version__},
+        }
+    with open(os.path.join(version_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return summary
+
+
+def train_job(team_id, mode, train_positions, test_positions, version_dir, threads_per_job=1):
+    """
+    Fit one team's pipeline for one mode on its slice of the memory-mapped frames and write the artifact. Runs in the
+    worker processes.
+
+    Returns the job's summary row as a dict
+    """
+    table = ppu.MODE_TABLES[mode]
+    target = ppu.MODE_TARGETS[mode]
+
+    start = time.perf_counter()
+    train_set = _frames[table].take(pa.array(train_positions)).to_pandas()
+    test_set = _frames[f'{table}_test'].take(pa.array(test_positions)).to_pandas()
+    X_train, y_train = train_set.drop(columns=[target]), train_set[target]
+    X_test, y_test = test_set.drop(columns=[target]), test_set[target]
+    slice_seconds = time.perf_counter() - start
+
+    # string labels (the end pitch zones) are encoded for the classifier, and decoded again by predict
+    label_encoder = None
+    if FINAL_MODELS[mode][0] is xgb.XGBClassifier:
+        label_encoder = LabelEncoder().fit(y_train)
+        y_train = label_encoder.transform(y_train)
+
+    start = time.perf_counter()
+    pipeline = make_team_pipeline(mode, n_jobs=threads_per_job)
+    pipeline.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    artifact = {
+        'pipeline': pipeline,
+        'classes': None if label_encoder is None else label_encoder.classes_,
+        'team_id': _native(team_id),
+        'mode': mode,
+        'target': target,
+        'n_train': len(X_train),
+        }
+
+    start = time.perf_counter()
+    test_score = _score(artifact, y_test, predict(artifact, X_test) if len(X_test) else None)
+    score_seconds = time.perf_counter() - start
+
+    path = write_artifact(artifact, version_dir)
+
+    return {
+        'team_id': _native(team_id),
+        'mode': mode,
+        'n_train': len(X_train),
+        'n_test': len(X_test),
+        # R^2 for the regressors, accuracy for the classifiers
+        'test_score': test_score,
+        'slice_seconds': slice_seconds,
+        'fit_seconds': fit_seconds,
+        'score_seconds': score_seconds,
+        'pid': os.getpid(),
+        'path': path,
+        }
+
+
+def train_shared_job(team_id, modes, train_positions, test_positions, version_dir, threads_per_job=1, mode_threads=1):
+    """
+    Fit one team's pipelines for several SHARED_MODES from one shared transformed matrix and write an artifact per
+    mode, the same as train_job writes for each of them. With mode_threads > 1 the models are fitted in parallel
+    threads (XGBoost releases the GIL while training). Runs in the worker processes.
+
+    Returns the summary rows of the modes, as a list of dicts
+    """
+    table = ppu.MODE_TABLES[modes[0]]
+
+    start = time.perf_counter()
+    train_set = _frames[table].take(pa.array(train_positions)).to_pandas()
+    test_set = _frames[f'{table}_test'].take(pa.array(test_positions)).to_pandas()
+    slice_seconds = time.perf_counter() - start
+
+    # the other modes' targets are in the union of the features, the masks keep each mode to its own columns
+    start = time.perf_counter()
+    shared = ppu.SharedColumnTransformer(modes)
+    train_blocks = shared.fit_blocks(train_set)
+    test_blocks = shared.transform_blocks(test_set) if len(test_set) else None
+    transform_seconds = time.perf_counter() - start
+
+    def fit(mode):
+        target = ppu.MODE_TARGETS[mode]
+        model_class, params = FINAL_MODELS[mode]
+        y_train = train_set[target]
+
+        label_encoder = None
+        if model_class is xgb.XGBClassifier:
+            label_encoder = LabelEncoder().fit(y_train)
+            y_train = label_encoder.transform(y_train)
+
+        start = time.perf_counter()
+        model = model_class(n_jobs=threads_per_job, **params)
+        model.fit(shared.select(train_blocks, mode), y_train)
+        fit_seconds = time.perf_counter() - start
+
+        artifact = {
+            'pipeline': make_pipeline(shared.mode_transformer(mode), model),
+            'classes': None if label_encoder is None else label_encoder.classes_,
+            'team_id': _native(team_id),
+            'mode': mode,
+            'target': target,
+            'n_train': len(train_set),
+            }
+
+        start = time.perf_counter()
+        y_pred = None
+        if test_blocks is not None:
+            y_pred = _decode(artifact, model.predict(shared.select(test_blocks, mode)))
+        test_score = _score(artifact, test_set[target], y_pred)
+        score_seconds = time.perf_counter() - start
+
+        return {
+            'team_id': _native(team_id),
+            'mode': mode,
+            'n_train': len(train_set),
+            'n_test': len(test_set),
+            'test_score': test_score,
+            'slice_seconds': slice_seconds,
+            'fit_seconds': fit_seconds,
+            'score_seconds': score_seconds,
+            # the shared transformer fit and transforms, once for all the modes of the job
+            'transform_seconds': transform_seconds,
+            'pid': os.getpid(),
+            'path': write_artifact(artifact, version_dir),
+            }
+
+    with ThreadPoolExecutor(max_workers=min(mode_threads, len(modes))) as pool:
+        return list(pool.map(fit, modes))
+
+
+def load_artifact(out_dir, version, team_id, mode):
+    """
+    Returns the artifact written by train_teams - a dict with the fitted 'pipeline' and, for the classifiers, the
+    'classes' its predictions are indices into
+    """
+    return joblib.load(os.path.join(out_dir, version, str(team_id), f'{mode}.joblib'))
+
+
+def predict(artifact, X):
+    """
+    Predict with an artifact, decoding the classifier labels back to the original values
+    """
+    return _decode(artifact, artifact['pipeline'].predict(X))
+
+
+def write_artifact(artifact, version_dir):
+    """
+    Write an artifact to <version_dir>/<team_id>/<mode>.joblib, where load_artifact finds it - returns the path
+    """
+    path = os.path.join(version_dir, str(artifact['team_id']), f"{artifact['mode']}.joblib")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(artifact, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _decode(artifact, y_pred):
+    if artifact['classes'] is not None:
+        y_pred = np.asarray(artifact['classes'])[np.asarray(y_pred, dtype=int)]
+    return y_pred
+
+
+def _score(artifact, y_test, y_pred):
+    # R^2 for the regressors, accuracy for the classifiers - NaN without test rows
+    if y_pred is None:
+        return np.nan
+    if artifact['classes'] is None:
+        return r2_score(y_test, y_pred)
+    return accuracy_score(y_test, y_pred)
+
+
+def _write_frame(df, path):
+    # uncompressed, so the workers can memory-map the columns instead of reading them
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _open_frames(paths):
+    global _frames
+    _frames = {name: pa.ipc.open_file(pa.memory_map(path, 'r')).read_all() for name, path in paths.items()}
+
+
+def _native(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--teams', nargs='+', required=True, help="team ids to train, or 'all'")
+    parser.add_argument('--modes', nargs='+', default=TEAM_MODES, choices=TEAM_MODES)
+    parser.add_argument('--out-dir', default=MODELS_DIR)
+    parser.add_argument('--version', default=None)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--threads-per-job', type=int, default=1)
+    parser.add_argument('--shared', action='store_true',
+                        help='train the vaep, action and end models of a team on one shared transformed matrix')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+    if args.teams == ['all']:
+        team_ids = sorted(tables.vaep['team_id'].unique())
+    else:
+        team_ids = [int(team_id) for team_id in args.teams]
+
+    start = time.perf_counter()
+    summary = train_teams(tables, team_ids, args.modes, args.out_dir, args.version, args.jobs, args.threads_per_job,
+                          args.shared)
+    print(summary.to_string(index=False))
+    print(f'{len(summary)} models in {time.perf_counter() - start:.1f}s '
+          f'({summary["fit_seconds"].sum():.1f}s of fitting)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# add_opponent_and_home against the Notebook 2 comprehensions
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_engineering
+
+
+def notebook_opponent_and_home(df_actions_zones, df_games):
+    # the Notebook 2 cell, df_games is indexed by game_id
+    matches = list(df_actions_zones['game_id'].unique())
+    match_teams = {match: list(df_actions_zones[df_actions_zones['game_id'] == match]['team_id'].unique()) for match in matches}
+    opponent_id = [match_teams[k][1] if match_teams[k][0] == row['team_id'] else match_teams[k][0] \
+        for i, row in df_actions_zones.iterrows() \
+            for k, v in match_teams.items() \
+                if row['game_id'] == k]
+    home = [1 if np.array(df_games[df_games.index == row['game_id']]['home_team_id'] == row['team_id'])[0] \
+        else 0 for i, row in df_actions_zones.iterrows() \
+            for match in matches if row['game_id'] == match]
+    return opponent_id, home
+
+
+def games():
+    return pd.DataFrame({
+        'game_id': [10, 11, 12],
+        'season_id': [42, 42, 90],
+        'home_team_id': [1, 3, 2],
+        'away_team_id': [2, 1, 4],
+        }).set_index('game_id')
+
+
+def actions():
+    # game 11 starts with an action of the away team, and the games are interleaved
+    return pd.DataFrame({
+        'game_id': [10, 10, 11, 11, 10, 12, 11, 12, 12, 10],
+        'team_id': [1, 2, 1, 3, 1, 4, 1, 2, 4, 2],
+        'player_id': range(10),
+        }, index=[5, 3, 8, 0, 1, 9, 2, 7, 4, 6])
+
+
+def test_matches_notebook():
+    df = actions()
+    opponent_id, home = notebook_opponent_and_home(df, games())
+    result = feature_engineering.add_opponent_and_home(df.copy(), games())
+    assert list(result['opponent_id']) == opponent_id
+    assert list(result['home']) == home
+    # the index and the row order are kept
+    assert list(result.index) == list(df.index)
+
+
+def test_game_id_column():
+    by_index = feature_engineering.add_opponent_and_home(actions(), games())
+    by_column = feature_engineering.add_opponent_and_home(actions(), games().reset_index())
+    pd.testing.assert_frame_equal(by_index, by_column)
+
+
+def test_concatenated_games_tables():
+    # the same fixture in both tables is only counted once
+    df_games = pd.concat([games(), games().loc[[12]]])
+    result = feature_engineering.add_opponent_and_home(actions(), df_games)
+    opponent_id, home = notebook_opponent_and_home(actions(), games())
+    assert list(result['opponent_id']) == opponent_id
+    assert list(result['home']) == home
+
+
+def test_missing_game():
+    df = actions()
+    df.loc[df.index[0], 'game_id'] = 99
+    with pytest.raises(ValueError, match='99'):
+        feature_engineering.add_opponent_and_home(df, games())
@@ -0,0 +1,88 @@
+# the registry round trip of the chunked_training artifacts
+import numpy as np
+import pandas as pd
+import pytest
+
+import chunked_training
+import feature_engineering
+import model_registry
+import pitch_zones
+import team_training
+
+TEAM_ID = 965
+
+
+def vaep_table(n_games=4, n_actions=150, seed=0):
+    # a small vaep table built with the Notebook 2 feature steps, the team plays at home in every game
+    rng = np.random.default_rng(seed)
+    games = pd.DataFrame({
+        'game_id': np.arange(n_games) + 1,
+        'season_id': 42,
+        'home_team_id': TEAM_ID,
+        'away_team_id': 100 + np.arange(n_games),
+        })
+    frames = []
+    for game in games.itertuples():
+        frames.append(pd.DataFrame({
+            'game_id': game.game_id,
+            'original_event_id': [f'{game.game_id}-{i}' for i in range(n_actions)],
+            'period_id': 1,
+            'time_seconds': np.sort(rng.uniform(0, 2700, n_actions)),
+            'team_id': rng.choice([game.home_team_id, game.away_team_id], n_actions),
+            'player_id': rng.integers(1, 12, n_actions),
+            'start_x': rng.uniform(0, 105, n_actions),
+            'start_y': rng.uniform(0, 68, n_actions),
+            'end_x': rng.uniform(0, 105, n_actions),
+            'end_y': rng.uniform(0, 68, n_actions),
+            'type_id': 0,
+            'result_id': 1,
+            'bodypart_id': 0,
+            'action_id': np.arange(n_actions),
+            'type_name': rng.choice(['pass', 'dribble', 'shot', 'cross'], n_actions),
+            'result_name': rng.choice(['success', 'fail'], n_actions),
+            'bodypart_name': rng.choice(['foot', 'head'], n_actions),
+            'offensive_value': rng.normal(0, 0.01, n_actions),
+            'defensive_value': rng.normal(0, 0.001, n_actions),
+            }))
+    df = pd.concat(frames, ignore_index=True)
+    # a value that depends on the features, so the regression trees split
+    df['offensive_value'] += 0.001 * df['end_x']
+    df['vaep_value'] = df['offensive_value'] + df['defensive_value']
+    pitch_zones.add_pitch_zones(df)
+    feature_engineering.add_opponent_and_home(df, games)
+    return feature_engineering.build_context_features(df)
+
+
+@pytest.fixture(scope='module')
+def table(tmp_path_factory):
+    path = tmp_path_factory.mktemp('data') / 'vaep.parquet'
+    df = vaep_table()
+    df.to_parquet(path)
+    return str(path), df
+
+
+@pytest.mark.parametrize('mode', ['team-vaep', 'team-action', 'team-end'])
+def test_chunked_artifact_round_trip(table, tmp_path, mode):
+    path, df = table
+    artifact = chunked_training.train_team_chunked(path, TEAM_ID, mode, batch_size=200)
+    # the layout team_training writes, exported as a version
+    team_training.write_artifact(artifact, str(tmp_path / 'models' / 'v1'))
+    exported = model_registry.export_version(str(tmp_path / 'models'), 'v1')
+    assert [(row['team_id'], row['mode']) for row in exported] == [(TEAM_ID, mode)]
+
+    loaded = model_registry.load_artifact(str(tmp_path / 'models' / 'v1' / 'registry'), TEAM_ID, mode)
+    X = df[df['team_id'] == TEAM_ID].dropna().drop(columns=[artifact['target']])
+    expected = team_training.predict(artifact, X)
+    result = team_training.predict(loaded, X)
+    if artifact['classes'] is None:
+        assert np.ptp(expected) > 0
+        np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+    else:
+        assert list(result) == list(expected)
+
+
+def test_sgd_artifact_is_rejected(table, tmp_path):
+    path, _ = table
+    artifact = chunked_training.train_team_chunked(path, TEAM_ID, 'team-vaep', model='sgd', batch_size=200)
+    with pytest.raises(ValueError, match='not an XGBoost model'):
+        model_registry.save_artifact(artifact, str(tmp_path))
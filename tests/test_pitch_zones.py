@@ -0,0 +1,73 @@
+# assign_zones against the if/elif chain from Notebook 2
+import numpy as np
+import pandas as pd
+
+import pitch_zones
+
+
+def notebook_zones(df, x, y):
+    # the Notebook 2 loop, with start_x / start_y swapped for the given columns
+    zones = []
+    for i, row in df.iterrows():
+        if ((row[x] >=0) & (row[x] < 35)) & ((row[y]>=0) & (row[y] < 23)):
+            zones.append('zone_1')
+        elif ((row[x] >=0) & (row[x] < 35)) & ((row[y]>=23) & (row[y] < 46)):
+            zones.append('zone_2')
+        elif ((row[x] >=0) & (row[x] < 35)) & ((row[y]>=46) & (row[y] <= 69)):
+            zones.append('zone_3')
+        elif ((row[x] >=35) & (row[x] < 70)) & ((row[y]>=0) & (row[y] < 23)):
+            zones.append('zone_4')
+        elif ((row[x] >=35) & (row[x] < 70)) & ((row[y]>=23) & (row[y] < 46)):
+            zones.append('zone_5')
+        elif ((row[x] >=35) & (row[x] < 70)) & ((row[y]>=46) & (row[y] <= 69)):
+            zones.append('zone_6')
+        elif ((row[x] >=70) & (row[x] <= 105)) & ((row[y]>=0) & (row[y] < 23)):
+            zones.append('zone_7')
+        elif ((row[x] >=70) & (row[x] <= 105)) & ((row[y]>=23) & (row[y] < 46)):
+            zones.append('zone_8')
+        elif ((row[x] >=70) & (row[x] <= 105)) & ((row[y]>=46) & (row[y] <= 69)):
+            zones.append('zone_9')
+        else:
+            zones.append('no_zone')
+    return zones
+
+
+def actions():
+    # every edge and just either side of it on both axes, plus missing and off-pitch coordinates
+    xs = [-0.1, 0, 0.5, 34.999, 35, 35.001, 69.999, 70, 104.999, 105, 105.001, np.nan]
+    ys = [-0.1, 0, 22.999, 23, 45.999, 46, 68.999, 69, 69.001, np.nan]
+    start_x, start_y = (a.ravel() for a in np.meshgrid(xs, ys))
+    df = pd.DataFrame({'start_x': start_x, 'start_y': start_y})
+    # the end coordinates are the same points in a different order
+    rng = np.random.default_rng(0)
+    df['end_x'] = rng.permutation(df['start_x'].to_numpy())
+    df['end_y'] = rng.permutation(df['start_y'].to_numpy())
+    return df
+
+
+def test_assign_zones_matches_notebook():
+    df = actions()
+    labels = pitch_zones.assign_zones(df['start_x'], df['start_y'])
+    assert list(labels) == notebook_zones(df, 'start_x', 'start_y')
+
+
+def test_closed_upper_edge():
+    labels = pitch_zones.assign_zones([105, 105, 0, 105, 105.001], [69, 0, 69, 23, 69])
+    assert list(labels) == ['zone_9', 'zone_7', 'zone_3', 'zone_8', 'no_zone']
+
+
+def test_missing_coordinates():
+    labels = pitch_zones.assign_zones([np.nan, 50, np.nan], [30, np.nan, np.nan])
+    assert list(labels) == ['no_zone'] * 3
+
+
+def test_add_pitch_zones_matches_notebook():
+    df = pitch_zones.add_pitch_zones(actions())
+    assert list(df['start_pitch_zone']) == notebook_zones(df, 'start_x', 'start_y')
+    assert list(df['end_pitch_zone']) == notebook_zones(df, 'end_x', 'end_y')
+
+
+def test_custom_grid():
+    x_edges, y_edges = pitch_zones.zone_edges(n_x=2, n_y=1)
+    labels = pitch_zones.assign_zones([0, 52.5, 105, 106], [10, 69, 0, 10], x_edges, y_edges)
+    assert list(labels) == ['zone_1', 'zone_2', 'zone_2', 'no_zone']
@@ -0,0 +1,145 @@
+# transfer scoring - the Notebook 6 transfer prediction for every target player against every candidate club
+#
+#   python transfer_scoring.py --models-dir models --version 20230101-120000 --out data/transfer_scores.csv
+#
+# the pre-transfer actions of all the candidate players are stacked into one matrix per table, and each club's four
+# pipelines (trained by team_training.py) predict on it in one call per mode, instead of one call per player.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import load_data
+import model_registry
+import pre_processing_utils as ppu
+import team_training
+
+
+def load_team_models(models_dir, version, team_ids, modes=team_training.TEAM_MODES, registry=False):
+    """
+    Returns {team_id: {mode: artifact}} for the clubs' pipelines written by team_training.train_teams - with registry,
+    the compact copies model_registry.export_version wrote to <models_dir>/<version>/registry, which load much faster
+    """
+    if registry:
+        registry_dir = os.path.join(models_dir, version, model_registry.REGISTRY_DIR)
+        return {team_id: model_registry.load_team(registry_dir, team_id, modes) for team_id in team_ids}
+    return {team_id: {mode: team_training.load_artifact(models_dir, version, team_id, mode) for mode in modes}
+            for team_id in team_ids}
+
+
+def games_played(players):
+    """
+    Number of games each player appeared in (minutes_played > 0), from the players table
+
+    Returns a Series indexed by player_id
+    """
+    appearances = players[players['minutes_played'] > 0]
+    return appearances.groupby('player_id')['game_id'].nunique()
+
+
+def score_transfers(models, vaep_df, xt_df, player_ids, n_games=None, batch_size=None):
+    """
+    Predict every player's pre-transfer actions with every club's pipelines, and summarise them per (player, club) as
+    in Notebook 6: per game VAEP and xT, and the share of each predicted action type and end zone.
+
+    Inputs:
+    - models:      {team_id: {mode: artifact}}, as returned by load_team_models
+    - vaep_df:     the pre-transfer vaep table (modeling_train_df in Notebook 6)
+    - xt_df:       the pre-transfer xt table (modeling_xt_train_df)
+    - player_ids:  the candidate players, e.g. target_players['player_id']
+    - n_games:     games played per player (Series indexed by player_id) to normalise by, e.g. games_played(players) -
+                   defaults to the number of games the player has actions in
+    - batch_size:  predict in chunks of this many rows, to cap the memory of a transformed matrix - None predicts the
+                   whole matrix at once
+
+    Returns a DataFrame indexed by (player_id, team_id) with n_games, vaep_per_game, xt_per_game, action_<type> and
+    end_<zone> columns
+    """
+    player_ids = pd.Index(pd.unique(np.asarray(player_ids)))
+    stacked = {
+        'vaep': vaep_df[vaep_df['player_id'].isin(player_ids)],
+        'xt': xt_df[xt_df['player_id'].isin(player_ids)],
+        }
+    # row -> player code, so the per player sums are a bincount instead of a groupby
+    codes = {table: player_ids.get_indexer(df['player_id']) for table, df in stacked.items()}
+
+    if n_games is None:
+        n_games = stacked['vaep'].groupby('player_id')['game_id'].nunique()
+    games = n_games.reindex(player_ids).to_numpy(dtype=float)
+
+    results = []
+    for team_id, artifacts in models.items():
+        columns = {'n_games': games}
+
+        for mode, artifact in artifacts.items():
+            table = ppu.MODE_TABLES[mode]
+            y_pred = _predict(artifact['pipeline'], stacked[table], batch_size)
+
+            if artifact['classes'] is None:
+                name = 'vaep_per_game' if mode == 'team-vaep' else 'xt_per_game'
+                columns[name] = np.bincount(codes[table], weights=y_pred, minlength=len(player_ids)) / games
+            else:
+                # share of each predicted class, per player
+                prefix = 'action' if mode == 'team-action' else 'end'
+                classes = np.asarray(artifact['classes'])
+                counts = np.bincount(codes[table] * len(classes) + np.asarray(y_pred, dtype=int),
+                                     minlength=len(player_ids) * len(classes)).reshape(len(player_ids), len(classes))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    shares = counts / counts.sum(axis=1, keepdims=True)
+                for i, label in enumerate(classes):
+                    columns[f'{prefix}_{label}'] = shares[:, i]
+
+        team_result = pd.DataFrame(columns, index=player_ids)
+        team_result['team_id'] = team_id
+        results.append(team_result)
+
+    scores = pd.concat(results).rename_axis('player_id').set_index('team_id', append=True)
+
+    # classes a club never predicts are a 0 share, not missing - players without actions stay NaN
+    share_cols = [col for col in scores.columns if col.startswith(('action_', 'end_'))]
+    has_actions = np.isin(scores.index.get_level_values('player_id'), stacked['vaep']['player_id'].unique())
+    scores.loc[has_actions, share_cols] = scores.loc[has_actions, share_cols].fillna(0)
+
+    first_cols = [col for col in ['n_games', 'vaep_per_game', 'xt_per_game'] if col in scores.columns]
+    return scores[first_cols + sorted(share_cols)]
+
+
+def _predict(pipeline, X, batch_size):
+    # the raw predictions - class indices for the classifiers, decoded through the artifact's classes by the caller
+    if not len(X):
+        return np.zeros(0)
+    if batch_size is None or len(X) <= batch_size:
+        return pipeline.predict(X)
+    return np.concatenate([pipeline.predict(X.iloc[start:start + batch_size])
+                           for start in range(0, len(X), batch_size)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='local', choices=load_data.MODES)
+    parser.add_argument('--models-dir', default=team_training.MODELS_DIR)
+    parser.add_argument('--version', required=True)
+    parser.add_argument('--teams', nargs='+', type=int, default=None,
+                        help='candidate clubs, defaults to every club in the model version')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--registry', action='store_true', help='load the model_registry.py copies of the pipelines')
+    parser.add_argument('--out', required=True, help='csv file for the player x club scores')
+    args = parser.parse_args()
+
+    tables = load_data.load_tables(args.mode)
+
+    team_ids = args.teams
+    if team_ids is None:
+        summary = pd.read_csv(f'{args.models_dir}/{args.version}/summary.csv')
+        team_ids = sorted(summary['team_id'].unique())
+
+    models = load_team_models(args.models_dir, args.version, team_ids, registry=args.registry)
+    scores = score_transfers(models, tables.vaep, tables.xt, tables.target_players['player_id'],
+                             n_games=games_played(tables.players), batch_size=args.batch_size)
+    scores.to_csv(args.out)
+    print(f'{len(scores):,} player x club pairs written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
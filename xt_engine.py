@@ -0,0 +1,264 @@
+# xt engine - the Notebook 2 xT step (left to right play + ExpectedThreat fit) from per-season count matrices
+#
+# the left to right flip is one vectorised pass over all the games, and every season keeps its shot / goal / move
+# counts and its move transition counts as arrays on a fine base grid. New games only add to their season's counts,
+# and an xT model for any grid that divides the base grid (16 x 12 by default, or 8 x 6, 24 x 18, ...) is fitted from
+# the summed counts - without going back to the actions.
+#
+#   engine = XTEngine()
+#   engine.add_games(all_actions, games)
+#   xTModel = engine.fit(l=16, w=12)
+#   mov_actions = xthreat.get_successful_move_actions(engine.play_left_to_right(all_actions, games))
+#   mov_actions['xT_value'] = xTModel.predict(mov_actions)
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import socceraction.spadl.config as spadlconfig
+import socceraction.xthreat as xthreat
+
+# the base grid every supported grid size must divide - 48 x 36 covers 16 x 12, 8 x 6, 24 x 18, 12 x 9, 4 x 3, ...
+BASE_L = 48
+BASE_W = 36
+
+_SHOT = spadlconfig.actiontypes.index('shot')
+_MOVES = [spadlconfig.actiontypes.index(name) for name in ('pass', 'dribble', 'cross')]
+_SUCCESS = spadlconfig.results.index('success')
+
+
+def play_left_to_right(actions, games):
+    """
+    spadl.play_left_to_right for the actions of many games at once - the away team's actions are mirrored, so every
+    team attacks from left to right
+
+    Inputs:
+    - actions:  SPADL actions of any number of games
+    - games:    games table with home_team_id, game_id as a column or the index
+
+    Returns a new dataframe
+    """
+    fixtures = games.set_index('game_id') if 'game_id' in games.columns else games
+    home_team_id = actions['game_id'].map(fixtures['home_team_id'][~fixtures.index.duplicated()])
+    if home_team_id.isna().any():
+        raise ValueError('games table is missing game_id(s): '
+                         f'{sorted(actions.loc[home_team_id.isna(), "game_id"].unique())[:10]}')
+
+    away = (actions['team_id'] != home_team_id).to_numpy()
+    ltr_actions = actions.copy()
+    for col, size in (('start_x', spadlconfig.field_length), ('end_x', spadlconfig.field_length),
+                      ('start_y', spadlconfig.field_width), ('end_y', spadlconfig.field_width)):
+        values = actions[col].to_numpy(dtype=float)
+        ltr_actions[col] = np.where(away, size - values, values)
+    return ltr_actions
+
+
+class SeasonCounts:
+    """
+    The xT counts of one season on the base grid - cells numbered like socceraction's flat indexes (row w-1-y, col x)
+
+    - move:        number of move actions (pass, dribble, cross) starting in each cell
+    - shot:        number of shots taken from each cell
+    - goal:        number of goals scored from each cell
+    - transition:  sparse (start cell, end cell) counts of the successful moves
+    """
+
+    def __init__(self, base_l=BASE_L, base_w=BASE_W):
+        n_cells = base_l * base_w
+        self.base_l = base_l
+        self.base_w = base_w
+        self.move = np.zeros(n_cells, dtype=np.int64)
+        self.shot = np.zeros(n_cells, dtype=np.int64)
+        self.goal = np.zeros(n_cells, dtype=np.int64)
+        self.transition = sparse.csr_matrix((n_cells, n_cells), dtype=np.int64)
+        self.game_ids = set()
+
+    def add(self, ltr_actions):
+        """
+        Add the counts of (left to right) actions
+        """
+        n_cells = self.base_l * self.base_w
+        type_id = ltr_actions['type_id'].to_numpy()
+        result_id = ltr_actions['result_id'].to_numpy()
+        start = _cells(ltr_actions['start_x'], ltr_actions['start_y'], self.base_l, self.base_w)
+        end = _cells(ltr_actions['end_x'], ltr_actions['end_y'], self.base_l, self.base_w)
+
+        moves = np.isin(type_id, _MOVES)
+        shots = type_id == _SHOT
+        has_start = start >= 0
+
+        self.move += np.bincount(start[moves & has_start], minlength=n_cells)
+        self.shot += np.bincount(start[shots & has_start], minlength=n_cells)
+        self.goal += np.bincount(start[shots & has_start & (result_id == _SUCCESS)], minlength=n_cells)
+
+        successful = moves & (result_id == _SUCCESS) & has_start & (end >= 0)
+        self.transition = self.transition + sparse.csr_matrix(
+            (np.ones(successful.sum(), dtype=np.int64), (start[successful], end[successful])), shape=(n_cells, n_cells))
+
+        self.game_ids.update(ltr_actions['game_id'].unique().tolist())
+
+
+class XTEngine:
+    """
+    Per-season xT counts that grow game by game, and xT models fitted from them for any grid dividing the base grid.
+    fit(l=16, w=12) gives the same model as xthreat.ExpectedThreat(l=16, w=12).fit(actions_ltr) - a fitted
+    ExpectedThreat, so predict / rate / save_model work as before.
+    """
+
+    def __init__(self, base_l=BASE_L, base_w=BASE_W):
+        self.base_l = base_l
+        self.base_w = base_w
+        self.seasons = {}
+
+    def add_games(self, actions, games, ltr=False):
+        """
+        Add the actions of new games to their seasons' counts - games already added are skipped, so adding the same
+        games twice is harmless
+
+        Inputs:
+        - actions:  SPADL actions of any number of games
+        - games:    games table with season_id and home_team_id
+        - ltr:      the actions are already left to right (e.g. the vaep / xt tables), do not flip them
+
+        Returns the list of the game_ids added
+        """
+        fixtures = games.set_index('game_id') if 'game_id' in games.columns else games
+        fixtures = fixtures[~fixtures.index.duplicated()]
+
+        added = []
+        season_ids = actions['game_id'].map(fixtures['season_id'])
+        for season_id, season_actions in actions.groupby(season_ids.to_numpy(), sort=False):
+            counts = self.seasons.setdefault(season_id, SeasonCounts(self.base_l, self.base_w))
+            new = ~season_actions['game_id'].isin(counts.game_ids)
+            if not new.any():
+                continue
+
+            season_actions = season_actions[new]
+            counts.add(season_actions if ltr else play_left_to_right(season_actions, fixtures))
+            added += season_actions['game_id'].unique().tolist()
+        return added
+
+    def counts(self, l, w, season_ids=None):
+        """
+        The summed counts of the given seasons (all by default) on an l x w grid
+
+        Returns move, shot, goal (w x l arrays) and the (w*l x w*l) successful move transition counts
+        """
+        if self.base_l % l or self.base_w % w:
+            raise ValueError(f'the {l} x {w} grid does not divide the {self.base_l} x {self.base_w} base grid - '
+                             f'use an XTEngine with a base grid that is a multiple of it')
+
+        seasons = [self.seasons[season_id] for season_id in (self.seasons if season_ids is None else season_ids)]
+        if not seasons:
+            raise ValueError('no games added')
+
+        # base cell -> grid cell, as a sparse (base cells x grid cells) aggregation matrix
+        row, col = np.divmod(np.arange(self.base_l * self.base_w), self.base_l)
+        grid_cell = (row // (self.base_w // w)) * l + col // (self.base_l // l)
+        aggregate = sparse.csr_matrix((np.ones(len(grid_cell), dtype=np.int64), (np.arange(len(grid_cell)), grid_cell)),
+                                      shape=(len(grid_cell), l * w))
+
+        move = aggregate.T @ sum(counts.move for counts in seasons)
+        shot = aggregate.T @ sum(counts.shot for counts in seasons)
+        goal = aggregate.T @ sum(counts.goal for counts in seasons)
+        transition = aggregate.T @ sum(counts.transition for counts in seasons) @ aggregate
+
+        return move.reshape(w, l), shot.reshape(w, l), goal.reshape(w, l), transition.toarray()
+
+    def fit(self, l=16, w=12, season_ids=None, eps=1e-5):
+        """
+        Fit an l x w xT model on the counts of the given seasons (all by default)
+
+        Returns a fitted xthreat.ExpectedThreat
+        """
+        move, shot, goal, transition = self.counts(l, w, season_ids)
+
+        model = xthreat.ExpectedThreat(l=l, w=w, eps=eps)
+        model.scoring_prob_matrix = _safe_divide(goal, shot)
+        model.shot_prob_matrix = _safe_divide(shot, move + shot)
+        model.move_prob_matrix = _safe_divide(move, move + shot)
+        model.transition_matrix = _safe_divide(transition, move.reshape(-1, 1))
+
+        # the ExpectedThreat value iteration, with the four nested loops as one matrix-vector product
+        gs = model.scoring_prob_matrix * model.shot_prob_matrix
+        xT = np.zeros((w, l))
+        model.heatmaps = [xT.copy()]
+        diff = np.ones((w, l))
+        while np.any(diff > eps):
+            new_xT = gs + model.move_prob_matrix * (model.transition_matrix @ xT.ravel()).reshape(w, l)
+            diff = new_xT - xT
+            xT = new_xT
+            model.heatmaps.append(xT.copy())
+        model.xT = xT
+
+        return model
+
+    def save(self, path):
+        """
+        Save the per-season counts to a .npz file
+        """
+        arrays = {'base': np.array([self.base_l, self.base_w])}
+        for season_id, counts in self.seasons.items():
+            transition = counts.transition.tocoo()
+            arrays.update({
+                f'{season_id}/move': counts.move,
+                f'{season_id}/shot': counts.shot,
+                f'{season_id}/goal': counts.goal,
+                f'{season_id}/transition_row': transition.row,
+                f'{season_id}/transition_col': transition.col,
+                f'{season_id}/transition_count': transition.data,
+                f'{season_id}/game_ids': np.array(sorted(counts.game_ids)),
+                })
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an engine saved with save
+        """
+        with np.load(path) as arrays:
+            base_l, base_w = arrays['base'].tolist()
+            engine = cls(base_l, base_w)
+            n_cells = base_l * base_w
+            for name in arrays.files:
+                if not name.endswith('/move'):
+                    continue
+                key = name[:-len('/move')]
+                counts = SeasonCounts(base_l, base_w)
+                counts.move = arrays[f'{key}/move']
+                counts.shot = arrays[f'{key}/shot']
+                counts.goal = arrays[f'{key}/goal']
+                counts.transition = sparse.csr_matrix(
+                    (arrays[f'{key}/transition_count'], (arrays[f'{key}/transition_row'], arrays[f'{key}/transition_col'])),
+                    shape=(n_cells, n_cells))
+                counts.game_ids = set(arrays[f'{key}/game_ids'].tolist())
+                engine.seasons[_season_key(key)] = counts
+        return engine
+
+
+def _cells(x, y, l, w):
+    """
+    socceraction's flat cell index of each (x, y) on an l x w grid, -1 where a coordinate is missing
+    """
+    x = x.to_numpy(dtype=float)
+    y = y.to_numpy(dtype=float)
+    missing = np.isnan(x) | np.isnan(y)
+    x = np.where(missing, 0, x)
+    y = np.where(missing, 0, y)
+
+    # truncated like astype('int64') in socceraction, then clipped to the pitch
+    xi = np.clip((x / spadlconfig.field_length * l).astype(np.int64), 0, l - 1)
+    yj = np.clip((y / spadlconfig.field_width * w).astype(np.int64), 0, w - 1)
+    return np.where(missing, -1, (w - 1 - yj) * l + xi)
+
+
+def _safe_divide(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.broadcast_to(np.asarray(b, dtype=float), a.shape)
+    return np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+
+
+def _season_key(key):
+    try:
+        return int(key)
+    except ValueError:
+        return key